@@ -0,0 +1,83 @@
+"""Keeps recently played songs in memory, so going back to one is instant."""
+import os
+import threading
+
+from collections import OrderedDict
+
+from tracing import traced
+
+
+class AudioCache():
+    """The file contents of recently played songs, by path.
+
+    Songs are evicted least recently played first once their total size exceeds
+    max_bytes. Songs bigger than max_bytes are never cached.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """Initialises the AudioCache.
+
+        Args:
+            max_bytes (int, optional): Memory budget for cached songs. Defaults to 64 MiB.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+
+        self._songs: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, path: str) -> bool:
+        with self._lock:
+            return path in self._songs
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._songs)
+
+    def get(self, path: str) -> bytes | None:
+        """Returns a cached song and marks it as recently played, or None if it isn't cached."""
+        with self._lock:
+            data = self._songs.get(path)
+            if data is not None:
+                self._songs.move_to_end(path)
+            return data
+
+    def put(self, path: str, data: bytes):
+        """Caches a song, evicting the least recently played songs to stay within max_bytes."""
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._songs.pop(path, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._songs[path] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._songs.popitem(last=False)
+                self.size -= len(evicted)
+
+    @traced('AudioCache.load', 'player')
+    def load(self, path: str) -> bytes | None:
+        """Returns a song from the cache, reading and caching it if it isn't cached.
+
+        Returns:
+            bytes | None: The song's file contents, or None if it can't be read.
+        """
+        data = self.get(path)
+        if data is not None:
+            return data
+        try:
+            if os.path.getsize(path) > self.max_bytes:
+                return None
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+        self.put(path, data)
+        return data
+
+    def discard(self, path: str):
+        """Removes a song, e.g. when its file has been replaced."""
+        with self._lock:
+            data = self._songs.pop(path, None)
+            if data is not None:
+                self.size -= len(data)
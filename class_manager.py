@@ -4,8 +4,12 @@ import logging
 from textual.logging import TextualHandler
 
 from music_manager import MusicManager as mm
+from prewarm import PlaylistHistory, PlaylistWarmer
+from shared_cache import TieredCache
 from song_metadata import SongMetadataFile as sm
 from spotify import SpotifyClient as sc
+from thumbnails import ThumbnailCache
+from track import TrackStore
 
 class ClassManager():
     """A class to manage all the other classes used in spotdl-tui"""
@@ -14,7 +18,8 @@ class ClassManager():
         music_manager = None,
         song_metadata_file = sm(),
         spotify_client = sc(),
-        logger: logging.Logger = logging.getLogger()
+        logger: logging.Logger = logging.getLogger(),
+        shared_cache: TieredCache | None = None
         ):
 
         self.logger = logger
@@ -28,10 +33,16 @@ class ClassManager():
 
         self.song_metadata_file = song_metadata_file
         self.spotify_client = spotify_client
+        # Track records shared by every view
+        self.tracks = TrackStore()
+        # Album covers, shown when Pillow is installed
+        self.thumbnails = ThumbnailCache(logger=self.logger)
 
         if self.spotify_client is None:
             self.spotify_client = sc()
             self.spotify_client.authenticate()
+        if hasattr(self.spotify_client, 'tracks'):
+            self.spotify_client.tracks = self.tracks
 
         if logger is None:
             self.logger = logging.getLogger()
@@ -46,3 +57,64 @@ class ClassManager():
             self.logger.addHandler(handler)
 
         self.spotify_client.authenticate()
+
+        # Fetches every playlist in the background once the UI is up
+        self.playlist_history = PlaylistHistory()
+        self.playlist_warmer = PlaylistWarmer(self.spotify_client, self.song_metadata_file,
+                                              self.playlist_history, logger=self.logger)
+
+        if hasattr(self.music_manager, 'recordings'):
+            self.music_manager.recordings.lookup_isrc = self.lookup_isrc
+        if hasattr(self.music_manager, 'lookup_duration'):
+            self.music_manager.lookup_duration = self.lookup_duration
+        if hasattr(self.music_manager, 'post_processor'):
+            self.music_manager.post_processor.lookup_metadata = self.song_metadata_file.get_metadata
+            self.music_manager.post_processor.on_result = self.save_post_process_results
+
+        # Local cache, backed by Redis when SPOTDL_TUI_REDIS_URL is set
+        if shared_cache is None:
+            shared_cache = TieredCache.from_env(logger=self.logger)
+        self.shared_cache = shared_cache
+        for cached in (self.song_metadata_file, self.spotify_client):
+            if hasattr(cached, 'shared_cache'):
+                cached.shared_cache = self.shared_cache
+        if hasattr(self.music_manager, 'use_shared_cache'):
+            self.music_manager.use_shared_cache(self.shared_cache)
+
+    def lookup_isrc(self, track_id: str) -> str | None:
+        """Returns the ISRC of a track from the song metadata, downloading the
+        metadata if it is missing or was saved without an ISRC.
+
+        Args:
+            track_id (str): Spotify track ID.
+
+        Returns:
+            str | None: The ISRC, or None if Spotify doesn't have one.
+        """
+        metadata = self.song_metadata_file.get_metadata(track_id)
+        if metadata is None or 'isrc' not in metadata:
+            metadata = self.spotify_client.download_song_metadata(track_id)
+            if metadata is None:
+                return None
+            self.song_metadata_file.add_metadata((metadata['id'], metadata))
+        return metadata['isrc']
+
+    def lookup_duration(self, track_id: str) -> float | None:
+        """Returns the duration of a downloaded song in seconds, if post-processing has measured it."""
+        metadata = self.song_metadata_file.get_metadata(track_id)
+        return metadata.get('duration') if metadata is not None else None
+
+    def save_post_process_results(self, track_id: str, results: dict):
+        """Saves the results of post-processing a song (duration, loudness, ...)
+        with its metadata, downloading the metadata if it is missing.
+
+        Args:
+            track_id (str): Spotify track ID.
+            results (dict): Results from post_process.process_track.
+        """
+        if self.song_metadata_file.get_metadata(track_id) is None:
+            metadata = self.spotify_client.download_song_metadata(track_id)
+            if metadata is None:
+                return
+            self.song_metadata_file.add_metadata((metadata['id'], metadata))
+        self.song_metadata_file.update_metadata(track_id, results)
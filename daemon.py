@@ -0,0 +1,451 @@
+"""A headless daemon that owns playback, downloads and the caches, and the client
+used by the TUI to attach to it over a Unix socket.
+
+Run `python daemon.py` to start the daemon. When it is running, `main.py`
+attaches to it instead of starting its own MusicManager, so several frontends
+(including ones served through textual-serve) share one warm process.
+
+The protocol is newline-delimited JSON. Requests look like
+{"id": 1, "target": "music_manager", "method": "pause", "args": []} and are
+answered with {"id": 1, "result": ..., "state": {...}} or {"id": 1, "error": "..."}.
+The daemon also pushes {"event": "song-change", "delta": {...}, "state": {...}}
+messages to every connected client.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import struct
+import threading
+
+from collections.abc import Callable
+
+import tracing
+
+SOCKET_PATH = os.getenv('SPOTDL_TUI_SOCKET', 'cache/daemon.sock')
+# Messages waiting to be written to one client before it is dropped as too slow
+MAX_OUTGOING = 256
+
+EXPOSED_METHODS = {
+    'music_manager': {
+        'pause', 'unpause', 'force_play_song', 'reset_queue', 'add_song_to_queue',
+        'add_songs_to_queue', 'play_queue', 'skip_forward', 'previous', 'download_song'
+    },
+    'spotify_client': {
+        'get_user_playlists', 'get_playlist_tracks', 'get_playlist_items', 'get_playlist_metadata',
+        'download_song_metadata'
+    },
+    'song_metadata_file': {'read', 'get_metadata', 'get_many', 'add_metadata', 'add_many'},
+}
+
+
+class DaemonError(Exception):
+    """Raised by the client when the daemon returns an error or disconnects."""
+
+
+def music_state(music_manager) -> dict:
+    """Returns the parts of a MusicManager's state that clients mirror."""
+    return {
+        'queue':                list(music_manager.queue),
+        'currently_playing':    music_manager.currently_playing,
+        'paused':               music_manager.paused
+    }
+
+
+class _DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """Handles one client connection for the lifetime of the connection.
+
+    Messages are written by a writer thread from an outgoing queue, so sending
+    never blocks the caller (e.g. the MusicManager actor broadcasting an event).
+    A client that falls MAX_OUTGOING messages behind is disconnected.
+    """
+    def setup(self):
+        super().setup()
+        self.outgoing: queue.Queue = queue.Queue(maxsize=MAX_OUTGOING)
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def handle(self):
+        music_daemon: MusicDaemon = self.server.music_daemon
+        music_daemon.add_client(self)
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.send(music_daemon.dispatch(request))
+        except OSError:
+            pass
+        finally:
+            music_daemon.remove_client(self)
+
+    def finish(self):
+        self._close_outgoing()
+        self.writer.join()
+        super().finish()
+
+    def send(self, message: dict):
+        """Queues a message for the writer thread without blocking.
+
+        Raises:
+            OSError: If the client is too slow to keep up and has been disconnected.
+        """
+        data = (json.dumps(message) + '\n').encode('utf-8')
+        try:
+            self.outgoing.put_nowait(data)
+        except queue.Full:
+            self._disconnect()
+            raise OSError("Client is not reading its messages") from None
+
+    def _write_loop(self):
+        while True:
+            data = self.outgoing.get()
+            if data is None:
+                return
+            try:
+                self.wfile.write(data)
+            except OSError:
+                self._disconnect()
+                return
+
+    def _close_outgoing(self):
+        # Wakes the writer thread, dropping queued messages if there is no room
+        while True:
+            try:
+                self.outgoing.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    self.outgoing.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _disconnect(self):
+        # Ends handle() by closing the connection under the reader and writer
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def _peer_uid(connection: socket.socket) -> int | None:
+    """Returns the user ID of the process at the other end of a Unix socket, or
+    None where the platform can't tell."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', credentials)
+    return uid
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    """Unix socket server that only accepts connections from the daemon's user,
+    since any client can control playback and downloads."""
+    daemon_threads = True
+
+    def server_bind(self):
+        super().server_bind()
+        os.chmod(self.server_address, 0o600)
+
+    def verify_request(self, request, client_address) -> bool:
+        return _peer_uid(request) in (None, os.getuid())
+
+
+class MusicDaemon():
+    """Serves a ClassManager's MusicManager, SpotifyClient and SongMetadataFile over a Unix socket."""
+    def __init__(self, classman, path: str = SOCKET_PATH, logger: logging.Logger | None = None):
+        self.classman = classman
+        self.path = path
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+        self._clients: set[_DaemonRequestHandler] = set()
+        self._clients_lock = threading.Lock()
+        self._server: _UnixServer | None = None
+
+        self.classman.music_manager.set_on_song_change(lambda **delta: self.broadcast('song-change', delta))
+        self.classman.music_manager.set_on_queue_change(lambda **delta: self.broadcast('queue-change', delta))
+
+    def add_client(self, client: _DaemonRequestHandler):
+        with self._clients_lock:
+            self._clients.add(client)
+        self.logger.info("Client attached (%d connected)", len(self._clients))
+
+    def remove_client(self, client: _DaemonRequestHandler):
+        with self._clients_lock:
+            self._clients.discard(client)
+        self.logger.info("Client detached (%d connected)", len(self._clients))
+
+    def broadcast(self, event: str, delta: dict | None = None):
+        """Sends an event with what changed and the current state to every connected client.
+
+        Sending only queues the message, so this never waits on a slow client."""
+        message = {'event': event, 'delta': delta or {}, 'state': music_state(self.classman.music_manager)}
+        with self._clients_lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.send(message)
+            except OSError:
+                self.remove_client(client)
+
+    def dispatch(self, request: dict) -> dict:
+        """Runs a request from a client and returns the reply to send.
+
+        Args:
+            request (dict): Decoded request with id, target, method and args.
+        """
+        request_id = request.get('id')
+        target = request.get('target')
+        method = request.get('method')
+
+        if target == 'daemon' and method == 'state':
+            return {'id': request_id, 'result': None, 'state': music_state(self.classman.music_manager)}
+        if method not in EXPOSED_METHODS.get(target, set()):
+            return {'id': request_id, 'error': f"Unknown method {target}.{method}"}
+
+        try:
+            with tracing.span(f'{target}.{method}', 'daemon'):
+                result = getattr(getattr(self.classman, target), method)(*request.get('args', []))
+        except Exception as e:
+            self.logger.exception("Error running %s.%s", target, method)
+            return {'id': request_id, 'error': f"{type(e).__name__}: {e}"}
+
+        if target == 'music_manager':
+            # Pausing etc. doesn't fire a hook, so tell the other clients here
+            self.broadcast('state-change')
+        return {'id': request_id, 'result': result, 'state': music_state(self.classman.music_manager)}
+
+    def serve_forever(self):
+        """Listens on the socket until shutdown() is called."""
+        if os.path.exists(self.path):
+            if is_daemon_running(self.path):
+                raise DaemonError(f"A daemon is already listening on {self.path}")
+            os.remove(self.path)
+
+        self._server = _UnixServer(self.path, _DaemonRequestHandler)
+        self._server.music_daemon = self
+        self.logger.info("Listening on %s", self.path)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def shutdown(self):
+        """Stops serve_forever (call from another thread)."""
+        if self._server is not None:
+            self._server.shutdown()
+
+
+class DaemonClient():
+    """A connection to a MusicDaemon.
+
+    Replies are matched to requests by ID on a reader thread, and pushed events
+    are handed to on_event on a separate thread so that event handlers can make
+    calls to the daemon themselves.
+    """
+    def __init__(self, path: str = SOCKET_PATH):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._reader = self._socket.makefile('rb')
+
+        self._ids = itertools.count()
+        self._pending: dict[int, queue.Queue] = {}
+        self._lock = threading.Lock()
+        self._events: queue.Queue = queue.Queue()
+        self._closed = False
+
+        self.state: dict = {'queue': [], 'currently_playing': None, 'paused': True}
+        self.on_event: Callable[[str, dict], None] | None = None
+
+        threading.Thread(target=self._read_loop, daemon=True).start()
+        threading.Thread(target=self._event_loop, daemon=True).start()
+
+        self.call('daemon', 'state')
+
+    def call(self, target: str, method: str, *args):
+        """Calls a method on the daemon and waits for the result.
+
+        Raises:
+            DaemonError: If the daemon returned an error or disconnected.
+        """
+        replies: queue.Queue = queue.Queue(maxsize=1)
+        with self._lock:
+            if self._closed:
+                raise DaemonError("Not connected to daemon")
+            request_id = next(self._ids)
+            self._pending[request_id] = replies
+            data = json.dumps({'id': request_id, 'target': target, 'method': method, 'args': list(args)})
+            self._socket.sendall((data + '\n').encode('utf-8'))
+
+        reply = replies.get()
+        if 'error' in reply:
+            raise DaemonError(reply['error'])
+        return reply['result']
+
+    def _read_loop(self):
+        try:
+            for line in self._reader:
+                message = json.loads(line)
+                if 'state' in message:
+                    self.state = message['state']
+                if 'event' in message:
+                    self._events.put((message['event'], message.get('delta', {})))
+                else:
+                    with self._lock:
+                        replies = self._pending.pop(message.get('id'), None)
+                    if replies is not None:
+                        replies.put(message)
+        except (OSError, ValueError):
+            pass
+
+        with self._lock:
+            self._closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for replies in pending:
+            replies.put({'error': "Daemon disconnected"})
+        self._events.put(None)
+
+    def _event_loop(self):
+        while True:
+            item = self._events.get()
+            if item is None:
+                return
+            if self.on_event is not None:
+                self.on_event(*item)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+
+class RemoteMusicManager():
+    """Stands in for MusicManager in a client, forwarding calls to the daemon.
+
+    queue, currently_playing and paused mirror the daemon's state.
+    """
+    def __init__(self, client: DaemonClient, logger: logging.Logger | None = None):
+        self.client = client
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.on_song_change = None
+        self.on_queue_change = None
+        self.client.on_event = self._on_event
+
+    @property
+    def queue(self) -> list[str]:
+        return self.client.state['queue']
+
+    @property
+    def currently_playing(self) -> str | None:
+        return self.client.state['currently_playing']
+
+    @property
+    def paused(self) -> bool:
+        return self.client.state['paused']
+
+    def _on_event(self, event: str, delta: dict):
+        if event == 'song-change' and self.on_song_change is not None:
+            self.on_song_change(**delta)
+        elif event == 'queue-change' and self.on_queue_change is not None:
+            self.on_queue_change(**delta)
+
+    def set_on_song_change(self, on_song_change: Callable):
+        self.on_song_change = on_song_change
+
+    def set_on_queue_change(self, on_queue_change):
+        self.on_queue_change = on_queue_change
+
+    def __getattr__(self, name: str):
+        if name in EXPOSED_METHODS['music_manager']:
+            return lambda *args: self.client.call('music_manager', name, *args)
+        raise AttributeError(name)
+
+    def quit(self):
+        """Detaches from the daemon, leaving playback and downloads running."""
+        self.client.close()
+
+
+class RemoteProxy():
+    """Forwards the exposed methods of a SpotifyClient or SongMetadataFile to the daemon."""
+    def __init__(self, client: DaemonClient, target: str):
+        self.client = client
+        self.target = target
+
+    def authenticate(self):
+        """The daemon is already authenticated, so there is nothing to do."""
+
+    def __getattr__(self, name: str):
+        if name in EXPOSED_METHODS[self.target]:
+            return lambda *args: self.client.call(self.target, name, *args)
+        raise AttributeError(name)
+
+
+def is_daemon_running(path: str = SOCKET_PATH) -> bool:
+    """Returns true if a daemon is accepting connections on path."""
+    if not os.path.exists(path):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+            return True
+        except OSError:
+            return False
+
+
+def attach(path: str = SOCKET_PATH, logger: logging.Logger | None = None):
+    """Returns a ClassManager attached to a running daemon, or None if none is running."""
+    from class_manager import ClassManager
+
+    if not is_daemon_running(path):
+        return None
+    try:
+        client = DaemonClient(path)
+    except (OSError, DaemonError):
+        return None
+
+    logger = logger if logger is not None else logging.getLogger()
+    return ClassManager(
+        music_manager=RemoteMusicManager(client, logger),
+        song_metadata_file=RemoteProxy(client, 'song_metadata_file'),
+        spotify_client=RemoteProxy(client, 'spotify_client'),
+        logger=logger
+    )
+
+
+if __name__ == "__main__":
+    from class_manager import ClassManager
+
+    parser = argparse.ArgumentParser(description="Run the spotdl-tui playback and download daemon.")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="Path of the Unix socket to listen on.")
+    parser.add_argument('--trace', metavar='PATH', default=tracing.TRACE_PATH,
+                        help="Record a Chrome trace to PATH on exit (or set SPOTDL_TUI_TRACE).")
+    parser.add_argument('--profile', action='store_true', default=tracing.PROFILE,
+                        help="Include sampled stacks of all threads in the trace (or set SPOTDL_TUI_PROFILE=1).")
+    args = parser.parse_args()
+    if args.trace:
+        tracing.tracer.enable(args.trace, profile=args.profile)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s [%(filename)s:%(lineno)d]: %(message)s")
+    class_manager = ClassManager(logger=logging.getLogger())
+    music_daemon = MusicDaemon(class_manager, args.socket)
+
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=music_daemon.shutdown).start())
+    try:
+        music_daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        class_manager.music_manager.quit()
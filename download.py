@@ -1,12 +1,18 @@
 """Provides download_song to download a song from Youtube Music"""
+import logging
 import subprocess
 import re
 
-def download_song(query: str) -> str | None | tuple[str, str]:
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+def download_song(query: str, rate_limit: int | None = None) -> str | None | tuple[str, str]:
     """Downloads a song and parses the output to get the track ID.
 
     Args:
         query (str): The Spotify track ID to download.
+        rate_limit (int | None, optional): Maximum download speed in bytes/s. Defaults to None.
 
     Returns:
         str | None | tuple[str, str]: Spotify track ID or None if no song found.
@@ -20,31 +26,21 @@ def download_song(query: str) -> str | None | tuple[str, str]:
         "--output",
         "cache/downloads/{track-id}"
     ]
+    if rate_limit is not None:
+        download_cmd += ["--yt-dlp-args", f"--limit-rate {rate_limit}"]
 
-    convert_cmd = [
-        "ffmpeg",
-        '-i',
-        f'cache/downloads/{query}.mp3',
-        '-acodec',
-        'pcm_u8',
-        '-ar',
-        '22050',
-        f'cache/downloads/{query}.wav'
-    ]
-    print(f"query: {query}")
+    logger.debug("query: %s", query)
 
     try:
-        result = subprocess.run(
-            download_cmd,
-            capture_output=True,
-            text=True,
-            check=False
-        )
+        with span('spotdl', 'download', track=query):
+            result = subprocess.run(
+                download_cmd,
+                capture_output=True,
+                text=True,
+                check=False
+            )
         output = result.stdout + result.stderr
-
-
-        convert_result = subprocess.run(convert_cmd, check=False, capture_output=True, text=True)
-        print(convert_result.stderr)
+        # Converting, tagging and loudness analysis are done by post_process.PostDownloadPipeline
 
         # Try to find "Downloaded" line
         match = re.search(r'Downloaded\s+"(.+?)":', output)
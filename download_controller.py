@@ -0,0 +1,202 @@
+"""Adapts how many downloads run at once, and how fast, to the network."""
+import threading
+import time
+
+from collections import deque
+
+
+class DownloadSlot():
+    """Permission to run one download, returned by AdaptiveDownloadController.
+
+    Call finish() with the outcome when the download is done, or cancel() if no
+    download was attempted.
+    """
+    def __init__(self, controller: 'AdaptiveDownloadController', priority: bool, rate_limit: int | None):
+        self.controller = controller
+        self.priority = priority
+        self.rate_limit = rate_limit
+        self.started = controller.clock()
+        # Controller's download-seconds count when the slot started, to measure concurrency
+        self.busy_at_start = controller._busy_seconds
+        self._done = False
+
+    def finish(self, succeeded: bool, size: int = 0):
+        """Releases the slot and reports how the download went.
+
+        Args:
+            succeeded (bool): Whether the download succeeded.
+            size (int, optional): Bytes downloaded. Defaults to 0.
+        """
+        if not self._done:
+            self._done = True
+            self.controller._finish(self, succeeded, size, self.controller.clock() - self.started)
+
+    def cancel(self):
+        """Releases the slot without reporting anything."""
+        if not self._done:
+            self._done = True
+            self.controller._finish(self, None, 0, 0)
+
+
+class AdaptiveDownloadController():
+    """Sets the number of concurrent background downloads and their bandwidth cap
+    using additive increase / multiplicative decrease (AIMD).
+
+    Each finished download reports its throughput, which is scaled by the average
+    number of downloads that ran alongside it to estimate the aggregate throughput
+    of the link. A download counts as congested if the aggregate fell below
+    congestion_ratio times the best recent aggregate, or if more than max_error_rate
+    of the recent downloads failed (single failures are usually unavailable tracks).
+    A download that kept up with its own rate limit is never congested, since the
+    cap rather than the link slowed it. Congestion halves the number of workers and
+    caps background bandwidth below what was being achieved. A full round of
+    uncongested downloads adds one worker and raises the cap by rate_step.
+
+    Priority downloads (the track that is about to play) always start immediately,
+    ignore the worker limit and are never rate limited, so background downloads
+    can't starve playback.
+    """
+    def __init__(
+        self,
+        min_workers: int = 1,
+        max_workers: int = 6,
+        congestion_ratio: float = 0.5,
+        backoff: float = 0.5,
+        rate_step: int = 128 * 1024,
+        min_rate: int = 64 * 1024,
+        max_error_rate: float = 0.3,
+        error_window: int = 10,
+        clock = time.monotonic
+        ):
+        """Initialises the AdaptiveDownloadController.
+
+        Args:
+            min_workers (int, optional): Fewest concurrent background downloads. Defaults to 1.
+            max_workers (int, optional): Most concurrent background downloads. Defaults to 6.
+            congestion_ratio (float, optional): Fraction of the best aggregate throughput below
+                which a download counts as congested. Defaults to 0.5.
+            backoff (float, optional): Multiplier for workers and bandwidth on congestion. Defaults to 0.5.
+            rate_step (int, optional): Bytes/s the bandwidth cap grows by each round. Defaults to 128 KiB/s.
+            min_rate (int, optional): Lowest bandwidth cap in bytes/s. Defaults to 64 KiB/s.
+            max_error_rate (float, optional): Fraction of failed downloads that counts as
+                congestion. Defaults to 0.3.
+            error_window (int, optional): Number of recent downloads the error rate is
+                measured over. Defaults to 10.
+        """
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.congestion_ratio = congestion_ratio
+        self.backoff = backoff
+        self.rate_step = rate_step
+        self.min_rate = min_rate
+        self.max_error_rate = max_error_rate
+        self.clock = clock
+
+        self.workers = min_workers
+        # Total bytes/s for background downloads, None until the first congestion
+        self.rate_cap: float | None = None
+
+        self._active = 0
+        self._active_priority = 0
+        # Integral of the number of running downloads over time, see _advance()
+        self._busy_seconds = 0.0
+        self._last_change = clock()
+        self._best_aggregate = 0.0
+        self._round_successes = 0
+        self._outcomes: deque[bool] = deque(maxlen=error_window)
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> int:
+        """Number of background downloads running."""
+        return self._active
+
+    def error_rate(self) -> float:
+        """Fraction of the recent downloads that failed."""
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def free_slots(self) -> int:
+        """Returns how many more background downloads may start now."""
+        with self._lock:
+            return max(0, self.workers - self._active)
+
+    def _advance(self):
+        """Adds the time since the last start or finish, weighted by the number of
+        downloads that were running, to _busy_seconds."""
+        now = self.clock()
+        self._busy_seconds += (now - self._last_change) * (self._active + self._active_priority)
+        self._last_change = now
+
+    def _per_download_rate(self) -> int | None:
+        if self.rate_cap is None:
+            return None
+        return max(int(self.rate_cap / self.workers), 1)
+
+    def start(self, priority: bool = False) -> DownloadSlot | None:
+        """Returns a slot to run a download in, or None if all background slots are busy.
+
+        Args:
+            priority (bool, optional): True for the track about to play, which always
+                gets a slot without a rate limit. Defaults to False.
+        """
+        with self._lock:
+            if not priority and self._active >= self.workers:
+                return None
+            self._advance()
+            if priority:
+                self._active_priority += 1
+                return DownloadSlot(self, True, None)
+            self._active += 1
+            return DownloadSlot(self, False, self._per_download_rate())
+
+    def _finish(self, slot: DownloadSlot, succeeded: bool | None, size: int, seconds: float):
+        with self._lock:
+            self._advance()
+            if slot.priority:
+                self._active_priority -= 1
+            else:
+                self._active -= 1
+
+            if succeeded is None:
+                return
+            self._outcomes.append(succeeded)
+            if not succeeded:
+                if len(self._outcomes) > 1 and self.error_rate() > self.max_error_rate:
+                    self._outcomes.clear()
+                    self._decrease(None)
+                return
+            if size <= 0 or seconds <= 0:
+                return
+
+            throughput = size / seconds
+            if slot.rate_limit is not None and throughput >= slot.rate_limit * 0.9:
+                self._increase()
+                return
+            # Average number of downloads sharing the link while this one ran
+            concurrent = max(1.0, (self._busy_seconds - slot.busy_at_start) / seconds)
+            aggregate = throughput * concurrent
+            # Let the best throughput decay slowly so that it follows the link
+            self._best_aggregate = max(aggregate, self._best_aggregate * 0.95)
+            if aggregate < self._best_aggregate * self.congestion_ratio:
+                self._decrease(aggregate)
+            else:
+                self._increase()
+
+    def _decrease(self, achieved_rate: float | None):
+        self.workers = max(self.min_workers, int(self.workers * self.backoff))
+        self._round_successes = 0
+        if achieved_rate is not None:
+            self.rate_cap = max(self.min_rate, achieved_rate * self.backoff)
+        elif self.rate_cap is not None:
+            self.rate_cap = max(self.min_rate, self.rate_cap * self.backoff)
+
+    def _increase(self):
+        self._round_successes += 1
+        if self._round_successes < self.workers:
+            return
+        self._round_successes = 0
+        self.workers = min(self.max_workers, self.workers + 1)
+        if self.rate_cap is not None:
+            self.rate_cap += self.rate_step
@@ -0,0 +1,159 @@
+"""Tracks failed downloads so unavailable tracks are not retried constantly."""
+import os
+import pickle
+import threading
+import time
+
+from tracing import traced
+
+
+class DownloadFailureCache():
+    """A persistent negative cache of failed downloads with exponential backoff.
+
+    Each failed track is stored with its failure count and the time at which it
+    may be retried. Entries expire after ttl seconds so that tracks which become
+    available later are eventually retried from scratch. Safe to use from several
+    download threads at once.
+    """
+    def __init__(
+        self,
+        path: str = 'cache/failed_downloads.pkl',
+        base_delay: float = 60,
+        max_delay: float = 6 * 60 * 60,
+        ttl: float = 7 * 24 * 60 * 60,
+        clock = time.time
+        ) -> None:
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.ttl = ttl
+        self._clock = clock
+        # Held while changing and writing the entries, so a write never sees them half changed
+        self._lock = threading.RLock()
+        self._entries: dict[str, dict[str, float]] = self._read()
+
+    @traced('failed_downloads.pkl read', 'pickle')
+    def _read(self) -> dict[str, dict[str, float]]:
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'rb') as file:
+                    return pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                return {}
+        return {}
+
+    @traced('failed_downloads.pkl write', 'pickle')
+    def _write(self):
+        try:
+            with open(self.path, 'wb') as file:
+                pickle.dump(self._entries, file)
+        except OSError:
+            pass
+
+    def _get_entry(self, track_id: str) -> dict[str, float] | None:
+        with self._lock:
+            entry = self._entries.get(track_id)
+            if entry is not None and self._clock() - entry['last-failure'] > self.ttl:
+                del self._entries[track_id]
+                self._write()
+                return None
+            return entry
+
+    def record_failure(self, track_id: str) -> float:
+        """Records a failed download and schedules the next retry.
+
+        Args:
+            track_id (str): Spotify track ID that failed to download.
+
+        Returns:
+            float: Number of seconds until the track may be retried.
+        """
+        with self._lock:
+            now = self._clock()
+            entry = self._get_entry(track_id)
+            failures = 1 if entry is None else int(entry['failures']) + 1
+            delay = min(self.base_delay * 2 ** (failures - 1), self.max_delay)
+
+            self._entries[track_id] = {
+                'failures':     failures,
+                'last-failure': now,
+                'retry-at':     now + delay
+            }
+            self._write()
+        return delay
+
+    def record_success(self, track_id: str):
+        """Forgets any previous failures of a track.
+
+        Args:
+            track_id (str): Spotify track ID that downloaded successfully.
+        """
+        with self._lock:
+            if self._entries.pop(track_id, None) is not None:
+                self._write()
+
+    def is_unavailable(self, track_id: str) -> bool:
+        """Returns true if the track failed recently and is still backing off.
+
+        Args:
+            track_id (str): Spotify track ID to check.
+        """
+        entry = self._get_entry(track_id)
+        return entry is not None and self._clock() < entry['retry-at']
+
+    def failures(self, track_id: str) -> int:
+        """Returns the number of consecutive failures recorded for a track."""
+        entry = self._get_entry(track_id)
+        return 0 if entry is None else int(entry['failures'])
+
+
+class CircuitBreaker():
+    """Stops all downloads for a while after too many consecutive failures.
+
+    The breaker is closed while downloads succeed. After threshold consecutive
+    failures it opens for cooldown seconds, during which allow() returns False.
+    Once the cooldown has passed the breaker is half-open: the first allow() claims
+    the single trial download and later calls return False until its outcome is
+    recorded. If the trial fails the breaker opens again, and if it succeeds the
+    breaker closes. A trial with no recorded outcome expires after another cooldown.
+    """
+    def __init__(self, threshold: int = 5, cooldown: float = 5 * 60, clock = time.monotonic) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._consecutive_failures = 0
+        self._opened_at: float | None = None
+        self._trial_started: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        """True while downloads are paused."""
+        return self._opened_at is not None and self._clock() - self._opened_at < self.cooldown
+
+    def remaining(self) -> float:
+        """Returns the number of seconds until a trial download is allowed."""
+        if self._opened_at is None:
+            return 0
+        started = self._opened_at if self._trial_started is None else self._trial_started
+        return max(0, self.cooldown - (self._clock() - started))
+
+    def allow(self) -> bool:
+        """Returns true if a download may be attempted now. While half-open, only the
+        first call returns true, claiming the trial download."""
+        if self._opened_at is None:
+            return True
+        if self.remaining() > 0:
+            return False
+        self._trial_started = self._clock()
+        return True
+
+    def record_success(self):
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_started = None
+
+    def record_failure(self):
+        self._consecutive_failures += 1
+        self._trial_started = None
+        if self._opened_at is not None or self._consecutive_failures >= self.threshold:
+            self._opened_at = self._clock()
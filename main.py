@@ -1,6 +1,6 @@
 """Main entry point for spotdl-tui"""
 
-import threading
+import argparse
 import random
 
 from textual.app import App, ComposeResult
@@ -12,6 +12,10 @@ from textual.coordinate import Coordinate
 from rich.text import Text
 
 from class_manager import ClassManager
+from track import Track
+from ui_events import UIEventBus
+from tracing import PROFILE, TRACE_PATH, span, traced, tracer
+import daemon
 
 class PlaylistView(Static):
     """A Static that takes a playlist_id and displays a DataTable with a few buttons"""
@@ -20,43 +24,47 @@ class PlaylistView(Static):
         self.classman = classman
         self.playlist_id = playlist_id
 
-        self.playlist_tracks = []
+        self.playlist_tracks: list[Track] = []
         self.playlist_name = ""
 
         self.table = DataTable()
         self.title = Label()
+        self.cover = Static()
         self.shuffle = Button()
         self.play_all = Button()
+        self._album_id: str | None = None
 
         super().__init__()
 
     def compose(self):
         if self.playlist_id is not None:
-            # Setup Data
-            table = [
-                ("x", "Track Name", "Artist", "id"),
-            ]
-            tracks = self.classman.spotify_client.get_playlist_tracks(f'https://open.spotify.com/playlist/{self.playlist_id}')
-            self.playlist_tracks = tracks
-            tracks = [['▶'] + sublist for sublist in tracks]
+            with span('PlaylistView.compose', 'ui', playlist=self.playlist_id):
+                # Setup Data
+                table = [
+                    ("x", "Track Name", "Artist", "id"),
+                ]
+                self.playlist_tracks = self.classman.tracks.from_rows(
+                    self.classman.spotify_client.get_playlist_tracks(f'https://open.spotify.com/playlist/{self.playlist_id}'))
 
-            name = self.classman.spotify_client.get_playlist_metadata(f'https://open.spotify.com/playlist/{self.playlist_id}')['name']
+                name = self.classman.spotify_client.get_playlist_metadata(f'https://open.spotify.com/playlist/{self.playlist_id}')['name']
 
-            self.playlist_name = name
+                self.playlist_name = name
 
-            # Setup Elements
-            self.table = DataTable(id='playlist')
-            self.title = Label(name, id='playlist-title')
-            self.shuffle = Button("Shuffle", id='playlist-shuffle')
-            self.play_all = Button("Play", id='playlist-play')
+                # Setup Elements
+                self.table = DataTable(id='playlist')
+                self.title = Label(name, id='playlist-title')
+                self.cover = Static(id='playlist-cover')
+                self.shuffle = Button("Shuffle", id='playlist-shuffle')
+                self.play_all = Button("Play", id='playlist-play')
 
 
-            self.table.add_columns(*table[0])
-            self.table.add_rows(tracks)
+                with span('PlaylistView populate table', 'ui', rows=len(self.playlist_tracks)):
+                    self.table.add_columns(*table[0])
+                    self.table.add_rows(('▶', track.name, track.artists, track.id) for track in self.playlist_tracks)
 
             play_group = HorizontalGroup(self.shuffle, self.play_all, id='playlist-play-group')
 
-            topbar = HorizontalGroup(self.title, play_group, id="playlist-topbar")
+            topbar = HorizontalGroup(self.cover, self.title, play_group, id="playlist-topbar")
 
             v_group = VerticalGroup(topbar, self.table)
 
@@ -64,6 +72,36 @@ class PlaylistView(Static):
         else:
             yield Label("No Playlist")
 
+    def on_mount(self):
+        self.app.events.subscribe('cover-ready', self.on_cover_ready)
+        # Load the covers of the first screen of tracks
+        metadata = self.classman.song_metadata_file.get_many([track.id for track in self.playlist_tracks[:20]])
+        self.classman.thumbnails.prefetch(list(metadata.values()))
+        if self.playlist_tracks:
+            self.show_cover(self.playlist_tracks[0].id)
+
+    def on_unmount(self):
+        self.app.events.unsubscribe('cover-ready', self.on_cover_ready)
+
+    @on(DataTable.RowHighlighted)
+    def show_highlighted_cover(self, event: DataTable.RowHighlighted) -> None:
+        """Shows the album cover of the highlighted track."""
+        if event.control.id == 'playlist' and event.cursor_row < len(self.playlist_tracks):
+            self.show_cover(self.playlist_tracks[event.cursor_row].id)
+
+    def show_cover(self, track_id: str):
+        """Shows the album cover of a track, loading it in the background if needed."""
+        metadata = self.classman.song_metadata_file.get_metadata(track_id)
+        if metadata is not None:
+            self._album_id = metadata.get('album-id')
+            self.cover.update(self.classman.thumbnails.get(self._album_id) or '')
+            self.classman.thumbnails.request(self._album_id, metadata.get('album-cover-url'))
+
+    def on_cover_ready(self, delta: dict):
+        """Run on the app thread when album covers have loaded."""
+        if self._album_id in delta.get('albums', []):
+            self.cover.update(self.classman.thumbnails.get(self._album_id) or '')
+
     # Run when playlist selected
     @on(DataTable.CellSelected)
     async def on_data_table_cell_selected(self, event: DataTable.CellSelected) -> None:
@@ -71,27 +109,29 @@ class PlaylistView(Static):
         if event.control.id == 'playlist':
             row, column = event.coordinate
             if column == 0:
-                def _task():
-                    self.classman.music_manager.force_play_song(self.table.get_cell_at(Coordinate(row, column + 3)), True)
-
-                _task_thread = threading.Thread(target=_task)
-                _task_thread.daemon = True
-                _task_thread.start()
+                track_id = self.table.get_cell_at(Coordinate(row, column + 3))
+                # Downloading can take a while, a newer click replaces the worker
+                self.run_worker(lambda: self.classman.music_manager.force_play_song(track_id, True),
+                                thread=True, group='play', exclusive=True)
 
     @on(Button.Pressed)
     def handle_button_selected(self, event: Button.Pressed) -> None:
         """Runs when the play or shuffle button is pressed"""
         if event.control.id == 'playlist-play':
-            track_ids = [track[-1] for track in self.playlist_tracks]
-            self.classman.music_manager.reset_queue()
-            self.classman.music_manager.add_songs_to_queue(track_ids)
-            self.classman.music_manager.play_queue()
+            self.play_tracks([track.id for track in self.playlist_tracks])
         elif event.control.id == 'playlist-shuffle':
-            track_ids = [track[-1] for track in self.playlist_tracks]
+            track_ids = [track.id for track in self.playlist_tracks]
             random.shuffle(track_ids)
+            self.play_tracks(track_ids)
+
+    def play_tracks(self, track_ids: list[str]):
+        """Replaces the queue with track_ids and plays the first, in a worker thread
+        because the first song may need downloading."""
+        def play():
             self.classman.music_manager.reset_queue()
             self.classman.music_manager.add_songs_to_queue(track_ids)
             self.classman.music_manager.play_queue()
+        self.run_worker(play, thread=True, group='play', exclusive=True)
 
 class PlaylistsView(Static):
     """Shows all of the users playlist's in a DataTable,
@@ -101,30 +141,33 @@ class PlaylistsView(Static):
         self.classman = classman
         self.playlist = PlaylistView(classman)
         self.table = DataTable()
+        self.playlist_ids: list[str] = []
 
     def compose(self) -> ComposeResult:
-        data = self.classman.spotify_client.get_user_playlists()
-        data = [['x'] + sublist for sublist in data]
-        self.table = DataTable(id='playlists')
-        self.table.add_columns(*("x", "Name", "ID"))
-        self.table.add_rows(data)
+        with span('PlaylistsView.compose', 'ui'):
+            data = self.classman.spotify_client.get_user_playlists()
+            self.playlist_ids = [playlist_id for _, playlist_id in data]
+            self.table = DataTable(id='playlists')
+            self.table.add_columns(*("x", "Name", "ID"))
+            self.table.add_rows(('x', name, playlist_id) for name, playlist_id in data)
         yield Collapsible(self.table, collapsed=False, title="Playlists")
         yield self.playlist
 
+    def on_mount(self):
+        # Wait for the first frame so warming never delays startup
+        self.call_after_refresh(self.classman.playlist_warmer.start, self.playlist_ids)
+
     # Run when a cell is selected
     @on(DataTable.CellSelected)
     def handle_cell_selected(self, event: DataTable.CellSelected) -> None:
         """Run when a playlist is selected.
         Opens the playlist in PlaylistView"""
         if event.control.id == 'playlists':
-            def _task():
-                playlist_id = event.control.get_cell_at(Coordinate(event.coordinate[0], 2))
-                def update_ui():
-                    self.playlist.remove()
-                    self.playlist = PlaylistView(self.classman, playlist_id)
-                    self.mount(self.playlist)
-                self.app.call_from_thread(update_ui)
-            threading.Thread(target=_task, daemon=True).start()
+            playlist_id = event.control.get_cell_at(Coordinate(event.coordinate[0], 2))
+            self.classman.playlist_history.record(playlist_id)
+            self.playlist.remove()
+            self.playlist = PlaylistView(self.classman, playlist_id)
+            self.mount(self.playlist)
 
 class BottomBar(Static):
     """Bar at the bottom of the screen that displays currently playing song."""
@@ -133,29 +176,48 @@ class BottomBar(Static):
         self.classman = classman
 
         self.current_play_label = Label()
+        self.cover = Static()
+        self._album_id: str | None = None
 
     def compose(self) -> ComposeResult:
         self.current_play_label =  Label("Currently Playing", id='current')
-        yield self.current_play_label
+        self.cover = Static(id='cover')
+        yield HorizontalGroup(self.cover, self.current_play_label, id='now-playing')
         yield HorizontalGroup(
+            Button("Previous Song", id='previous'),
             Button("Play/Pause", id='play'),
             Button("Next Song", id='next')
         )
 
-        self.classman.music_manager.set_on_song_change(self.update_currently_playing)
+        self.app.events.subscribe('song-change', self.update_currently_playing)
+        self.app.events.subscribe('cover-ready', self.on_cover_ready)
 
-    def update_currently_playing(self):
-        print('DEBUG type(song_metadata_file):', type(self.classman.song_metadata_file))
-        if self.classman.music_manager.currently_playing is not None:
-            metadata = self.classman.song_metadata_file.get_metadata(self.classman.music_manager.currently_playing)
+    def update_currently_playing(self, delta: dict):
+        """Run on the app thread when the song changes."""
+        currently_playing = delta.get('currently_playing')
+        if currently_playing is not None:
+            metadata = self.classman.song_metadata_file.get_metadata(currently_playing)
             if metadata is not None:
                 label_text = Text()
                 label_text.append(f"{metadata['name']} - ")
                 label_text.append(metadata['artist-name'], 'gray0')
                 self.current_play_label.update(label_text)
 
+                self._album_id = metadata.get('album-id')
+                self.cover.update(self.classman.thumbnails.get(self._album_id) or '')
+                self.classman.thumbnails.request(self._album_id, metadata.get('album-cover-url'))
+
+            # Covers of the next songs are ready before they play
+            upcoming = self.classman.song_metadata_file.get_many(list(self.classman.music_manager.queue[:3]))
+            self.classman.thumbnails.prefetch(list(upcoming.values()))
+
+    def on_cover_ready(self, delta: dict):
+        """Run on the app thread when album covers have loaded."""
+        if self._album_id in delta.get('albums', []):
+            self.cover.update(self.classman.thumbnails.get(self._album_id) or '')
+
     def on_button_pressed(self, event: Button.Pressed):
-        """Run when play or next is clicked."""
+        """Run when play, next or previous is clicked."""
         if event.button.id == 'play':
             if self.classman.music_manager.currently_playing is not None:
                 if self.classman.music_manager.paused:
@@ -164,7 +226,11 @@ class BottomBar(Static):
                     self.classman.music_manager.pause()
 
         elif event.button.id == 'next':
-            self.classman.music_manager.skip_forward()
+            # The next song may need downloading
+            self.run_worker(self.classman.music_manager.skip_forward, thread=True, group='play', exclusive=True)
+
+        elif event.button.id == 'previous':
+            self.classman.music_manager.previous()
 
 class Queue(Static):
     """View to show the current queue."""
@@ -172,6 +238,7 @@ class Queue(Static):
         super().__init__(**kwargs)
         self.classman = classman
         self.table = DataTable()
+        self._row_keys = []
 
     def compose(self) -> ComposeResult:
         yield Label("Queue")
@@ -180,27 +247,58 @@ class Queue(Static):
         yield self.table
         yield Label(f"{self.classman.music_manager.queue}")
 
-        self.classman.music_manager.set_on_queue_change(self.on_queue_change)
-
-    def on_queue_change(self):
-        """To be run when the queue needs to be updated."""
-        self.table.clear()
-        self.table.add_rows(self.parse_queue(self.classman.music_manager.queue))
-
-
-    def parse_queue(self, queue: list[str]) -> list[str]:
-        print('DEBUG type(song_metadata_file):', type(self.classman.song_metadata_file))
-        metadata = self.classman.song_metadata_file.read()
-        for song_id in queue:
-            if metadata.get(song_id) is None:
-                new_metadata = self.classman.spotify_client.download_song_metadata(song_id)
-                if new_metadata is not None:
+        self.app.events.subscribe('queue-change', self.on_queue_change)
+
+    @traced('Queue populate table', 'ui')
+    def on_mount(self):
+        self._row_keys = self.table.add_rows(self.parse_queue(list(self.classman.music_manager.queue)))
+
+    @traced('Queue.on_queue_change', 'ui')
+    def on_queue_change(self, delta: dict):
+        """Run on the app thread with the queue edits made since the last update."""
+        ops = delta.get('ops', [])
+        # Anything before the last reset has already been cleared
+        resets = [index for index, op in enumerate(ops) if op[0] == 'reset']
+        if resets:
+            ops = ops[resets[-1]:]
+
+        for op in ops:
+            if op[0] == 'reset':
+                self.table.clear()
+                self._row_keys = []
+            elif op[0] == 'pop':
+                for _ in range(min(op[1], len(self._row_keys))):
+                    self.table.remove_row(self._row_keys.pop(0))
+            elif op[0] == 'append':
+                self._row_keys.extend(self.table.add_rows(self.parse_queue(op[1])))
+            elif op[0] == 'insert':
+                # Rows can only be appended, so the rows after index are moved after the new ones
+                index = min(op[1], len(self._row_keys))
+                moved = [self.table.get_row(row_key) for row_key in self._row_keys[index:]]
+                for row_key in self._row_keys[index:]:
+                    self.table.remove_row(row_key)
+                del self._row_keys[index:]
+                self._row_keys.extend(self.table.add_rows(self.parse_queue(op[2])))
+                self._row_keys.extend(self.table.add_rows(moved))
+
+    def parse_queue(self, queue: list[str]) -> list[tuple[str]]:
+        """Returns table rows for track IDs, using the shared Track records and only
+        reading metadata for tracks that no view has loaded yet. Tracks without
+        metadata are shown by ID, so the rows stay in step with the queue."""
+        tracks = self.classman.tracks
+        missing = [song_id for song_id in queue if tracks.get(song_id) is None]
+        if missing:
+            metadata = self.classman.song_metadata_file.get_many(missing)
+            for song_id in missing:
+                if metadata.get(song_id) is None:
+                    new_metadata = self.classman.spotify_client.download_song_metadata(song_id)
+                    if new_metadata is None:
+                        self.classman.logger.warning("No metadata for queued track %s", song_id)
+                        continue
                     self.classman.song_metadata_file.add_metadata((new_metadata['id'], new_metadata))
-        read_again = self.classman.song_metadata_file.read()
-        new_data = []
-        for song_id in queue:
-            new_data.append([read_again[song_id]['name']])
-        return new_data
+                    metadata[song_id] = new_metadata
+                tracks.from_metadata(metadata[song_id])
+        return [(track.name if (track := tracks.get(song_id)) is not None else song_id,) for song_id in queue]
 
 class ViewSwitcher(Static):
     """A Static that uses ViewSwitcher and Button to switch views between PlaylistsView and Queue."""
@@ -229,14 +327,33 @@ class Main(App):
         super().__init__(*args, **kwargs)
         self.classman = classman
 
+        # MusicManager calls these from its own threads, the bus hands them to the app thread
+        self.events = UIEventBus(self)
+        self.classman.music_manager.set_on_song_change(lambda **delta: self.events.publish('song-change', **delta))
+        self.classman.music_manager.set_on_queue_change(lambda **delta: self.events.publish('queue-change', **delta))
+        self.classman.thumbnails.on_loaded = lambda album_id: self.events.publish('cover-ready', albums=[album_id])
+
     def compose(self) -> ComposeResult:
         yield ViewSwitcher(self.classman)
         yield BottomBar(classman=self.classman)
 
 if __name__ == "__main__":
-    class_manager = ClassManager()
+    parser = argparse.ArgumentParser(description="A terminal music player for Spotify playlists using spotdl.")
+    parser.add_argument('--trace', metavar='PATH', default=TRACE_PATH,
+                        help="Record a Chrome trace to PATH on exit (or set SPOTDL_TUI_TRACE).")
+    parser.add_argument('--profile', action='store_true', default=PROFILE,
+                        help="Include sampled stacks of all threads in the trace (or set SPOTDL_TUI_PROFILE=1).")
+    args = parser.parse_args()
+    if args.trace:
+        tracer.enable(args.trace, profile=args.profile)
+
+    # Attach to a running daemon if there is one, otherwise run everything in-process
+    class_manager = daemon.attach()
+    if class_manager is None:
+        class_manager = ClassManager()
 
     main = Main(classman=class_manager)
 
     Main(classman=class_manager).run()
     class_manager.music_manager.quit()
+    class_manager.thumbnails.shutdown()
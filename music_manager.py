@@ -1,24 +1,86 @@
+from audio_cache import AudioCache
 from player import MusicPlayer
 from download import download_song
+from download_controller import AdaptiveDownloadController, DownloadSlot
+from download_failures import DownloadFailureCache, CircuitBreaker
+from post_process import PostDownloadPipeline, probe_duration
+from recordings import RecordingIndex
+from tracing import traced
+import asyncio
+import concurrent.futures
+import inspect
 import os
-import time
 import threading
 
+from collections import deque
 from collections.abc import Callable
 
+# Seconds into a song after which previous() restarts it instead of going back
+RESTART_AFTER = 3.0
+
+
+async def _resolve(result):
+    """Awaits result if it is awaitable. MusicManager methods called on the actor
+    thread return a coroutine when their command is asynchronous."""
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+def _settle(future: concurrent.futures.Future, result=None, exception: BaseException | None = None):
+    """Sets a command's result, unless quit() has already failed it."""
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except concurrent.futures.InvalidStateError:
+        pass
+
 
 class MusicManager():
+    """Plays songs, manages the queue and downloads queued songs.
+
+    All playback, queue and download scheduling state is owned by one asyncio
+    actor running on its own thread. The public methods can be called from any
+    thread: they send a command to the actor and wait for its result, so commands
+    never run at the same time. Blocking work (downloads, probing durations) runs
+    in executors, and the end of a song is detected with a timer set from its
+    duration instead of polling.
+    """
     def __init__(self, queue=None, logger=None):
         if queue is None:
             queue = []
         self.paused = True
-        self.player = MusicPlayer(on_song_end_hook=self.on_song_end)
+        self.player = MusicPlayer()
         self.queue: list[str] = queue
-        self._downloaded_songs: list = self._parse_downloaded_file_index()
+        self._downloaded_songs: set[str] = self._parse_downloaded_file_index()
         self.currently_playing: str | None = None
+        # Songs played before currently_playing, most recent last
+        self.history: deque[str] = deque(maxlen=100)
+        # Recently played songs are kept in memory, so going back to them is instant
+        self.audio_cache = AudioCache()
+        self.failed_downloads = DownloadFailureCache()
+        self.download_breaker = CircuitBreaker()
+        self.recordings = RecordingIndex()
+        self.shared_cache = None
+        self.download_controller = AdaptiveDownloadController()
+        self.post_processor = PostDownloadPipeline(logger=logger)
+        # Download tasks on the actor by track ID, removed when they finish
+        self._downloading: dict[str, asyncio.Task] = {}
+        self._download_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.download_controller.max_workers, thread_name_prefix='download')
+        # The song the user is waiting for never queues behind background downloads
+        self._priority_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix='download-priority')
 
         self.on_song_change = None
         self.on_queue_change = None
+        # Queue edits since on_queue_change was last called, e.g. ('append', [ids]), ('insert', 0, [ids]),
+        # ('pop', 1), ('reset',)
+        self._queue_ops: list[tuple] = []
+        # Called with a track ID to get its duration in seconds, set by ClassManager
+        self.lookup_duration: Callable[[str], float | None] | None = None
 
         # Use provided logger or fallback to default
         if logger is not None:
@@ -27,48 +89,213 @@ class MusicManager():
             import logging
             self.logger = logging.getLogger(__name__)
 
-        self._download_manager_thread = threading.Thread(target=self.download_manager)
-        self._download_manager_thread.daemon = True
-        self._download_manager_thread.start()
+        # Number of commands and timers the actor has run, to check it stays idle when nothing happens
+        self.wakeups = 0
+        self._downloads_scheduled = False
+        self._breaker_timer: asyncio.TimerHandle | None = None
+        self._song_timer: asyncio.TimerHandle | None = None
+        self._song_duration: float | None = None
+        self._song_token = 0
+        self._play_token = 0
+
+        self._loop = asyncio.new_event_loop()
+        self._commands: asyncio.Queue = asyncio.Queue()
+        # Futures of commands that haven't finished, failed by quit() so no caller waits forever
+        self._pending: set[concurrent.futures.Future] = set()
+        self._pending_lock = threading.Lock()
+        self._stopped = False
+        self._actor_thread = threading.Thread(target=self._run_actor, name='music-manager', daemon=True)
+        self._actor_thread.start()
+
+    def _run_actor(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.create_task(self._process_commands())
+        try:
+            self._loop.run_forever()
+        finally:
+            with self._pending_lock:
+                self._stopped = True
+            for task in asyncio.all_tasks(self._loop):
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(self._loop), return_exceptions=True))
+            self._loop.close()
+
+    async def _process_commands(self):
+        """Runs commands one at a time. Asynchronous commands continue as tasks, so
+        a command waiting for a download doesn't hold up the others."""
+        while True:
+            function, args, future = await self._commands.get()
+            self.wakeups += 1
+            try:
+                result = function(*args)
+            except BaseException as e:
+                _settle(future, exception=e)
+                if not isinstance(e, Exception):
+                    raise
+                continue
+            if inspect.isawaitable(result):
+                self._loop.create_task(self._finish_command(result, future))
+            else:
+                _settle(future, result)
+
+    async def _finish_command(self, awaitable, future: concurrent.futures.Future):
+        try:
+            _settle(future, await awaitable)
+        except asyncio.CancelledError:
+            _settle(future, exception=RuntimeError("MusicManager has quit"))
+            raise
+        except BaseException as e:
+            _settle(future, exception=e)
+            if not isinstance(e, Exception):
+                raise
+
+    def _on_actor_thread(self) -> bool:
+        return threading.current_thread() is self._actor_thread
+
+    def _call(self, function: Callable, *args):
+        """Runs a command on the actor and returns its result. On the actor thread
+        the command runs directly, returning a coroutine if it is asynchronous."""
+        if self._on_actor_thread():
+            return function(*args)
+        future = concurrent.futures.Future()
+        with self._pending_lock:
+            if self._stopped:
+                raise RuntimeError("MusicManager has quit")
+            self._pending.add(future)
+            try:
+                self._loop.call_soon_threadsafe(self._commands.put_nowait, (function, args, future))
+            except RuntimeError:
+                self._pending.discard(future)
+                raise RuntimeError("MusicManager has quit") from None
+        future.add_done_callback(self._forget_pending)
+        return future.result()
+
+    def _forget_pending(self, future: concurrent.futures.Future):
+        with self._pending_lock:
+            self._pending.discard(future)
+
+    def _fail_pending(self):
+        """Fails every command that was sent but never finished, so their callers
+        don't wait for an actor that has stopped."""
+        with self._pending_lock:
+            self._stopped = True
+            pending, self._pending = self._pending, set()
+        for future in pending:
+            _settle(future, exception=RuntimeError("MusicManager has quit"))
+
+    def _post(self, function: Callable, *args):
+        """Runs function on the actor without waiting for it."""
+        try:
+            self._loop.call_soon_threadsafe(function, *args)
+        except RuntimeError:
+            pass
 
     def set_on_song_change(self, on_song_change: Callable):
         self.on_song_change = on_song_change
 
     def call_on_song_change(self):
+        """Calls on_song_change with the new currently_playing and paused state."""
         if self.on_song_change is not None:
-            self.on_song_change()
+            self.on_song_change(currently_playing=self.currently_playing, paused=self.paused)
 
     def set_on_queue_change(self, on_queue_change):
         self.on_queue_change = on_queue_change
 
     def call_on_queue_change(self):
+        """Calls on_queue_change with the list of queue edits made since it was last called."""
+        ops, self._queue_ops = self._queue_ops, []
+        self._notify_downloads()
         if self.on_queue_change is not None:
-            self.on_queue_change()
+            self.on_queue_change(ops=ops)
 
     def _parse_downloaded_file_index(self):
-        """Reads cache/downloaded.txt, and returns each line stripped of newline.
+        """Reads cache/downloaded.txt, and returns the track IDs in it.
 
         Returns:
-            list[str]: List of each line in cache/downloaded.txt
+            set[str]: Each non-empty line in cache/downloaded.txt, stripped of newline
         """
         if os.path.isfile('cache/downloaded.txt'):
             with open('cache/downloaded.txt', encoding='utf-8') as f:
                 lines = f.readlines()
-                return [line.rstrip('\n') for line in lines]
+                return {line.rstrip('\n') for line in lines if line.strip()}
         else:
-            return []
+            return set()
 
-    def download_manager(self):
-        while True:
-            time.sleep(1)
-            if len(self.queue) > 0:
-                if self.queue[0] not in self._downloaded_songs:
-                    self.logger.info("Download Next in Queue: %s", self.queue[0])
-                    self.download_song(self.queue[0])
+    def use_shared_cache(self, shared_cache):
+        """Shares the download index through a TieredCache. Tracks downloaded by
+        other stations count as downloaded here when their file exists locally,
+        e.g. when cache/downloads is on shared storage.
+
+        Args:
+            shared_cache (TieredCache): The cache to share the index through.
+        """
+        self.shared_cache = shared_cache
+        self.shared_cache.add_members('downloaded', list(self._downloaded_songs))
+        for track_id in self.shared_cache.members('downloaded'):
+            if track_id not in self._downloaded_songs and os.path.exists(self.song_path(track_id)):
+                self._add_to_downloaded_index(track_id)
+
+    def song_path(self, track_id: str) -> str:
+        """Returns the path of the file holding a track's audio, which may be
+        shared with other track IDs of the same recording.
+
+        Args:
+            track_id (str): Spotify track ID.
+        """
+        return f'cache/downloads/{self.recordings.resolve(track_id)}.mp3'
+
+    def _tracks_to_download(self):
+        """Yields the tracks in the queue that still need downloading, in order,
+        skipping tracks that are being downloaded or recently failed to download.
+        """
+        for track_id in list(self.queue):
+            if track_id in self._downloaded_songs or track_id in self._downloading:
+                continue
+            if self.failed_downloads.is_unavailable(track_id):
+                continue
+            yield track_id
+
+    def _notify_downloads(self):
+        """Asks the actor to start any downloads that can start now. Requests are
+        coalesced until the actor runs them."""
+        if not self._downloads_scheduled:
+            self._downloads_scheduled = True
+            self._post(self._schedule_downloads)
+
+    def _schedule_downloads(self):
+        """Starts background downloads of queued tracks, as many at once as the
+        download controller allows. The next track to play gets a priority slot.
+        Runs on the actor whenever the queue changes or a download finishes.
+        """
+        self._downloads_scheduled = False
+        self.wakeups += 1
+        if self._stopped:
+            return
+        for track_id in self._tracks_to_download():
+            priority = len(self.queue) > 0 and self.queue[0] == track_id
+            slot = self.download_controller.start(priority)
+            if slot is None:
+                break
+            # Asked per download, so a half-open breaker lets exactly one trial through
+            if not self.download_breaker.allow():
+                slot.cancel()
+                # Try again when the breaker lets a trial download through
+                if self._breaker_timer is None:
+                    self._breaker_timer = self._loop.call_later(self.download_breaker.remaining(), self._breaker_closed)
+                break
+            self.logger.info("Download Next in Queue: %s", track_id)
+            self._start_download(track_id, False, slot)
+
+    def _breaker_closed(self):
+        self._breaker_timer = None
+        self._schedule_downloads()
 
     def pause(self):
         """Attempts to pause currently playing song, and sends notification on error.
         """
+        self._call(self._pause)
+
+    def _pause(self):
         try:
             self.player.pause()
             self.paused = True
@@ -78,33 +305,71 @@ class MusicManager():
     def unpause(self):
         """Attempts to unpause the currently playing song, and sends notification on error.
         """
+        self._call(self._unpause)
+
+    def _unpause(self):
         try:
             self.player.play()
             self.paused = False
         except (AttributeError, RuntimeError):
             os.system('notify-send \'Error while unpausing\'')
+        self._check_song_end(self._song_token)
 
-    def force_play_song(self, track_id: str, clear_queue: bool = False):
+    @traced('MusicManager.force_play_song', 'player')
+    def force_play_song(self, track_id: str, clear_queue: bool = False) -> bool:
         """Loads song immediately, but does not play it (call MusicManager.unpause). Will clear the queue if clear_queue is true.
 
         Args:
             track_id (str): The spotify track id of the song to play.
             clear_queue (bool, optional): Set to true to clear the queue. Defaults to False.
+
+        Returns:
+            bool: True if the song was loaded. False if it could not be downloaded, or
+                another song was played while it downloaded.
         """
-        self.player.stop()
-        if track_id not in self._downloaded_songs or not os.path.exists(f'cache/downloads/{track_id}.mp3'):
-            self.download_song(track_id)
+        return self._call(self._force_play_song, track_id, clear_queue)
+
+    async def _force_play_song(self, track_id: str, clear_queue: bool) -> bool:
+        self._play_token += 1
+        play_token = self._play_token
+        self._stop_for_load()
+        if track_id not in self._downloaded_songs or not os.path.exists(self.song_path(track_id)):
+            if track_id in self._downloaded_songs:
+                # Listed in the index but the file is missing, so download it again
+                self._downloaded_songs.discard(track_id)
+                self.audio_cache.discard(self.song_path(track_id))
+            downloaded = await _resolve(self.download_song(track_id))
+            if not downloaded:
+                self.logger.warning("Could not play %s, download failed", track_id)
+                return False
+            if play_token != self._play_token:
+                # Another song was played while this one downloaded
+                return False
         self.load_song(track_id)
         self.currently_playing = track_id
         if clear_queue:
             self.reset_queue()
+            self.call_on_queue_change()
 
-        self.call_on_song_change()
+        return True
+
+    def _stop_for_load(self):
+        """Stops the current song while the next one is loaded, so the stopped song
+        isn't mistaken for one that has ended and replaced from the queue."""
+        self.player.stop()
+        self._song_token += 1
+        if self._song_timer is not None:
+            self._song_timer.cancel()
+            self._song_timer = None
 
     def reset_queue(self):
         """Sets the queue to an empty list.
         """
+        self._call(self._reset_queue)
+
+    def _reset_queue(self):
         self.queue = []
+        self._queue_ops.append(('reset',))
 
     def add_song_to_queue(self, track_id: str, call_on_queue_change: bool = True):
         """Adds a track to the queue.
@@ -112,9 +377,7 @@ class MusicManager():
         Args:
             track_id (str): Spotify track ID to add to queue.
         """
-        self.queue.append(track_id)
-        if call_on_queue_change:
-            self.call_on_queue_change()
+        self._call(self._add_songs_to_queue, [track_id], call_on_queue_change)
 
     def add_songs_to_queue(self, track_ids: list[str]):
         """Adds a list of tracks to the queue.
@@ -122,24 +385,123 @@ class MusicManager():
         Args:
             track_ids (list[str]): List of track ids to add to the queue.
         """
-        for track in track_ids:
-            self.add_song_to_queue(track, False)
+        self._call(self._add_songs_to_queue, list(track_ids), True)
 
-        self.call_on_queue_change()
+    def _add_songs_to_queue(self, track_ids: list[str], call_on_queue_change: bool):
+        self.queue.extend(track_ids)
+        self._queue_ops.append(('append', track_ids))
+        if call_on_queue_change:
+            self.call_on_queue_change()
+
+    def download_song(self, track_id: str, force: bool = False) -> bool:
+        """Calls SpotDL to download a song if not already downloaded.
 
-    def download_song(self, track_id: str, force: bool = False):
-        """Calls SpotDL to download a song if not already downloaded
+        Failed downloads are recorded in the failure cache, and the track is not
+        retried until its backoff has passed (unless force is set). If the track is
+        already being downloaded, waits for that download instead. Someone is
+        waiting for the song, so it gets a priority slot.
 
         Args:
             track_id (str): Spotify track ID to download.
-            force (bool): Set to true to download even if already downloaded.
+            force (bool): Set to true to download even if already downloaded or recently failed.
+
+        Returns:
+            bool: True if the song is downloaded, False if the download failed or was skipped.
         """
-        if track_id not in self._downloaded_songs or force:
+        return self._call(self._download_song, track_id, force)
+
+    async def _download_song(self, track_id: str, force: bool) -> bool:
+        task = self._downloading.get(track_id)
+        if task is None:
+            task = self._start_download(track_id, force, self.download_controller.start(priority=True))
+        # Shielded so that a superseded caller doesn't cancel a download others wait for
+        return await asyncio.shield(task)
+
+    def _start_download(self, track_id: str, force: bool, slot: DownloadSlot) -> asyncio.Task:
+        task = self._loop.create_task(self._download(track_id, force, slot))
+        self._downloading[track_id] = task
+        task.add_done_callback(lambda _: self._download_finished(track_id))
+        return task
+
+    def _download_finished(self, track_id: str):
+        self._downloading.pop(track_id, None)
+        self._notify_downloads()
+
+    async def _download(self, track_id: str, force: bool, slot: DownloadSlot) -> bool:
+        """Downloads a track. Runs on the actor, which owns the download index,
+        failure cache, breaker and recording index; only the ISRC lookup and
+        spotdl run in an executor."""
+        try:
+            if track_id in self._downloaded_songs and not force:
+                return True
+            if self.failed_downloads.is_unavailable(track_id) and not force:
+                self.logger.info("Skipping unavailable track: %s", track_id)
+                return False
+            executor = self._priority_executor if slot.priority else self._download_executor
+
+            # Another track ID of the same recording may already be downloaded
+            if self.recordings.needs_lookup(track_id):
+                try:
+                    isrc = await self._loop.run_in_executor(executor, self.recordings.lookup_isrc, track_id)
+                except Exception:
+                    # Try again next time rather than remembering a failed lookup
+                    pass
+                else:
+                    self.recordings.add_isrc(track_id, isrc)
+            if self.recordings.resolve(track_id) != track_id and os.path.exists(self.song_path(track_id)):
+                self.logger.info("Using existing recording %s for %s", self.recordings.resolve(track_id), track_id)
+                self._add_to_downloaded_index(track_id)
+                return True
+
             self.logger.info("Downloading: %s", track_id)
-            download_song(track_id)
+            result, size = await self._loop.run_in_executor(executor, self._run_spotdl, track_id, slot.rate_limit)
+            path = f'cache/downloads/{track_id}.mp3'
+            if isinstance(result, tuple) or size is None:
+                slot.finish(False)
+                delay = self.failed_downloads.record_failure(track_id)
+                self.download_breaker.record_failure()
+                self.logger.warning("Download failed: %s (%s), retrying in %ds", track_id, result, delay)
+                if self.download_breaker.is_open:
+                    self.logger.warning("Too many failed downloads, pausing downloads for %ds",
+                                        self.download_breaker.remaining())
+                return False
+
+            # spotdl returns the track ID when it skipped an existing file, which says nothing about the network
+            slot.finish(True, size)
+            self.failed_downloads.record_success(track_id)
+            self.download_breaker.record_success()
+            if not self.recordings.needs_lookup(track_id):
+                self.recordings.set_file(track_id)
+            self._add_to_downloaded_index(track_id)
+            if result is None:
+                # Runs in worker processes, the song can already be played while it is processed
+                self.post_processor.submit(track_id, path)
+            return True
+        finally:
+            slot.cancel()
+
+    @staticmethod
+    def _run_spotdl(track_id: str, rate_limit: int | None) -> tuple:
+        """Runs spotdl in an executor.
+
+        Returns:
+            tuple: spotdl's result, and the bytes downloaded (0 if spotdl skipped an
+                existing file), or None if there is no file.
+        """
+        result = download_song(track_id, rate_limit=rate_limit)
+        path = f'cache/downloads/{track_id}.mp3'
+        if isinstance(result, tuple) or not os.path.exists(path):
+            return result, None
+        return result, os.path.getsize(path) if result is None else 0
+
+    def _add_to_downloaded_index(self, track_id: str):
+        """Appends a track to cache/downloaded.txt if it isn't listed yet."""
+        if track_id not in self._downloaded_songs:
             with open('cache/downloaded.txt', "a", encoding='utf-8') as f:
                 f.write(f'\n{track_id}')
-                self._downloaded_songs.append(track_id)
+                self._downloaded_songs.add(track_id)
+            if self.shared_cache is not None:
+                self.shared_cache.add_members('downloaded', [track_id])
 
     def load_song(self, track_id: str):
         """Loads a track in python with full path.
@@ -147,49 +509,193 @@ class MusicManager():
         Args:
             track_id (str): Spotify track ID to load.
         """
-        self.player.load_song(f"cache/downloads/{track_id}.mp3")
+        self._call(self._load_song, track_id)
+
+    def _load_song(self, track_id: str, remember: bool = True):
+        if remember and self.currently_playing is not None and self.currently_playing != track_id:
+            self.history.append(self.currently_playing)
+        path = self.song_path(track_id)
+        data = self.audio_cache.get(path)
+        self.player.load_song(path, data)
+        if data is None:
+            # Read into the cache off the actor, so going back to this song is instant
+            self._loop.run_in_executor(None, self.audio_cache.load, path)
         self.currently_playing = track_id
         self.paused = True
 
         self.call_on_song_change()
-
+        self._start_song_timer(track_id)
+
+    def _start_song_timer(self, track_id: str):
+        """Schedules the end of song check from the song's duration, probing the
+        file in an executor if the duration isn't in the metadata."""
+        self._song_token += 1
+        token = self._song_token
+        if self._song_timer is not None:
+            self._song_timer.cancel()
+            self._song_timer = None
+        self._song_duration = self.lookup_duration(track_id) if self.lookup_duration is not None else None
+        if self._song_duration is not None:
+            self._check_song_end(token)
+            return
+
+        def probed(future: asyncio.Future):
+            if token != self._song_token:
+                return
+            try:
+                self._song_duration = future.result()['duration']
+            except Exception:
+                self._song_duration = None
+            self._check_song_end(token)
+        self._loop.run_in_executor(None, probe_duration, self.song_path(track_id)).add_done_callback(probed)
+
+    def _check_song_end(self, token: int):
+        """Ends the song if it has finished, otherwise checks again when it should
+        have. Paused songs aren't checked until they are unpaused."""
+        if token != self._song_token or self.currently_playing is None:
+            return
+        self.wakeups += 1
+        if self._song_timer is not None:
+            self._song_timer.cancel()
+            self._song_timer = None
+        if self.player.paused:
+            return
+
+        if self.player.is_busy():
+            if self._song_duration is not None:
+                delay = max(self._song_duration - self.player.position(), 0) + 0.25
+            else:
+                # Without a duration all that can be done is to check now and then
+                delay = 1.0
+            self._song_timer = self._loop.call_later(delay, self._check_song_end, token)
+            return
+        self._song_token += 1
+        self._loop.create_task(self._on_song_end())
+
+    @traced('MusicManager.on_song_end', 'player')
     def on_song_end(self):
         """Runs when the currently playing song ends (don't call)
         """
+        self._call(self._on_song_end)
+
+    async def _on_song_end(self):
+        if self.currently_playing is not None:
+            self.history.append(self.currently_playing)
         self.currently_playing = None
         self.paused = True
         if len(self.queue) > 0:
-            self.currently_playing = self.queue[0]
-            self.force_play_song(self.queue[0])
-            self.queue.pop(0)
+            if not await self._play_next_in_queue():
+                self.call_on_song_change()
+            self.call_on_queue_change()
 
-            self.call_on_song_change()
+    async def _play_next_in_queue(self) -> bool:
+        """Pops songs off the front of the queue until one can be played,
+        skipping tracks that are known to be unavailable.
+
+        Returns:
+            bool: True if a song was loaded. False if the queue ran out, or another
+                song was played while one from the queue downloaded.
+        """
+        while len(self.queue) > 0:
+            track_id = self.queue.pop(0)
+            self._queue_ops.append(('pop', 1))
+            if self.failed_downloads.is_unavailable(track_id):
+                self.logger.info("Skipping unavailable track in queue: %s", track_id)
+                continue
+            # force_play_song takes the next play token
+            play_token = self._play_token + 1
+            if await _resolve(self.force_play_song(track_id)):
+                return True
+            if play_token != self._play_token:
+                return False
+        return False
 
     def play_queue(self):
         """Plays the first song in the queue.
         """
-        self.logger.info("Playing %s", self.queue[0])
-        self.force_play_song(self.queue[0])
-        self.queue.pop(0)
+        return self._call(self._play_queue)
 
-        self.call_on_song_change()
+    async def _play_queue(self):
+        if len(self.queue) > 0:
+            self.logger.info("Playing %s", self.queue[0])
+        if not await self._play_next_in_queue():
+            self.call_on_song_change()
         self.call_on_queue_change()
 
-    def skip_forward(self):
+    @traced('MusicManager.skip_forward', 'player')
+    def skip_forward(self) -> bool:
+        """Plays the next song in the queue.
+
+        Returns:
+            bool: True if a song from the queue was loaded.
+        """
+        return self._call(self._skip_forward)
+
+    async def _skip_forward(self) -> bool:
         if len(self.queue) < 1:
             return False
-        else:
-            self.logger.info("Skipping to %s from %s", self.queue[0], self.currently_playing)
-            self.pause()
-            self.force_play_song(self.queue[0])
-            self.queue.pop(0)
+        self.logger.info("Skipping to %s from %s", self.queue[0], self.currently_playing)
+        self.pause()
+        played = await self._play_next_in_queue()
+        if not played:
             self.call_on_song_change()
-            self.call_on_queue_change()
+        self.call_on_queue_change()
+        return played
+
+    @traced('MusicManager.previous', 'player')
+    def previous(self) -> bool:
+        """Goes back to the last song played, putting the current song back at the
+        front of the queue. Restarts the current song instead if more than
+        RESTART_AFTER seconds of it have played, or if no song was played before it.
+
+        Returns:
+            bool: False if there is no song to go back to.
+        """
+        return self._call(self._previous)
+
+    def _previous(self) -> bool:
+        current = self.currently_playing
+        if current is not None and (self.player.position() > RESTART_AFTER or not self.history):
+            self.logger.info("Restarting %s", current)
+            self._load_song(current, remember=False)
+            return True
+
+        while self.history:
+            track_id = self.history.pop()
+            path = self.song_path(track_id)
+            if path not in self.audio_cache and not os.path.exists(path):
+                continue
+            self.logger.info("Going back to %s from %s", track_id, current)
+            # Stops a song still downloading for force_play_song from replacing this one
+            self._play_token += 1
+            if current is not None:
+                self.queue.insert(0, current)
+                self._queue_ops.append(('insert', 0, [current]))
+            self._load_song(track_id, remember=False)
+            if current is not None:
+                self.call_on_queue_change()
+            return True
+        return False
+
+    def quit(self, wait: bool = False):
+        """Stops playback, the actor and pygame.
 
-    def quit(self):
-        """Stops playback and quits pygame.
+        Args:
+            wait (bool, optional): Wait for downloads and post-processing in progress. Defaults to False.
         """
+        if self._loop.is_closed():
+            return
         self.paused = True
         self.currently_playing = None
-        self.player.stop()
-        self.player.quit()
\ No newline at end of file
+        try:
+            self._call(self.player.stop)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        except RuntimeError:
+            pass
+        if not self._on_actor_thread():
+            self._actor_thread.join(5)
+        self._fail_pending()
+        self._download_executor.shutdown(wait=wait, cancel_futures=True)
+        self._priority_executor.shutdown(wait=wait, cancel_futures=True)
+        self.player.quit()
+        self.post_processor.shutdown(wait)
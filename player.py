@@ -1,11 +1,18 @@
+import os
+
 import pygame
-import threading
-import time
+
+from io import BytesIO
+
+from tracing import traced
 
 class MusicPlayer():
     """This is a MusicPlayer class, which can load and play music files using pygame.mixer.
+
+    The player doesn't watch for the end of a song itself, MusicManager schedules
+    a check for when the song should end using position().
     """
-    def __init__(self, queue: list[str] = [], on_song_end_hook = None):
+    def __init__(self, queue: list[str] = []):
         """Initialises the MusicPlayer class.
 
         Args:
@@ -16,53 +23,53 @@ class MusicPlayer():
         self.queue = queue
 
         self._paused = False
-        self._watch_song_end_thread = threading.Thread(target=self._watch_song_end)
-        self._watch_song_end_started = False
-        self.on_song_end_hook = on_song_end_hook
-        self._quitting = False
-
-    def _watch_song_end(self):
-        was_playing = False
-        while not self._quitting:
-            is_playing = pygame.mixer.music.get_busy()
-            if was_playing and not is_playing and not self._paused:
-                self.on_song_finish()
-            was_playing = is_playing
-            time.sleep(0.5)
-
-    def load_song(self, path: str = ""):
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    def is_busy(self) -> bool:
+        """True while a song is loaded and hasn't finished (including while paused)."""
+        return pygame.mixer.music.get_busy() or self._paused
+
+    def position(self) -> float:
+        """Returns how many seconds of the current song have been played."""
+        return max(pygame.mixer.music.get_pos(), 0) / 1000
+
+    @traced('player.load_song', 'player')
+    def load_song(self, path: str = "", data: bytes | None = None):
         """Loads a song for pygame, will load 0th song in queue if path not provided.
 
         Args:
             path (str, optional): The path of the song to play. Defaults to "".
+            data (bytes | None, optional): Contents of the file at path, to play from memory
+                instead of reading the file. Defaults to None.
         """
-        if not self._watch_song_end_started:
-            self._watch_song_end_thread.start()
-            self._watch_song_end_started = True
-        if len(path) > 0:
+        if data is not None:
+            pygame.mixer.music.load(BytesIO(data), os.path.splitext(path)[1].lstrip('.') or 'mp3')
+        elif len(path) > 0:
             pygame.mixer.music.load(path)
         else:
             pygame.mixer.music.load(self.queue[0])
 
         pygame.mixer.music.play()
+        self._paused = False
 
+    @traced('player.play', 'player')
     def play(self):
         pygame.mixer.music.unpause()
         self._paused = False
 
+    @traced('player.pause', 'player')
     def pause(self):
         pygame.mixer.music.pause()
         self._paused = True
 
-    def on_song_finish(self):
-        if self.on_song_end_hook is not None:
-            self.on_song_end_hook()
-
+    @traced('player.stop', 'player')
     def stop(self):
         pygame.mixer.music.stop()
         self._paused = False
 
     def quit(self):
-        self._quitting = True
         pygame.mixer.quit()
 
@@ -0,0 +1,237 @@
+"""Runs CPU heavy work on downloaded songs in ffmpeg processes.
+
+After spotdl has downloaded a song, it is handed to PostDownloadPipeline, which
+runs these stages on a worker thread:
+
+1. probe_duration: reads the duration with ffprobe.
+2. analyse_loudness: measures integrated loudness and works out the ReplayGain.
+3. download_cover: fetches the album art named in the song's metadata.
+4. embed_tags: writes the tags, ReplayGain and album art into the mp3.
+5. convert: converts the mp3 to an 8 bit 22050Hz wav.
+
+Each stage is recorded as a span when tracing is on.
+
+Every stage is an ffprobe or ffmpeg process, so the work runs in parallel on
+those processes and the worker threads only wait for them. The workers and the
+processes they start run at a lower priority, so this never competes with
+playback or blocks the download threads, and the results are passed to
+on_result to be saved with the song's metadata.
+"""
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+
+from collections.abc import Callable
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+import requests
+
+from tracing import span
+
+# ReplayGain 2.0 reference loudness in LUFS
+REPLAYGAIN_REFERENCE = -18.0
+
+
+def probe_duration(path: str) -> dict:
+    """Returns the duration of an audio file in seconds."""
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+         '-of', 'default=noprint_wrappers=1:nokey=1', path],
+        check=True, capture_output=True, text=True
+    )
+    return {'duration': float(result.stdout.strip())}
+
+
+def analyse_loudness(path: str) -> dict:
+    """Returns the integrated loudness (LUFS) and ReplayGain (dB) of an audio file."""
+    result = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-nostats', '-i', path, '-af', 'loudnorm=print_format=json', '-f', 'null', '-'],
+        check=True, capture_output=True, text=True
+    )
+    match = re.search(r'\{[^{}]*"input_i"[^{}]*\}', result.stderr)
+    if match is None:
+        raise ValueError("No loudness in ffmpeg output")
+    loudness = float(json.loads(match.group(0))['input_i'])
+    return {
+        'loudness':                 loudness,
+        'replaygain-track-gain':    round(REPLAYGAIN_REFERENCE - loudness, 2)
+    }
+
+
+def download_cover(url: str, path: str) -> dict:
+    """Saves the album art at url to path."""
+    response = requests.get(url, timeout=10)
+    response.raise_for_status()
+    with open(path, 'wb') as file:
+        file.write(response.content)
+    return {}
+
+
+def embed_tags(path: str, tags: dict[str, str], cover: str | None = None) -> dict:
+    """Writes tags (and optionally cover art) into an mp3 without re-encoding it.
+
+    The file is written to a temporary file and moved over the original, so a
+    player that has the original open keeps reading the old file.
+    """
+    temp_path = f'{path}.tagging.mp3'
+    cmd = ['ffmpeg', '-y', '-hide_banner', '-i', path]
+    if cover is not None:
+        cmd += ['-i', cover, '-map', '0:a', '-map', '1:v', '-disposition:v', 'attached_pic']
+    for key, value in tags.items():
+        cmd += ['-metadata', f'{key}={value}']
+    cmd += ['-c', 'copy', '-id3v2_version', '3', temp_path]
+
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return {'tagged': True}
+
+
+def convert(path: str) -> dict:
+    """Converts an mp3 to an 8 bit 22050Hz wav next to it."""
+    wav_path = f'{os.path.splitext(path)[0]}.wav'
+    subprocess.run(
+        ['ffmpeg', '-y', '-i', path, '-vn', '-acodec', 'pcm_u8', '-ar', '22050', wav_path],
+        check=True, capture_output=True, text=True
+    )
+    return {'wav-path': wav_path}
+
+
+def process_track(path: str, metadata: dict[str, str] | None = None) -> dict:
+    """Runs every stage on a downloaded song. Runs on a worker thread.
+
+    A failing stage is recorded in 'post-process-errors' and doesn't stop the later stages.
+
+    Args:
+        path (str): Path of the downloaded mp3.
+        metadata (dict[str, str] | None, optional): Song metadata for the tags and
+            album art. Defaults to None.
+
+    Returns:
+        dict: Results of all the stages, to be saved with the song's metadata.
+    """
+    results = {}
+    errors = {}
+
+    def run(stage: str, function: Callable, *args) -> bool:
+        try:
+            with span(f'post-process {stage}', 'post-process', path=path):
+                results.update(function(*args))
+            return True
+        except (OSError, subprocess.CalledProcessError, ValueError, requests.RequestException) as e:
+            errors[stage] = str(e)
+            return False
+
+    run('duration', probe_duration, path)
+    run('loudness', analyse_loudness, path)
+
+    tags = {}
+    cover = None
+    cover_path = f'{path}.cover.jpg'
+    if metadata is not None:
+        tags.update({'title': metadata.get('name', ''), 'artist': metadata.get('artist-name', ''),
+                     'album': metadata.get('album-name', '')})
+        if metadata.get('isrc'):
+            tags['TSRC'] = metadata['isrc']
+        # Older metadata only has the thumbnail sized cover
+        cover_url = metadata.get('album-art-url') or metadata.get('album-cover-url')
+        if cover_url and run('cover', download_cover, cover_url, cover_path):
+            cover = cover_path
+    if 'replaygain-track-gain' in results:
+        tags['REPLAYGAIN_TRACK_GAIN'] = f"{results['replaygain-track-gain']:.2f} dB"
+    try:
+        if tags or cover is not None:
+            run('tags', embed_tags, path, tags, cover)
+    finally:
+        if os.path.exists(cover_path):
+            os.remove(cover_path)
+
+    run('convert', convert, path)
+
+    if errors:
+        results['post-process-errors'] = errors
+    return results
+
+
+def _lower_priority():
+    """Runs on each worker thread so that post-processing yields to playback.
+
+    Linux keeps a nice value per thread, which the ffmpeg processes a thread starts
+    inherit. Elsewhere it applies to the whole process, so it is left alone.
+    """
+    if sys.platform != 'linux':
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except OSError:
+        pass
+
+
+class PostDownloadPipeline():
+    """Runs process_track for downloaded songs on a pool of worker threads."""
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        executor: Executor | None = None,
+        logger: logging.Logger | None = None
+        ):
+        """Initialises the PostDownloadPipeline. Worker threads start on the first submit.
+
+        Args:
+            max_workers (int | None, optional): Songs processed at once. Defaults to half the CPUs.
+            executor (Executor | None, optional): Executor to use instead of a thread pool. Defaults to None.
+        """
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=max_workers or max(1, (os.cpu_count() or 2) // 2),
+                thread_name_prefix='post-process',
+                initializer=_lower_priority
+            )
+        self.executor = executor
+
+        # Called with (track_id, results) when a song has been processed
+        self.on_result: Callable[[str, dict], None] | None = None
+        # Called with a track ID to get the metadata to tag the song with
+        self.lookup_metadata: Callable[[str], dict | None] | None = None
+
+    def submit(self, track_id: str, path: str) -> Future:
+        """Queues a downloaded song for processing.
+
+        Args:
+            track_id (str): Spotify track ID of the song.
+            path (str): Path of the downloaded mp3.
+        """
+        metadata = self.lookup_metadata(track_id) if self.lookup_metadata is not None else None
+        with span('post-process submit', 'post-process', track=track_id):
+            future = self.executor.submit(process_track, path, metadata)
+        future.add_done_callback(lambda done: self._done(track_id, done))
+        return future
+
+    def _done(self, track_id: str, future: Future):
+        if future.cancelled():
+            return
+        try:
+            results = future.result()
+        except Exception:
+            self.logger.exception("Post-processing %s failed", track_id)
+            return
+        if 'post-process-errors' in results:
+            self.logger.warning("Post-processing %s: %s", track_id, results['post-process-errors'])
+        if self.on_result is not None:
+            self.on_result(track_id, results)
+
+    def shutdown(self, wait: bool = False):
+        """Stops the workers, dropping songs that haven't started processing.
+
+        Args:
+            wait (bool, optional): Wait for the songs being processed. Defaults to False.
+        """
+        self.executor.shutdown(wait=wait, cancel_futures=True)
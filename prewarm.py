@@ -0,0 +1,160 @@
+"""Fetches every playlist in the background so that opening one is instant."""
+import logging
+import os
+import pickle
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from spotipy.exceptions import SpotifyException
+
+from tracing import span, traced
+
+
+class PlaylistHistory():
+    """Remembers when each playlist was last opened, so the most used playlists
+    can be fetched first.
+    """
+    def __init__(self, path: str = 'cache/playlist_history.pkl', clock = time.time):
+        """Initialises the PlaylistHistory.
+
+        Args:
+            path (str, optional): Where to store the history. Defaults to 'cache/playlist_history.pkl'.
+        """
+        self.path = path
+        self.clock = clock
+        self._opened: dict[str, float] = self._read()
+
+    @traced('playlist_history.pkl read', 'pickle')
+    def _read(self) -> dict[str, float]:
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'rb') as file:
+                    return pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                return {}
+        return {}
+
+    @traced('playlist_history.pkl write', 'pickle')
+    def _write(self):
+        try:
+            with open(self.path, 'wb') as file:
+                pickle.dump(self._opened, file)
+        except OSError:
+            pass
+
+    def record(self, playlist_id: str):
+        """Records that a playlist was opened."""
+        self._opened[playlist_id] = self.clock()
+        self._write()
+
+    def most_recent_first(self, playlist_ids: list[str]) -> list[str]:
+        """Sorts playlists by when they were last opened. Playlists never opened
+        keep their order, after the opened ones.
+        """
+        return sorted(playlist_ids, key=lambda playlist_id: -self._opened.get(playlist_id, 0))
+
+
+class PlaylistWarmer():
+    """Fetches the track lists, song metadata and names of playlists in the
+    background, filling the caches PlaylistView reads from.
+
+    Only a few playlists are fetched at once. When Spotify rate limits a request
+    (HTTP 429), every worker waits for the Retry-After period before continuing.
+    """
+    def __init__(
+        self,
+        spotify_client,
+        song_metadata_file,
+        history: PlaylistHistory | None = None,
+        max_workers: int = 2,
+        max_retries: int = 3,
+        logger: logging.Logger | None = None,
+        clock = time.monotonic
+        ):
+        """Initialises the PlaylistWarmer.
+
+        Args:
+            spotify_client (SpotifyClient): Client to fetch playlists with.
+            song_metadata_file (SongMetadataFile): Where to save song metadata.
+            history (PlaylistHistory | None, optional): Used to fetch recently opened playlists first.
+            max_workers (int, optional): Playlists fetched at once. Defaults to 2.
+            max_retries (int, optional): Retries of a rate limited playlist. Defaults to 3.
+        """
+        self.spotify_client = spotify_client
+        self.song_metadata_file = song_metadata_file
+        self.history = history
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.clock = clock
+
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self, playlist_ids: list[str]):
+        """Starts warming playlists on a background thread, unless it is already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.warm, args=(list(playlist_ids),), name='playlist-warmer', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = False):
+        """Stops warming after the playlists being fetched now.
+
+        Args:
+            wait (bool, optional): Wait for those playlists. Defaults to False.
+        """
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    @traced('PlaylistWarmer.warm', 'prewarm')
+    def warm(self, playlist_ids: list[str]) -> int:
+        """Fetches playlists, most recently opened first, and returns how many were fetched."""
+        if self.history is not None:
+            playlist_ids = self.history.most_recent_first(playlist_ids)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='playlist-warmer') as executor:
+            return sum(executor.map(self._warm_playlist, playlist_ids))
+
+    def _wait_for_rate_limit(self) -> bool:
+        """Sleeps until a Retry-After period has passed. Returns False if stopped."""
+        while True:
+            with self._lock:
+                remaining = self._resume_at - self.clock()
+            if remaining <= 0:
+                return not self._stop.is_set()
+            if self._stop.wait(remaining):
+                return False
+
+    def _warm_playlist(self, playlist_id: str) -> bool:
+        url = f'https://open.spotify.com/playlist/{playlist_id}'
+        for _ in range(self.max_retries + 1):
+            if not self._wait_for_rate_limit():
+                return False
+            try:
+                with span('warm playlist', 'prewarm', playlist=playlist_id):
+                    items = self.spotify_client.get_playlist_items(url)
+                    known = self.song_metadata_file.get_many([item['id'] for item in items])
+                    self.song_metadata_file.add_many({
+                        item['id']: item for item in items
+                        if item['id'] not in known or 'album-cover-url' not in known[item['id']]
+                    })
+                    self.spotify_client.get_playlist_metadata(url)
+                return True
+            except SpotifyException as e:
+                if e.http_status != 429:
+                    self.logger.warning("Could not warm playlist %s: %s", playlist_id, e)
+                    return False
+                retry_after = int((e.headers or {}).get('Retry-After', 1))
+                self.logger.info("Rate limited while warming playlists, waiting %ds", retry_after)
+                with self._lock:
+                    self._resume_at = max(self._resume_at, self.clock() + retry_after)
+            except Exception as e:
+                self.logger.warning("Could not warm playlist %s: %s", playlist_id, e)
+                return False
+        return False
@@ -0,0 +1,119 @@
+"""Maps Spotify track IDs to recordings so identical audio is only stored once."""
+import os
+import pickle
+import threading
+
+from collections.abc import Callable
+
+from tracing import traced
+
+
+class RecordingIndex():
+    """An index of which downloaded file holds the audio for each recording.
+
+    The same recording (identified by its ISRC) often appears under several
+    Spotify track IDs, e.g. the single, album and compilation versions. Audio is
+    stored under the track ID it was first downloaded as, and every other track
+    ID with the same ISRC is an alias that resolves to that file. Safe to use from
+    several download threads at once.
+    """
+    def __init__(self, path: str = 'cache/recordings.pkl', lookup_isrc: Callable[[str], str | None] | None = None) -> None:
+        """Initialises the RecordingIndex.
+
+        Args:
+            path (str, optional): Where to store the index. Defaults to 'cache/recordings.pkl'.
+            lookup_isrc (Callable, optional): Called with a track ID to find its ISRC when
+                it is not in the index yet. Defaults to None.
+        """
+        self.path = path
+        self.lookup_isrc = lookup_isrc
+        # Held while changing and writing the index, so a write never sees it half changed
+        self._lock = threading.Lock()
+
+        data = self._read()
+        self._isrcs: dict[str, str | None] = data.get('isrcs', {})
+        self._files: dict[str, str] = data.get('files', {})
+
+    @traced('recordings.pkl read', 'pickle')
+    def _read(self) -> dict[str, dict]:
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'rb') as file:
+                    return pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                return {}
+        return {}
+
+    @traced('recordings.pkl write', 'pickle')
+    def _write(self):
+        try:
+            with open(self.path, 'wb') as file:
+                pickle.dump({'isrcs': self._isrcs, 'files': self._files}, file)
+        except OSError:
+            pass
+
+    def isrc_for(self, track_id: str) -> str | None:
+        """Returns the ISRC of a track, looking it up if it is not in the index.
+
+        Args:
+            track_id (str): Spotify track ID.
+
+        Returns:
+            str | None: The ISRC, or None if unknown.
+        """
+        if track_id in self._isrcs:
+            return self._isrcs[track_id]
+        if self.lookup_isrc is None:
+            return None
+
+        try:
+            isrc = self.lookup_isrc(track_id)
+        except Exception:
+            # Try again next time rather than remembering a failed lookup
+            return None
+        self.add_isrc(track_id, isrc)
+        return isrc
+
+    def needs_lookup(self, track_id: str) -> bool:
+        """True if isrc_for would have to call lookup_isrc for this track."""
+        return track_id not in self._isrcs and self.lookup_isrc is not None
+
+    def add_isrc(self, track_id: str, isrc: str | None):
+        """Records the ISRC of a track, e.g. one looked up with lookup_isrc on another thread."""
+        with self._lock:
+            self._isrcs[track_id] = isrc
+            self._write()
+
+    def resolve(self, track_id: str) -> str:
+        """Returns the track ID whose file holds the audio for track_id.
+
+        Args:
+            track_id (str): Spotify track ID.
+
+        Returns:
+            str: The stored track ID, which is track_id itself if it has no alias.
+        """
+        isrc = self._isrcs.get(track_id)
+        if isrc is None:
+            return track_id
+        return self._files.get(isrc, track_id)
+
+    def set_file(self, track_id: str):
+        """Marks the file downloaded for track_id as the audio of its recording.
+
+        Args:
+            track_id (str): Spotify track ID that was just downloaded.
+        """
+        isrc = self.isrc_for(track_id)
+        with self._lock:
+            if isrc is not None and self._files.get(isrc) != track_id:
+                self._files[isrc] = track_id
+                self._write()
+
+    def aliases(self, track_id: str) -> list[str]:
+        """Returns every known track ID that shares a recording with track_id."""
+        isrc = self._isrcs.get(track_id)
+        if isrc is None:
+            return [track_id]
+        with self._lock:
+            return [track for track, track_isrc in self._isrcs.items() if track_isrc == isrc]
@@ -0,0 +1,10 @@
+"""Serves the spotdl-tui frontend in a browser using textual-serve.
+
+Start `python daemon.py` first so that every browser session attaches to the
+same daemon instead of starting its own player and downloads.
+"""
+from textual_serve.server import Server
+
+if __name__ == "__main__":
+    server = Server("python main.py")
+    server.serve()
@@ -0,0 +1,273 @@
+"""Provides TieredCache, an in-process cache in front of an optional shared Redis cache."""
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+REDIS_URL = os.getenv('SPOTDL_TUI_REDIS_URL')
+
+_L2_ERRORS = (OSError,) if redis is None else (OSError, redis.RedisError)
+_MISSING = object()
+
+
+class TieredCache():
+    """A two level cache for song metadata, playlist listings and the download index.
+
+    Lookups check an in-process dict (L1) first, then Redis (L2) if a Redis URL is
+    configured, so every station benefits from lookups any one station has done.
+    Writes go to L1 immediately and are batched into a single Redis pipeline, which
+    is flushed when batch_size writes are pending or flush_delay seconds after the
+    first pending write. Without Redis the cache is L1 only.
+
+    L1 keeps the max_entries most recently used values of each bucket, so a burst
+    of writes to one bucket can't evict another. Writes in a pipeline that fails
+    stay pending and are retried after retry_delay; past max_pending, the oldest
+    pending writes are dropped and counted in dropped_writes. After any L2 error,
+    reads skip L2 until retry_delay has passed rather than each waiting out the
+    socket timeout.
+
+    Values are stored in Redis as JSON under "{namespace}:{bucket}:{key}".
+    """
+    def __init__(
+        self,
+        url: str | None = None,
+        namespace: str = 'spotdl-tui',
+        batch_size: int = 128,
+        flush_delay: float = 0.2,
+        client = None,
+        logger: logging.Logger | None = None,
+        max_entries: int = 4096,
+        max_pending: int = 4096,
+        retry_delay: float = 5.0
+        ) -> None:
+        """Initialises the TieredCache.
+
+        Args:
+            url (str | None, optional): Redis URL, e.g. redis://localhost:6379/0. Defaults to None.
+            namespace (str, optional): Prefix for all Redis keys. Defaults to 'spotdl-tui'.
+            batch_size (int, optional): Pending writes that trigger a flush. Defaults to 128.
+            flush_delay (float, optional): Seconds to wait for more writes before flushing. Defaults to 0.2.
+            client (optional): Redis client to use instead of connecting to url. Defaults to None.
+            max_entries (int, optional): Values kept in L1 per bucket. Defaults to 4096.
+            max_pending (int, optional): Most values kept waiting for L2 while it fails. Defaults to 4096.
+            retry_delay (float, optional): Seconds before retrying a failed flush. Defaults to 5.0.
+        """
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.namespace = namespace
+        self.batch_size = batch_size
+        self.flush_delay = flush_delay
+        self.max_entries = max_entries
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self.failed_flushes = 0
+        self.dropped_writes = 0
+
+        self.l2 = client
+        if self.l2 is None and url:
+            if redis is None:
+                self.logger.warning("SPOTDL_TUI_REDIS_URL is set but redis is not installed, using local cache only")
+            else:
+                self.l2 = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+
+        self._l1: dict[str, OrderedDict[str, Any]] = {}
+        self._l1_lock = threading.Lock()
+        self._l1_sets: dict[str, set[str]] = {}
+        self._pending_values: dict[str, tuple[str, int | None]] = {}
+        self._pending_members: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+        self._flush_timer: threading.Timer | None = None
+        self._retry_at = 0.0
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'TieredCache':
+        """Creates a TieredCache using the SPOTDL_TUI_REDIS_URL environment variable."""
+        return cls(url=REDIS_URL, **kwargs)
+
+    @property
+    def shared(self) -> bool:
+        """True if a Redis L2 is configured."""
+        return self.l2 is not None
+
+    def _key(self, bucket: str, key: str) -> str:
+        return f'{self.namespace}:{bucket}:{key}'
+
+    def _l1_get(self, bucket: str, key: str, default: Any = None) -> Any:
+        with self._l1_lock:
+            values = self._l1.get(bucket)
+            if values is None or key not in values:
+                return default
+            values.move_to_end(key)
+            return values[key]
+
+    def _l1_set(self, bucket: str, key: str, value: Any):
+        with self._l1_lock:
+            values = self._l1.setdefault(bucket, OrderedDict())
+            values[key] = value
+            values.move_to_end(key)
+            while len(values) > self.max_entries:
+                values.popitem(last=False)
+
+    def _l2_readable(self) -> bool:
+        """True if L2 is configured and hasn't failed within the last retry_delay."""
+        return self.l2 is not None and time.monotonic() >= self._retry_at
+
+    def _l2_call(self, function, *args, default=None):
+        try:
+            return function(*args)
+        except _L2_ERRORS as e:
+            self.logger.warning("Shared cache unavailable: %s", e)
+            self._retry_at = time.monotonic() + self.retry_delay
+            return default
+
+    def get(self, bucket: str, key: str, default: Any = None) -> Any:
+        """Returns a cached value, checking L1 then L2.
+
+        Args:
+            bucket (str): Kind of value, e.g. 'metadata' or 'playlist-tracks'.
+            key (str): Key within the bucket.
+            default (Any, optional): Returned on a miss. Defaults to None.
+        """
+        value = self._l1_get(bucket, key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if not self._l2_readable():
+            return default
+
+        raw = self._l2_call(self.l2.get, self._key(bucket, key))
+        if raw is None:
+            return default
+        value = json.loads(raw)
+        self._l1_set(bucket, key, value)
+        return value
+
+    def get_many(self, bucket: str, keys: list[str]) -> dict[str, Any]:
+        """Returns the cached values of several keys, fetching all L1 misses from
+        L2 in a single round trip. Missing keys are left out of the result.
+        """
+        found = {}
+        misses = []
+        for key in keys:
+            value = self._l1_get(bucket, key, _MISSING)
+            if value is not _MISSING:
+                found[key] = value
+            else:
+                misses.append(key)
+
+        if misses and self._l2_readable():
+            raws = self._l2_call(self.l2.mget, [self._key(bucket, key) for key in misses], default=[])
+            for key, raw in zip(misses, raws):
+                if raw is not None:
+                    value = json.loads(raw)
+                    self._l1_set(bucket, key, value)
+                    found[key] = value
+        return found
+
+    def set(self, bucket: str, key: str, value: Any, ttl: int | None = None):
+        """Stores a value in L1 and queues it to be written to L2.
+
+        Args:
+            bucket (str): Kind of value.
+            key (str): Key within the bucket.
+            value (Any): JSON serialisable value.
+            ttl (int | None, optional): Seconds until the value expires in L2. Defaults to None.
+        """
+        self.set_many(bucket, {key: value}, ttl)
+
+    def set_many(self, bucket: str, values: dict[str, Any], ttl: int | None = None):
+        """Stores several values at once, see set()."""
+        for key, value in values.items():
+            self._l1_set(bucket, key, value)
+        if self.l2 is None:
+            return
+
+        with self._lock:
+            for key, value in values.items():
+                self._pending_values[self._key(bucket, key)] = (json.dumps(value), ttl)
+        self._schedule_flush()
+
+    def add_members(self, bucket: str, members: list[str]):
+        """Adds members to a shared set, such as the download index."""
+        self._l1_sets.setdefault(bucket, set()).update(members)
+        if self.l2 is None:
+            return
+
+        with self._lock:
+            self._pending_members.setdefault(self._key(bucket, 'members'), set()).update(members)
+        self._schedule_flush()
+
+    def members(self, bucket: str) -> 'set[str]':
+        """Returns every member of a shared set."""
+        members = set(self._l1_sets.get(bucket, set()))
+        if self._l2_readable():
+            raw = self._l2_call(self.l2.smembers, self._key(bucket, 'members'), default=set())
+            members.update(member.decode('utf-8') if isinstance(member, bytes) else member for member in raw)
+            self._l1_sets[bucket] = set(members)
+        return members
+
+    def _schedule_flush(self):
+        with self._lock:
+            pending = len(self._pending_values) + sum(len(m) for m in self._pending_members.values())
+            # After a failed flush, wait for the retry instead of flushing on every write
+            retrying = time.monotonic() < self._retry_at
+            if (pending < self.batch_size or retrying) and self._flush_timer is not None:
+                return
+            if pending < self.batch_size or retrying:
+                self._start_flush_timer(max(self.flush_delay, self._retry_at - time.monotonic()))
+                return
+        self.flush()
+
+    def _start_flush_timer(self, delay: float):
+        self._flush_timer = threading.Timer(delay, self.flush)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+
+    def flush(self):
+        """Writes all pending values to L2 in one pipeline."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            values, self._pending_values = self._pending_values, {}
+            members, self._pending_members = self._pending_members, {}
+
+        if self.l2 is None or (not values and not members):
+            return
+
+        pipeline = self.l2.pipeline(transaction=False)
+        for full_key, (raw, ttl) in values.items():
+            pipeline.set(full_key, raw, ex=ttl)
+        for full_key, new_members in members.items():
+            pipeline.sadd(full_key, *new_members)
+        if self._l2_call(pipeline.execute) is None:
+            self._requeue(values, members)
+        else:
+            self._retry_at = 0.0
+
+    def _requeue(self, values: dict[str, tuple[str, int | None]], members: 'dict[str, set[str]]'):
+        """Puts the writes of a failed flush back in front of newer pending writes
+        and schedules a retry."""
+        with self._lock:
+            self.failed_flushes += 1
+            # Values written since the failed flush are newer, so they win
+            self._pending_values = {**values, **self._pending_values}
+            for full_key, new_members in members.items():
+                self._pending_members.setdefault(full_key, set()).update(new_members)
+            overflow = len(self._pending_values) - self.max_pending
+            if overflow > 0:
+                for full_key in list(self._pending_values)[:overflow]:
+                    del self._pending_values[full_key]
+                self.dropped_writes += overflow
+                self.logger.warning("Shared cache unavailable, dropped %d pending writes", overflow)
+
+            self._retry_at = time.monotonic() + self.retry_delay
+            if self._flush_timer is None:
+                self._start_flush_timer(self.retry_delay)
@@ -0,0 +1,449 @@
+"""Headless soak test of spotdl-tui, for finding leaks in long sessions.
+
+Runs the real app with Textual's pilot against a fake Spotify API server and
+fake spotdl, ffmpeg and ffprobe executables, and simulates thousands of
+playlist opens, song clicks, skips, back-skips and queue edits. RSS, traced Python memory,
+thread count and open file descriptors are sampled as it runs, and the soak
+fails if any of them grows past its budget after the warmup:
+
+    python soak.py --iterations 5000
+
+Everything runs in a temporary directory, so the real cache is not touched.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import re
+import resource
+import stat
+import sys
+import tempfile
+import threading
+import tracemalloc
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import urlparse
+
+import spotipy
+
+from spotify import SpotifyClient
+
+# A silent MPEG-1 Layer III frame (128kbps, 44.1kHz). 12 frames play for about 0.3s.
+SILENT_MP3_FRAME = b'\xff\xfb\x90\x64' + bytes(413)
+SONG_SECONDS = 0.31
+
+FAKE_SPOTDL = f'''#!{sys.executable}
+"""Fake spotdl: writes a short silent mp3 for the requested track."""
+import sys
+track_id = sys.argv[1].rsplit('/', 1)[-1]
+with open(f'cache/downloads/{{track_id}}.mp3', 'wb') as file:
+    file.write({SILENT_MP3_FRAME!r} * 12)
+print(f'Downloaded "{{track_id}}": https://music.youtube.com/watch?v=soak')
+'''
+
+FAKE_FFPROBE = f'''#!{sys.executable}
+"""Fake ffprobe: every song has the same duration."""
+print({SONG_SECONDS})
+'''
+
+FAKE_FFMPEG = f'''#!{sys.executable}
+"""Fake ffmpeg: reports a loudness, otherwise copies the input to the output."""
+import shutil
+import sys
+args = sys.argv[1:]
+if any('loudnorm' in arg for arg in args):
+    sys.stderr.write('{{"input_i" : "-14.00", "input_tp" : "-1.00"}}\\n')
+else:
+    shutil.copyfile(args[args.index('-i') + 1], args[-1])
+'''
+
+
+def install_fake_tools(directory: str):
+    """Writes the fake spotdl, ffprobe and ffmpeg executables to directory."""
+    for name, source in (('spotdl', FAKE_SPOTDL), ('ffprobe', FAKE_FFPROBE), ('ffmpeg', FAKE_FFMPEG)):
+        path = os.path.join(directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(source)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+
+class FakeSpotifyServer():
+    """Serves the Spotify Web API endpoints spotdl-tui uses, with generated data.
+
+    Every rate_limit_every-th request gets a 429 with Retry-After: 0, to exercise
+    retries.
+    """
+    def __init__(self, playlists: int = 12, tracks_per_playlist: int = 25, tracks: int = 120, rate_limit_every: int = 50):
+        self.playlist_count = playlists
+        self.tracks_per_playlist = tracks_per_playlist
+        self.track_count = tracks
+        self.rate_limit_every = rate_limit_every
+        self.requests = 0
+
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-spotify', daemon=True)
+        self._image = self._cover_image()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    @property
+    def api_url(self) -> str:
+        return f'{self.url}/v1/'
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @staticmethod
+    def _cover_image() -> bytes | None:
+        try:
+            from PIL import Image
+        except ImportError:
+            return None
+        image = BytesIO()
+        Image.new('RGB', (64, 64), (30, 120, 200)).save(image, format='PNG')
+        return image.getvalue()
+
+    def track_ids(self) -> list[str]:
+        return [f'soaktrack{index:04d}' for index in range(self.track_count)]
+
+    def track(self, index: int) -> dict:
+        album = index % 23
+        return {
+            'id':           f'soaktrack{index:04d}',
+            'name':         f'Track {index}',
+            'artists':      [{'name': f'Artist {index % 17}', 'id': f'soakartist{index % 17}'}],
+            'album':        {
+                'id': f'soakalbum{album}', 'name': f'Album {album}',
+                'images': [{'url': f'{self.url}/images/soakalbum{album}.png', 'width': 64}]
+                if self._image is not None else []
+            },
+            'external_ids': {'isrc': f'SOAK{index:08d}'}
+        }
+
+    def playlist_tracks(self, playlist: int) -> list[dict]:
+        rng = random.Random(playlist)
+        return [self.track(index) for index in rng.sample(range(self.track_count), self.tracks_per_playlist)]
+
+    def route(self, path: str) -> tuple[int, bytes, str]:
+        """Returns the status, body and content type for a request path."""
+        if path.startswith('/images/'):
+            if self._image is None:
+                return 404, b'', 'text/plain'
+            return 200, self._image, 'image/png'
+
+        if path == '/v1/me/playlists':
+            body = {'items': [
+                {'name': f'Playlist {index}', 'id': f'soakplaylist{index}', 'snapshot_id': 'snapshot1'}
+                for index in range(self.playlist_count)
+            ], 'next': None}
+        elif match := re.fullmatch(r'/v1/playlists/soakplaylist(\d+)/tracks', path):
+            body = {'items': [{'track': track} for track in self.playlist_tracks(int(match.group(1)))], 'next': None}
+        elif match := re.fullmatch(r'/v1/playlists/soakplaylist(\d+)', path):
+            body = {'name': f'Playlist {match.group(1)}'}
+        elif match := re.fullmatch(r'/v1/tracks/soaktrack(\d+)', path):
+            body = self.track(int(match.group(1)))
+        else:
+            return 404, json.dumps({'error': {'status': 404, 'message': 'Not found'}}).encode(), 'application/json'
+        return 200, json.dumps(body).encode(), 'application/json'
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    rate_limited = server.rate_limit_every and server.requests % server.rate_limit_every == 0
+                if rate_limited:
+                    status, body, content_type = 429, b'{}', 'application/json'
+                else:
+                    status, body, content_type = server.route(urlparse(self.path).path)
+
+                self.send_response(status)
+                if rate_limited:
+                    self.send_header('Retry-After', '0')
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class SoakSpotifyClient(SpotifyClient):
+    """SpotifyClient that talks to a FakeSpotifyServer instead of Spotify."""
+    def __init__(self, api_url: str):
+        super().__init__()
+        self.api_url = api_url
+
+    def authenticate(self):
+        self.sp = spotipy.Spotify(auth='soak', requests_timeout=10)
+        self.sp.prefix = self.api_url
+
+
+def _rss_bytes() -> int:
+    try:
+        with open('/proc/self/status', encoding='utf-8') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Peak rather than current RSS, in KiB on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def _fd_count() -> int | None:
+    for directory in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(directory))
+        except OSError:
+            continue
+    return None
+
+
+class ResourceMonitor():
+    """Samples RSS, traced Python memory, threads and file descriptors."""
+    def __init__(self, top: int = 10):
+        self.top = top
+        self.samples: list[dict] = []
+        self.baseline: dict | None = None
+        self._baseline_snapshot: tracemalloc.Snapshot | None = None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def sample(self, iteration: int) -> dict:
+        gc.collect()
+        sample = {
+            'iteration':    iteration,
+            'rss':          _rss_bytes(),
+            'traced':       tracemalloc.get_traced_memory()[0],
+            'threads':      threading.active_count(),
+            'fds':          _fd_count()
+        }
+        self.samples.append(sample)
+        return sample
+
+    def set_baseline(self, iteration: int):
+        """Measures growth from here on, once caches and worker pools have filled up."""
+        self.baseline = self.sample(iteration)
+        self._baseline_snapshot = tracemalloc.take_snapshot()
+
+    def top_allocators(self) -> list[str]:
+        """Returns the source lines whose allocations grew most since the baseline."""
+        if self._baseline_snapshot is None:
+            return []
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        return [str(stat) for stat in snapshot.compare_to(self._baseline_snapshot, 'lineno')[:self.top]]
+
+
+class SoakBudget():
+    """How much each resource may grow between the baseline and the end of a soak."""
+    def __init__(self, rss_mb: float = 48, traced_mb: float = 16, threads: int = 6, fds: int = 16):
+        self.rss_mb = rss_mb
+        self.traced_mb = traced_mb
+        self.threads = threads
+        self.fds = fds
+
+    def check(self, baseline: dict, final: dict) -> list[str]:
+        """Returns a description of each resource that grew past its budget."""
+        failures = []
+        mib = 1024 * 1024
+        if final['rss'] - baseline['rss'] > self.rss_mb * mib:
+            failures.append(f"RSS grew {(final['rss'] - baseline['rss']) / mib:.1f} MiB (budget {self.rss_mb} MiB)")
+        if final['traced'] - baseline['traced'] > self.traced_mb * mib:
+            failures.append(f"Traced memory grew {(final['traced'] - baseline['traced']) / mib:.1f} MiB "
+                            f"(budget {self.traced_mb} MiB)")
+        if final['threads'] - baseline['threads'] > self.threads:
+            failures.append(f"Threads grew from {baseline['threads']} to {final['threads']} (budget {self.threads})")
+        if final['fds'] is not None and baseline['fds'] is not None and final['fds'] - baseline['fds'] > self.fds:
+            failures.append(f"File descriptors grew from {baseline['fds']} to {final['fds']} (budget {self.fds})")
+        return failures
+
+
+class SoakReport():
+    """The samples and outcome of a soak."""
+    def __init__(self, samples: list[dict], failures: list[str], top_allocators: list[str], downloads: int, requests: int):
+        self.samples = samples
+        self.failures = failures
+        self.top_allocators = top_allocators
+        self.downloads = downloads
+        self.requests = requests
+
+    @property
+    def passed(self) -> bool:
+        return not self.failures
+
+    def format(self) -> str:
+        lines = [f"{'iteration':>9} {'RSS MiB':>8} {'traced MiB':>10} {'threads':>7} {'fds':>5}"]
+        for sample in self.samples:
+            lines.append(f"{sample['iteration']:>9} {sample['rss'] / 2**20:>8.1f} {sample['traced'] / 2**20:>10.1f} "
+                         f"{sample['threads']:>7} {sample['fds'] if sample['fds'] is not None else '-':>5}")
+        lines.append(f"{self.downloads} songs downloaded, {self.requests} Spotify API requests")
+        if self.top_allocators:
+            lines.append("Top allocators since the baseline:")
+            lines.extend(f"  {line}" for line in self.top_allocators)
+        lines.append("PASSED" if self.passed else "FAILED: " + "; ".join(self.failures))
+        return '\n'.join(lines)
+
+
+async def _step(app, pilot, rng: random.Random, track_ids: list[str]):
+    """Does one random thing a user might do."""
+    from textual.widgets import Button
+    from main import PlaylistsView
+
+    music_manager = app.classman.music_manager
+    playlists = app.query_one(PlaylistsView)
+    playlist = playlists.playlist
+    choice = rng.random()
+
+    if choice < 0.3 and playlists.table.row_count:
+        playlists.table.move_cursor(row=rng.randrange(playlists.table.row_count), column=0)
+        playlists.table.action_select_cursor()
+    elif choice < 0.45 and playlist.playlist_id is not None and playlist.table.row_count:
+        playlist.table.move_cursor(row=rng.randrange(playlist.table.row_count), column=0)
+        playlist.table.action_select_cursor()
+    elif choice < 0.55 and playlist.playlist_id is not None:
+        rng.choice((playlist.play_all, playlist.shuffle)).press()
+    elif choice < 0.7:
+        app.query_one('#next', Button).press()
+    elif choice < 0.75:
+        app.query_one(rng.choice(('#play', '#previous')), Button).press()
+    elif choice < 0.92:
+        music_manager.add_songs_to_queue(rng.sample(track_ids, rng.randint(1, 5)))
+    else:
+        music_manager.reset_queue()
+        music_manager.add_songs_to_queue([])
+    await pilot.pause()
+
+
+async def _drive(app, monitor: ResourceMonitor, iterations: int, warmup: int, sample_every: int,
+                 rng: random.Random, track_ids: list[str]):
+    async with app.run_test(size=(140, 45)) as pilot:
+        await pilot.pause(0.5)
+        for iteration in range(iterations):
+            if iteration == warmup:
+                monitor.set_baseline(iteration)
+            elif iteration % sample_every == 0:
+                monitor.sample(iteration)
+            await _step(app, pilot, rng, track_ids)
+        # Let downloads, covers and post-processing started by the last steps finish
+        await pilot.pause(1)
+        monitor.sample(iterations)
+
+
+def run_soak(
+    iterations: int = 2000,
+    warmup: int | None = None,
+    sample_every: int = 100,
+    budget: SoakBudget | None = None,
+    seed: int = 0,
+    playlists: int = 12,
+    tracks_per_playlist: int = 25,
+    tracks: int = 120
+    ) -> SoakReport:
+    """Runs the app headless under a random workload and checks resource growth.
+
+    Args:
+        iterations (int, optional): Number of simulated user actions. Defaults to 2000.
+        warmup (int | None, optional): Actions before the baseline is taken. Defaults to a fifth of iterations.
+        sample_every (int, optional): Actions between samples. Defaults to 100.
+        budget (SoakBudget | None, optional): Allowed growth. Defaults to SoakBudget().
+        seed (int, optional): Seed of the workload. Defaults to 0.
+        playlists (int, optional): Playlists served by the fake Spotify server. Defaults to 12.
+        tracks_per_playlist (int, optional): Tracks in each playlist. Defaults to 25.
+        tracks (int, optional): Distinct tracks across all playlists. Defaults to 120.
+
+    Returns:
+        SoakReport: Samples, failures and the top allocators.
+    """
+    warmup = warmup if warmup is not None else iterations // 5
+    budget = budget if budget is not None else SoakBudget()
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+    previous_directory = os.getcwd()
+    previous_path = os.environ.get('PATH', '')
+    server = FakeSpotifyServer(playlists, tracks_per_playlist, tracks)
+    with tempfile.TemporaryDirectory(prefix='spotdl-tui-soak-') as directory:
+        os.makedirs(os.path.join(directory, 'cache', 'downloads'))
+        os.makedirs(os.path.join(directory, 'bin'))
+        install_fake_tools(os.path.join(directory, 'bin'))
+        os.environ['PATH'] = os.path.join(directory, 'bin') + os.pathsep + previous_path
+        os.chdir(directory)
+        server.start()
+        classman = None
+        try:
+            from class_manager import ClassManager
+            from main import Main
+            from shared_cache import TieredCache
+            from song_metadata import SongMetadataFile
+
+            logger = logging.getLogger('soak')
+            monitor = ResourceMonitor()
+            classman = ClassManager(
+                song_metadata_file=SongMetadataFile(),
+                spotify_client=SoakSpotifyClient(server.api_url),
+                logger=logger,
+                shared_cache=TieredCache(logger=logger)
+            )
+            asyncio.run(_drive(Main(classman=classman), monitor, iterations, warmup, sample_every,
+                               random.Random(seed), server.track_ids()))
+
+            failures = budget.check(monitor.baseline or monitor.samples[0], monitor.samples[-1])
+            report = SoakReport(monitor.samples, failures, monitor.top_allocators(),
+                                len([name for name in os.listdir('cache/downloads') if name.endswith('.mp3')]),
+                                server.requests)
+        finally:
+            if classman is not None:
+                # Wait for workers still writing to the temporary directory before it is removed
+                classman.playlist_warmer.stop(wait=True)
+                classman.music_manager.quit(wait=True)
+                classman.thumbnails.shutdown(wait=True)
+            server.stop()
+            tracemalloc.stop()
+            os.chdir(previous_directory)
+            os.environ['PATH'] = previous_path
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Soak test spotdl-tui headless against fake Spotify and spotdl.")
+    parser.add_argument('--iterations', type=int, default=2000, help="Simulated user actions.")
+    parser.add_argument('--warmup', type=int, default=None, help="Actions before the baseline (default: a fifth).")
+    parser.add_argument('--sample-every', type=int, default=100, help="Actions between samples.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the random workload.")
+    parser.add_argument('--rss-mb', type=float, default=48, help="Allowed RSS growth in MiB.")
+    parser.add_argument('--traced-mb', type=float, default=16, help="Allowed traced Python memory growth in MiB.")
+    parser.add_argument('--threads', type=int, default=6, help="Allowed growth in thread count.")
+    parser.add_argument('--fds', type=int, default=16, help="Allowed growth in open file descriptors.")
+    args = parser.parse_args()
+
+    soak_report = run_soak(
+        iterations=args.iterations,
+        warmup=args.warmup,
+        sample_every=args.sample_every,
+        budget=SoakBudget(args.rss_mb, args.traced_mb, args.threads, args.fds),
+        seed=args.seed
+    )
+    print(soak_report.format())
+    sys.exit(0 if soak_report.passed else 1)
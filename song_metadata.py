@@ -1,32 +1,100 @@
 import pickle
 import os
+import threading
+
+from tracing import span
 
 class SongMetadataFile():
     def __init__(self, path:str='cache/metadata.pkl') -> None:
         self.path = path
+        # Optional TieredCache shared with other stations, set by ClassManager
+        self.shared_cache = None
+        # The file is only read again when its mtime changes
+        self._cache: dict[str, dict[str, str]] | None = None
+        self._cache_mtime: int | None = None
+        self._lock = threading.RLock()
         if not os.path.isfile(path):
             self._created = False
         else:
             self._created = True
 
     def add_metadata(self, info: tuple[str, dict[str, str]]):
-        current = self.read()
+        # Keeps keys added by update_metadata, like post-processing results
+        self.add_many({info[0]: info[1]})
 
-        current[info[0]] = info[1]
+    def add_many(self, entries: dict[str, dict[str, str]]):
+        """Adds the metadata of several songs with a single write.
 
-        with open(self.path, 'wb') as file:
-            pickle.dump(current, file)
-            self._created = True
+        Args:
+            entries (dict[str, dict[str, str]]): Metadata by track ID.
+        """
+        if not entries:
+            return
+        with self._lock:
+            current = dict(self.read())
+            for key, metadata in entries.items():
+                current[key] = {**current.get(key, {}), **metadata}
+
+            with span('metadata.pkl write', 'pickle', entries=len(current)), open(self.path, 'wb') as file:
+                pickle.dump(current, file)
+                self._created = True
+            self._cache = current
+            self._cache_mtime = os.stat(self.path).st_mtime_ns
+            merged = {key: current[key] for key in entries}
+
+        if self.shared_cache is not None:
+            self.shared_cache.set_many('metadata', merged)
+
+    def update_metadata(self, key: str, values: dict):
+        """Merges values, such as post-processing results, into a song's existing metadata.
+
+        Args:
+            key (str): Spotify track ID.
+            values (dict): Keys to add or replace.
+
+        Returns:
+            bool: False if the song has no metadata to add to.
+        """
+        with self._lock:
+            existing = self.read().get(key)
+            if existing is None:
+                return False
+            self.add_metadata((key, {**existing, **values}))
+        return True
 
     def read(self) -> dict[str, dict[str, str]]:
+        """Returns all the metadata. The result is shared between callers, so don't modify it."""
         if self._created:
-            with open(self.path, 'rb') as file:
-                return pickle.load(file)
+            with self._lock:
+                mtime = os.stat(self.path).st_mtime_ns
+                if self._cache is None or mtime != self._cache_mtime:
+                    with span('metadata.pkl read', 'pickle'), open(self.path, 'rb') as file:
+                        self._cache = pickle.load(file)
+                    self._cache_mtime = mtime
+                return self._cache
         else:
             return {}
 
     def get_metadata(self, key) -> dict[str, str]|None:
         data = self.read()
+        if key not in data and self.shared_cache is not None:
+            return self.shared_cache.get('metadata', key)
         return data.get(key)
 
+    def get_many(self, keys: list[str]) -> dict[str, dict[str, str]]:
+        """Returns the metadata of several songs, looking up songs missing from
+        the local file in the shared cache in one batch.
+
+        Args:
+            keys (list[str]): Spotify track IDs.
+
+        Returns:
+            dict[str, dict[str, str]]: Metadata by track ID, without songs that aren't cached.
+        """
+        data = self.read()
+        found = {key: data[key] for key in keys if key in data}
+        if self.shared_cache is not None and len(found) < len(keys):
+            found.update(self.shared_cache.get_many('metadata', [key for key in keys if key not in found]))
+        return found
+
 
@@ -4,6 +4,9 @@ from spotipy.oauth2 import SpotifyOAuth
 from dotenv import load_dotenv
 import re
 
+from tracing import traced
+from track import Track, TrackStore
+
 
 class SpotifyClient:
     def __init__(self):
@@ -13,6 +16,11 @@ class SpotifyClient:
         self.client_id = os.getenv("SPOTIPY_CLIENT_ID")
         self.client_secret = os.getenv("SPOTIPY_CLIENT_SECRET")
         self.sp = None
+        # Optional TieredCache for playlist listings, set by ClassManager
+        self.shared_cache = None
+        # Track records, replaced with the app's shared TrackStore by ClassManager
+        self.tracks = TrackStore()
+        self._snapshot_ids: dict[str, str] = {}
 
     def authenticate(self):
         """Authenticate with Spotify and initialize the client."""
@@ -24,6 +32,7 @@ class SpotifyClient:
         )
         self.sp = spotipy.Spotify(auth_manager=auth_manager)
 
+    @traced('spotify.get_user_playlists', 'spotify')
     def get_user_playlists(self):
         """Returns a list of all the playlist the authenticated user has created.
 
@@ -44,12 +53,14 @@ class SpotifyClient:
                     item['name'],
                     item['id']
                 ])
+                self._snapshot_ids[item['id']] = item['snapshot_id']
             if results['next']:
                 results = self.sp.next(results)
             else:
                 break
         return playlists
 
+    @traced('spotify.get_playlist_tracks', 'spotify')
     def get_playlist_tracks(self, playlist_url):
         """Gets all the tracks of Spotify playlist, with track name, artist name, and id.
 
@@ -70,21 +81,64 @@ class SpotifyClient:
         if not playlist_id:
             raise ValueError("Invalid Spotify playlist URL.")
 
-        tracks = []
+        cache_key = self._playlist_cache_key(playlist_id)
+        if cache_key is not None:
+            track_ids = self.shared_cache.get('playlist-tracks', cache_key)
+            tracks = self._cached_tracks(track_ids) if track_ids is not None else None
+            if tracks is not None:
+                return [[track.name, track.artists, track.id] for track in tracks]
+
+        return [
+            [metadata['name'], metadata['artists'], metadata['id']]
+            for metadata in self.get_playlist_items(playlist_url)
+        ]
+
+    @traced('spotify.get_playlist_items', 'spotify')
+    def get_playlist_items(self, playlist_url: str) -> list[dict[str, str]]:
+        """Gets the metadata of every track in a playlist, in the format of
+        download_song_metadata plus 'artists' (all artist names), and caches the
+        track IDs for get_playlist_tracks. The tracks themselves are kept once in
+        tracks, rather than copied into every cached listing.
+
+        Args:
+            playlist_url (str): URL of the playlist to get.
+
+        Raises:
+            Exception: If Spotify client not authenticated.
+            ValueError: If Spotify playlist URL is invalid.
+
+        Returns:
+            list[dict[str, str]]: Metadata of each track, skipping local files and removed tracks.
+        """
+        if not self.sp:
+            raise Exception("Spotify client not authenticated. Call authenticate() first.")
+
+        playlist_id = self._extract_playlist_id(playlist_url)
+        if not playlist_id:
+            raise ValueError("Invalid Spotify playlist URL.")
+
+        items = []
         results = self.sp.playlist_items(playlist_id)
         while results:
             for item in results['items']:
                 track = item['track']
-                name = track['name']
-                href = track['id']
-                artists = ", ".join(artist['name'] for artist in track['artists'])
-                tracks.append([name, artists, href])
+                if track is None or track.get('id') is None:
+                    continue
+                metadata = self._track_metadata(track)
+                metadata['artists'] = ", ".join(artist['name'] for artist in track['artists'])
+                self.tracks.add(metadata['id'], metadata['name'], metadata['artists'], metadata['album-name'])
+                items.append(metadata)
             if results['next']:
                 results = self.sp.next(results)
             else:
                 break
-        return tracks
 
+        cache_key = self._playlist_cache_key(playlist_id)
+        if cache_key is not None:
+            self.shared_cache.set('playlist-tracks', cache_key, [metadata['id'] for metadata in items])
+        return items
+
+    @traced('spotify.get_playlist_metadata', 'spotify')
     def get_playlist_metadata(self, playlist_url:str):
         """Gets playlist metadata.
 
@@ -106,32 +160,73 @@ class SpotifyClient:
         if not playlist_id:
             raise ValueError("Invalid Spotify URL.")
 
-        results = self.sp.playlist(playlist_id)
+        cache_key = self._playlist_cache_key(playlist_id)
+        if cache_key is not None:
+            cached = self.shared_cache.get('playlist-metadata', cache_key)
+            if cached is not None:
+                return cached
+
+        results = self.sp.playlist(playlist_id, fields='name')
 
         if type(results) == dict:
-            return {'name':results['name']}
+            metadata = {'name':results['name']}
+            if cache_key is not None:
+                self.shared_cache.set('playlist-metadata', cache_key, metadata)
+            return metadata
         else:
             raise ValueError("Could not get metadata.")
 
+    @traced('spotify.download_song_metadata', 'spotify')
     def download_song_metadata(self, song_id:str) -> dict[str, str] | None:
         if not self.sp:
             raise Exception("Spotify client not authenticated. Call authenticate() first.")
 
         response = self.sp.track(song_id)
         if response != None:
-            to_return = {
-                'album-id':     response['album']['id'],
-                'album-name':   response['album']['name'],
-                'name':         response['name'],
-                'artist-id':    response['artists'][0]['id'],
-                'artist-name':  response['artists'][0]['name'],
-                'id':           response['id']
-            }
+            to_return = self._track_metadata(response)
         else:
             to_return = None
 
         return to_return
 
+    def _track_metadata(self, track: dict) -> dict[str, str]:
+        """Returns the song metadata saved for a Spotify track object."""
+        # Album images are ordered widest first, the smallest is plenty for a thumbnail
+        images = track['album'].get('images') or []
+        return {
+            'album-id':     track['album']['id'],
+            'album-name':   track['album']['name'],
+            'album-cover-url': images[-1]['url'] if images else None,
+            'album-art-url': images[0]['url'] if images else None,
+            'name':         track['name'],
+            'artist-id':    track['artists'][0]['id'],
+            'artist-name':  track['artists'][0]['name'],
+            'id':           track['id'],
+            'isrc':         track.get('external_ids', {}).get('isrc')
+        }
+
+    def _cached_tracks(self, track_ids: list[str]) -> list[Track] | None:
+        """Returns the Tracks of a cached playlist listing, filling in tracks this
+        process hasn't seen from the cached song metadata. Returns None if any are
+        missing from both.
+        """
+        missing = [track_id for track_id in track_ids if self.tracks.get(track_id) is None]
+        if missing:
+            for track_id, metadata in self.shared_cache.get_many('metadata', missing).items():
+                self.tracks.add(track_id, metadata['name'], metadata.get('artists') or metadata['artist-name'],
+                                metadata.get('album-name', ''))
+        tracks = [self.tracks.get(track_id) for track_id in track_ids]
+        return None if None in tracks else tracks
+
+    def _playlist_cache_key(self, playlist_id: str) -> str | None:
+        """Returns the key to cache a playlist under, which includes its snapshot ID
+        so that edited playlists are fetched again. Returns None if there is no cache
+        or the snapshot ID is unknown (get_user_playlists hasn't listed it).
+        """
+        if self.shared_cache is None or playlist_id not in self._snapshot_ids:
+            return None
+        return f'{playlist_id}:{self._snapshot_ids[playlist_id]}'
+
     def _extract_playlist_id(self, url):
         """Extract playlist ID from a full Spotify playlist URL."""
         match = re.search(r'playlist/([a-zA-Z0-9]+)', url)
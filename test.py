@@ -1,11 +1,41 @@
+import asyncio
+import atexit
+import gc
+import json
 import unittest
 from unittest.mock import patch, MagicMock, mock_open
 import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from textual.app import App
 
 from music_manager import MusicManager
+import audio_cache
+import daemon
 import download
+import download_controller
+import download_failures
+import main
+import recordings
+import shared_cache
+import song_metadata
+import track
+import tracing
+import ui_events
 import player
+import post_process
+import prewarm
+import soak
 import spotify
+import thumbnails
 import class_manager
 
 class TestMusicManager(unittest.TestCase):
@@ -23,13 +53,13 @@ class TestMusicManager(unittest.TestCase):
     @patch('music_manager.open', new_callable=mock_open, read_data='track1\ntrack2\n')
     @patch('music_manager.os.path.isfile', return_value=True)
     def test_parse_downloaded_file_index(self, mock_isfile, mock_file):
-        self.assertEqual(self.mm._downloaded_songs, ['track1', 'track2'])
+        self.assertEqual(self.mm._downloaded_songs, {'track1', 'track2'})
 
     @patch('music_manager.open', new_callable=mock_open, read_data='track1\ntrack2\n')
     @patch('music_manager.os.path.isfile', return_value=False)
     def test_parse_downloaded_file_index_file_missing(self, mock_isfile, mock_file):
         mm = MusicManager()
-        self.assertEqual(mm._downloaded_songs, [])
+        self.assertEqual(mm._downloaded_songs, set())
 
     @patch('music_manager.MusicPlayer')
     def test_pause_and_unpause(self, mock_player):
@@ -45,7 +75,7 @@ class TestMusicManager(unittest.TestCase):
     @patch('music_manager.os.path.exists', return_value=True)
     @patch('music_manager.MusicPlayer')
     def test_force_play_song_downloaded(self, mock_player, mock_exists, mock_download):
-        self.mm._downloaded_songs = ['track1']
+        self.mm._downloaded_songs = {'track1'}
         self.mm.player = MagicMock()
         self.mm.load_song = MagicMock()
         self.mm.force_play_song('track1')
@@ -56,7 +86,7 @@ class TestMusicManager(unittest.TestCase):
     @patch('music_manager.os.path.exists', return_value=False)
     @patch('music_manager.MusicPlayer')
     def test_force_play_song_not_downloaded(self, mock_player, mock_exists, mock_download):
-        self.mm._downloaded_songs = []
+        self.mm._downloaded_songs = set()
         self.mm.player = MagicMock()
         self.mm.load_song = MagicMock()
         self.mm.download_song = MagicMock()
@@ -69,13 +99,104 @@ class TestMusicManager(unittest.TestCase):
         self.assertIn('trackX', self.mm.queue)
 
     @patch('music_manager.download_song')
+    @patch('music_manager.os.path.exists', return_value=True)
     @patch('music_manager.open', new_callable=mock_open)
-    def test_download_song(self, mock_file, mock_download):
-        self.mm._downloaded_songs = []
-        self.mm.download_song('trackY')
+    def test_download_song(self, mock_file, mock_exists, mock_download):
+        self.mm._downloaded_songs = set()
+        self.assertTrue(self.mm.download_song('trackY'))
         mock_download.assert_called()
         mock_file().write.assert_called()
 
+    @patch('music_manager.download_song', return_value=None)
+    @patch('music_manager.os.path.exists', return_value=False)
+    @patch('music_manager.open', new_callable=mock_open)
+    def test_download_song_failure_recorded(self, mock_file, mock_exists, mock_download):
+        self.mm._downloaded_songs = set()
+        self.mm.failed_downloads = download_failures.DownloadFailureCache(path=os.devnull)
+        self.assertFalse(self.mm.download_song('trackY'))
+        mock_file().write.assert_not_called()
+        self.assertNotIn('trackY', self.mm._downloaded_songs)
+        self.assertTrue(self.mm.failed_downloads.is_unavailable('trackY'))
+
+        # Backing off, so spotdl is not called again
+        mock_download.reset_mock()
+        self.assertFalse(self.mm.download_song('trackY'))
+        mock_download.assert_not_called()
+
+    @patch('music_manager.download_song')
+    @patch('music_manager.os.path.exists', return_value=True)
+    @patch('music_manager.open', new_callable=mock_open)
+    def test_download_song_reuses_recording(self, mock_file, mock_exists, mock_download):
+        isrcs = {'single': 'ISRC1', 'album': 'ISRC1'}
+        self.mm._downloaded_songs = set()
+        self.mm.recordings = recordings.RecordingIndex(path=os.devnull, lookup_isrc=isrcs.get)
+        self.mm.download_song('single')
+        mock_download.assert_called_once_with('single', rate_limit=None)
+
+        mock_download.reset_mock()
+        self.assertTrue(self.mm.download_song('album'))
+        mock_download.assert_not_called()
+        self.assertIn('album', self.mm._downloaded_songs)
+        self.assertEqual(self.mm.song_path('album'), 'cache/downloads/single.mp3')
+
+    @patch('music_manager.download_song', return_value=None)
+    @patch('music_manager.os.path.getsize', return_value=1024)
+    @patch('music_manager.os.path.exists', return_value=True)
+    @patch('music_manager.open', new_callable=mock_open)
+    def test_download_song_submits_post_processing(self, mock_file, mock_exists, mock_getsize, mock_download):
+        self.mm._downloaded_songs = set()
+        self.mm.recordings = recordings.RecordingIndex(path=os.devnull)
+        self.mm.failed_downloads = download_failures.DownloadFailureCache(path=os.devnull)
+        self.mm.post_processor = MagicMock()
+        self.assertTrue(self.mm.download_song('trackY'))
+        self.mm.post_processor.submit.assert_called_once_with('trackY', 'cache/downloads/trackY.mp3')
+
+        # Skipped by spotdl because the file already exists, so it was already processed
+        self.mm.post_processor.reset_mock()
+        mock_download.return_value = 'trackX'
+        self.assertTrue(self.mm.download_song('trackX'))
+        self.mm.post_processor.submit.assert_not_called()
+
+    @patch('music_manager.os.path.exists', return_value=True)
+    def test_change_hooks_carry_deltas(self, mock_exists):
+        song_changes = []
+        queue_changes = []
+        self.mm.set_on_song_change(lambda **delta: song_changes.append(delta))
+        self.mm.set_on_queue_change(lambda **delta: queue_changes.append(delta))
+        self.mm.player = MagicMock()
+        self.mm._downloaded_songs = {'a', 'b'}
+
+        self.mm.add_songs_to_queue(['a', 'b'])
+        self.mm.skip_forward()
+        self.assertEqual(queue_changes, [{'ops': [('append', ['a', 'b'])]}, {'ops': [('pop', 1)]}])
+        self.assertEqual(song_changes, [{'currently_playing': 'a', 'paused': True}])
+
+    @patch('music_manager.os.path.exists', return_value=True)
+    @patch('music_manager.open', new_callable=mock_open)
+    def test_concurrent_downloads_of_a_track_share_one_run(self, mock_file, mock_exists):
+        self.mm._downloaded_songs = set()
+        release = threading.Event()
+        with patch('music_manager.download_song', side_effect=lambda *args, **kwargs: release.wait()) as mock_download:
+            threads = [threading.Thread(target=self.mm.download_song, args=('trackY',)) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.05)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        mock_download.assert_called_once()
+        self.assertEqual(self.mm._downloaded_songs, {'trackY'})
+
+    def test_skip_unavailable_in_queue(self):
+        self.mm.failed_downloads = download_failures.DownloadFailureCache(path=os.devnull)
+        self.mm.failed_downloads.record_failure('bad')
+        self.mm.force_play_song = MagicMock(return_value=True)
+        self.mm.player = MagicMock()
+        self.mm.queue = ['bad', 'good', 'next']
+        self.mm.skip_forward()
+        self.mm.force_play_song.assert_called_once_with('good')
+        self.assertEqual(self.mm.queue, ['next'])
+
     @patch('music_manager.MusicPlayer')
     def test_load_song(self, mock_player):
         self.mm.player = MagicMock()
@@ -84,6 +205,336 @@ class TestMusicManager(unittest.TestCase):
         self.assertEqual(self.mm.currently_playing, 'trackZ')
         self.assertTrue(self.mm.paused)
 
+class FakePlayer():
+    """Stands in for MusicPlayer. Each song plays for duration seconds."""
+    def __init__(self, duration: float = 600):
+        self.duration = duration
+        self.loaded = []
+        self.data = None
+        self.paused = False
+        self._started = None
+
+    def load_song(self, path, data=None):
+        self.loaded.append(path)
+        self.data = data
+        self.paused = False
+        self._started = time.monotonic()
+
+    def play(self):
+        self.paused = False
+
+    def pause(self):
+        self.paused = True
+
+    def stop(self):
+        self._started = None
+        self.paused = False
+
+    def position(self) -> float:
+        return 0.0 if self._started is None else time.monotonic() - self._started
+
+    def is_busy(self) -> bool:
+        return self._started is not None and self.position() < self.duration
+
+    def quit(self):
+        pass
+
+class TestMusicManagerActor(unittest.TestCase):
+    @patch('music_manager.MusicPlayer')
+    @patch('music_manager.os.path.isfile', return_value=False)
+    def setUp(self, mock_isfile, mock_player):
+        self.mm = MusicManager()
+        self.addCleanup(self.mm.quit)
+        self.mm.player = FakePlayer()
+        self.mm.failed_downloads = download_failures.DownloadFailureCache(path=os.devnull)
+        self.mm.recordings = recordings.RecordingIndex(path=os.devnull)
+        # Every track is already downloaded
+        self.mm._downloaded_songs = {f't{i}' for i in range(20)}
+        patcher = patch('music_manager.os.path.exists', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_concurrent_commands_stay_consistent(self):
+        replayed = []
+        def on_queue_change(ops):
+            for op in ops:
+                if op[0] == 'reset':
+                    replayed.clear()
+                elif op[0] == 'pop':
+                    del replayed[:op[1]]
+                elif op[0] == 'insert':
+                    replayed[op[1]:op[1]] = op[2]
+                else:
+                    replayed.extend(op[1])
+        self.mm.set_on_queue_change(on_queue_change)
+        self.mm.lookup_duration = lambda track_id: 600
+
+        errors = []
+        def client(seed):
+            rng = __import__('random').Random(seed)
+            try:
+                for _ in range(100):
+                    choice = rng.random()
+                    track_id = f't{rng.randrange(20)}'
+                    if choice < 0.35:
+                        self.mm.add_song_to_queue(track_id)
+                    elif choice < 0.5:
+                        self.mm.add_songs_to_queue([track_id, f't{rng.randrange(20)}'])
+                    elif choice < 0.7:
+                        self.mm.skip_forward()
+                    elif choice < 0.8:
+                        self.mm.force_play_song(track_id, clear_queue=rng.random() < 0.3)
+                    elif choice < 0.85:
+                        self.mm.reset_queue()
+                    else:
+                        self.mm.pause()
+                        self.mm.unpause()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=client, args=(seed,)) for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        self.mm._call(self.mm.call_on_queue_change)
+
+        self.assertEqual(errors, [])
+        # Every edit was reported exactly once and in order
+        self.assertEqual(replayed, self.mm.queue)
+        self.assertIn(self.mm.currently_playing, self.mm._downloaded_songs)
+
+        # Nothing polls while a song plays
+        time.sleep(0.1)
+        wakeups = self.mm.wakeups
+        time.sleep(0.5)
+        self.assertEqual(self.mm.wakeups, wakeups)
+
+    def test_song_end_timer_plays_next(self):
+        self.mm.player = FakePlayer(duration=0.2)
+        self.mm.lookup_duration = lambda track_id: 0.2
+        self.mm.add_songs_to_queue(['t1', 't2'])
+        self.mm.play_queue()
+        deadline = time.monotonic() + 5
+        while len(self.mm.player.loaded) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.mm.player.loaded, ['cache/downloads/t1.mp3', 'cache/downloads/t2.mp3'])
+        self.assertEqual(self.mm.queue, [])
+        # One check per song rather than one every half second
+        self.assertLess(self.mm.wakeups, 15)
+
+    def test_paused_song_does_not_end(self):
+        self.mm.player = FakePlayer(duration=0.1)
+        self.mm.lookup_duration = lambda track_id: 0.1
+        self.mm.add_songs_to_queue(['t1', 't2'])
+        self.mm.play_queue()
+        self.mm.player.pause()
+        self.mm.pause()
+        time.sleep(0.5)
+        self.assertEqual(self.mm.player.loaded, ['cache/downloads/t1.mp3'])
+
+    def test_previous_goes_back_and_requeues_current(self):
+        replayed = []
+        def on_queue_change(ops):
+            for op in ops:
+                if op[0] == 'reset':
+                    replayed.clear()
+                elif op[0] == 'pop':
+                    del replayed[:op[1]]
+                elif op[0] == 'insert':
+                    replayed[op[1]:op[1]] = op[2]
+                else:
+                    replayed.extend(op[1])
+        self.mm.set_on_queue_change(on_queue_change)
+        self.mm.lookup_duration = lambda track_id: 600
+        self.mm.audio_cache.put('cache/downloads/t1.mp3', b'audio')
+        self.mm.add_songs_to_queue(['t1', 't2', 't3'])
+        self.mm.play_queue()
+        self.mm.skip_forward()
+        sent = []
+        self.mm.set_on_queue_change(lambda ops: (sent.extend(ops), on_queue_change(ops)))
+
+        self.assertTrue(self.mm.previous())
+
+        # Only the song put back is sent, not the whole queue again
+        self.assertEqual(sent, [('insert', 0, ['t2'])])
+        self.assertEqual(self.mm.currently_playing, 't1')
+        self.assertEqual(self.mm.queue, ['t2', 't3'])
+        self.assertEqual(replayed, ['t2', 't3'])
+        # Played from memory rather than read from disk
+        self.assertEqual(self.mm.player.data, b'audio')
+        self.assertEqual(list(self.mm.history), [])
+
+    def test_previous_restarts_song_after_a_few_seconds(self):
+        self.mm.lookup_duration = lambda track_id: 600
+        self.mm.add_songs_to_queue(['t1', 't2'])
+        self.mm.play_queue()
+        self.mm.skip_forward()
+        self.mm.player._started -= 5
+
+        self.assertTrue(self.mm.previous())
+
+        self.assertEqual(self.mm.currently_playing, 't2')
+        self.assertEqual(self.mm.player.loaded[-1], 'cache/downloads/t2.mp3')
+        self.assertEqual(list(self.mm.history), ['t1'])
+
+    def use_fake_spotdl(self, download):
+        """Replaces spotdl, returning the track ID as spotdl does for an existing file."""
+        patcher = patch('music_manager.download_song', side_effect=lambda track_id, rate_limit=None: download(track_id))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        file_patcher = patch('music_manager.open', new_callable=mock_open)
+        file_patcher.start()
+        self.addCleanup(file_patcher.stop)
+        self.mm._downloaded_songs = set()
+
+    def test_clicked_song_not_stuck_behind_background_downloads(self):
+        release = threading.Event()
+        def download(track_id):
+            if track_id != 't15':
+                # Background downloads hold every worker until released
+                release.wait(10)
+            return track_id
+        self.use_fake_spotdl(download)
+        self.addCleanup(release.set)
+        self.mm.download_controller.workers = self.mm.download_controller.max_workers
+        self.mm.add_songs_to_queue([f't{i}' for i in range(10)])
+        time.sleep(0.1)
+
+        start = time.monotonic()
+        self.assertTrue(self.mm.force_play_song('t15'))
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(self.mm.currently_playing, 't15')
+
+    def test_song_does_not_end_while_clicked_song_downloads(self):
+        def download(track_id):
+            time.sleep(1.5)
+            return track_id
+        self.use_fake_spotdl(download)
+        # No duration is known, so the playing song is checked every second
+        self.mm._downloaded_songs = {'t1', 't2', 't3'}
+        self.mm.add_songs_to_queue(['t1', 't2', 't3'])
+        self.mm.play_queue()
+        self.assertEqual(self.mm.currently_playing, 't1')
+
+        self.assertTrue(self.mm.force_play_song('t9', clear_queue=True))
+
+        self.assertEqual(self.mm.currently_playing, 't9')
+        self.assertEqual(self.mm.queue, [])
+        self.assertEqual(self.mm.player.loaded, ['cache/downloads/t1.mp3', 'cache/downloads/t9.mp3'])
+
+    def test_superseded_click_reports_not_loaded(self):
+        started = threading.Event()
+        def download(track_id):
+            if track_id == 't9':
+                started.set()
+                time.sleep(0.5)
+            return track_id
+        self.use_fake_spotdl(download)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.mm.force_play_song('t9')))
+        thread.start()
+        started.wait(5)
+
+        self.assertTrue(self.mm.force_play_song('t10'))
+        thread.join(5)
+
+        self.assertEqual(results, [False])
+        self.assertEqual(self.mm.currently_playing, 't10')
+
+    def test_quit_fails_commands_instead_of_hanging(self):
+        started = threading.Event()
+        def download(track_id):
+            started.set()
+            time.sleep(0.5)
+            return track_id
+        self.use_fake_spotdl(download)
+        results = []
+        def play():
+            try:
+                results.append(self.mm.force_play_song('t15'))
+            except RuntimeError as e:
+                results.append(e)
+        thread = threading.Thread(target=play)
+        thread.start()
+        started.wait(5)
+
+        self.mm.quit()
+        thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertIsInstance(results[0], RuntimeError)
+        with self.assertRaises(RuntimeError):
+            self.mm.add_song_to_queue('t1')
+
+    def test_download_state_changed_on_actor(self):
+        threads = set()
+        def record(*args):
+            threads.add(threading.current_thread())
+        self.mm.failed_downloads = MagicMock(is_unavailable=MagicMock(return_value=False), record_success=record)
+        self.mm.download_breaker = MagicMock(allow=MagicMock(return_value=True), record_success=record)
+        self.mm._add_to_downloaded_index = record
+        download_threads = set()
+        def download(track_id):
+            download_threads.add(threading.current_thread())
+            return track_id
+        self.use_fake_spotdl(download)
+
+        self.assertTrue(self.mm.download_song('t15'))
+        self.mm.add_songs_to_queue(['t16'])
+        deadline = time.monotonic() + 5
+        while self.mm._downloading or len(download_threads) < 2:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+        self.assertEqual(threads, {self.mm._actor_thread})
+        self.assertNotIn(self.mm._actor_thread, download_threads)
+
+    def test_uncached_song_read_off_the_actor(self):
+        readers = []
+        self.mm.audio_cache.load = lambda path: readers.append((path, threading.current_thread()))
+        self.mm.load_song('t1')
+        self.assertIsNone(self.mm.player.data)
+        deadline = time.monotonic() + 5
+        while not readers and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(readers[0][0], 'cache/downloads/t1.mp3')
+        self.assertIsNot(readers[0][1], self.mm._actor_thread)
+
+    def test_previous_without_history(self):
+        self.assertFalse(self.mm.previous())
+
+class TestAudioCache(unittest.TestCase):
+    def test_evicts_least_recently_played(self):
+        cache = audio_cache.AudioCache(max_bytes=10)
+        cache.put('a', b'aaaa')
+        cache.put('b', b'bbbb')
+        cache.get('a')
+        cache.put('c', b'cccc')
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(cache.size, 8)
+
+        cache.put('big', bytes(11))
+        self.assertNotIn('big', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_load_reads_file_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'song.mp3')
+            with open(path, 'wb') as file:
+                file.write(b'audio')
+            cache = audio_cache.AudioCache()
+
+            self.assertEqual(cache.load(path), b'audio')
+            os.remove(path)
+            self.assertEqual(cache.load(path), b'audio')
+            cache.discard(path)
+            self.assertIsNone(cache.load(path))
+            self.assertEqual(cache.size, 0)
+
 class TestDownload(unittest.TestCase):
     @patch('subprocess.run')
     def test_download_song_success(self, mock_run):
@@ -104,6 +555,891 @@ class TestDownload(unittest.TestCase):
         result = download.download_song('https://open.spotify.com/track/trackid')
         self.assertTrue(result is None or (isinstance(result, tuple) and result[0] == 'error'))
 
+class TestPostProcess(unittest.TestCase):
+    @staticmethod
+    def fake_ffmpeg(cmd, **kwargs):
+        result = MagicMock(stdout='', stderr='')
+        if cmd[0] == 'ffprobe':
+            result.stdout = '215.5\n'
+        elif 'loudnorm=print_format=json' in cmd:
+            result.stderr = '[Parsed_loudnorm_0]\n{\n\t"input_i" : "-11.50",\n\t"input_tp" : "-0.20"\n}\n'
+        elif cmd[-1].endswith('.tagging.mp3'):
+            open(cmd[-1], 'wb').close()
+        return result
+
+    def test_process_track(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'track.mp3')
+            open(path, 'wb').close()
+            with patch('post_process.subprocess.run', side_effect=self.fake_ffmpeg) as mock_run:
+                results = post_process.process_track(path, {'name': 'Song', 'artist-name': 'Artist', 'isrc': 'ISRC1'})
+
+            self.assertEqual(results, {
+                'duration': 215.5, 'loudness': -11.5, 'replaygain-track-gain': -6.5,
+                'tagged': True, 'wav-path': os.path.join(directory, 'track.wav')
+            })
+            tag_cmd = mock_run.call_args_list[2].args[0]
+            self.assertIn('title=Song', tag_cmd)
+            self.assertIn('REPLAYGAIN_TRACK_GAIN=-6.50 dB', tag_cmd)
+            self.assertFalse(os.path.exists(f'{path}.tagging.mp3'))
+
+    @patch('post_process.requests.get')
+    def test_cover_embedded_and_stages_traced(self, mock_get):
+        mock_get.return_value.content = b'jpeg'
+        metadata = {'name': 'Song', 'album-art-url': 'https://i.scdn.co/image/large'}
+        start = len(tracing.tracer._events)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'track.mp3')
+            open(path, 'wb').close()
+            with patch('post_process.subprocess.run', side_effect=self.fake_ffmpeg) as mock_run, \
+                 patch.object(tracing.tracer, 'enabled', True):
+                results = post_process.process_track(path, metadata)
+            self.assertFalse(os.path.exists(f'{path}.cover.jpg'))
+
+        mock_get.assert_called_once_with('https://i.scdn.co/image/large', timeout=10)
+        tag_cmd = mock_run.call_args_list[2].args[0]
+        self.assertIn(f'{path}.cover.jpg', tag_cmd)
+        self.assertIn('attached_pic', tag_cmd)
+        self.assertNotIn('post-process-errors', results)
+        stages = [event['name'] for event in list(tracing.tracer._events)[start:]]
+        self.assertEqual(stages, ['post-process duration', 'post-process loudness', 'post-process cover',
+                                  'post-process tags', 'post-process convert'])
+
+    @patch('post_process.subprocess.run', side_effect=subprocess.CalledProcessError(1, 'ffmpeg'))
+    def test_failed_stages_recorded(self, mock_run):
+        results = post_process.process_track('missing.mp3')
+        self.assertEqual(set(results['post-process-errors']), {'duration', 'loudness', 'convert'})
+
+    def test_pipeline_reports_results(self):
+        from concurrent.futures import ThreadPoolExecutor
+        pipeline = post_process.PostDownloadPipeline(executor=ThreadPoolExecutor(max_workers=1))
+        pipeline.lookup_metadata = {'t': {'name': 'Song'}}.get
+        results = {}
+        pipeline.on_result = results.__setitem__
+        with patch('post_process.process_track', return_value={'duration': 1.0}) as mock_process:
+            pipeline.submit('t', 'cache/downloads/t.mp3').result()
+            pipeline.executor.shutdown(wait=True)
+        mock_process.assert_called_once_with('cache/downloads/t.mp3', {'name': 'Song'})
+        self.assertEqual(results, {'t': {'duration': 1.0}})
+
+    def test_worker_pool(self):
+        pipeline = post_process.PostDownloadPipeline(max_workers=1)
+        try:
+            results = pipeline.submit('t', os.path.join(tempfile.gettempdir(), 'missing.mp3')).result(timeout=30)
+            niceness = pipeline.executor.submit(os.getpriority, os.PRIO_PROCESS, 0).result(timeout=30)
+        finally:
+            pipeline.shutdown()
+        self.assertIn('post-process-errors', results)
+        if sys.platform == 'linux':
+            # Only the worker thread is lowered, not playback
+            self.assertGreater(niceness, os.getpriority(os.PRIO_PROCESS, 0))
+
+class TestPlaylistWarmer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.metadata_file = song_metadata.SongMetadataFile(os.path.join(self.directory, 'metadata.pkl'))
+        self.client = MagicMock()
+        self.client.get_playlist_items.side_effect = lambda url: [
+            {'id': f'{url[-2:]}-track', 'name': 'T', 'isrc': 'ISRC'}]
+
+    def test_history_most_recent_first(self):
+        clock = iter([1.0, 2.0])
+        history = prewarm.PlaylistHistory(os.path.join(self.directory, 'history.pkl'), clock=lambda: next(clock))
+        history.record('b')
+        history.record('c')
+        self.assertEqual(history.most_recent_first(['a', 'b', 'c', 'd']), ['c', 'b', 'a', 'd'])
+        # Persisted across restarts
+        reopened = prewarm.PlaylistHistory(os.path.join(self.directory, 'history.pkl'))
+        self.assertEqual(reopened.most_recent_first(['a', 'b']), ['b', 'a'])
+
+    def test_warm_fills_metadata(self):
+        history = prewarm.PlaylistHistory(os.path.join(self.directory, 'history.pkl'))
+        history.record('p2')
+        warmer = prewarm.PlaylistWarmer(self.client, self.metadata_file, history, max_workers=1)
+        self.assertEqual(warmer.warm(['p1', 'p2']), 2)
+
+        urls = [call.args[0] for call in self.client.get_playlist_items.call_args_list]
+        self.assertEqual(urls, ['https://open.spotify.com/playlist/p2', 'https://open.spotify.com/playlist/p1'])
+        self.assertEqual(self.client.get_playlist_metadata.call_count, 2)
+        self.assertEqual(set(self.metadata_file.read()), {'p1-track', 'p2-track'})
+
+    def test_rate_limited_playlist_retried(self):
+        from spotipy.exceptions import SpotifyException
+        items = self.client.get_playlist_items.side_effect
+        self.client.get_playlist_items.side_effect = [
+            SpotifyException(429, -1, 'Too many requests', headers={'Retry-After': '0'}),
+            items('p1')
+        ]
+        warmer = prewarm.PlaylistWarmer(self.client, self.metadata_file)
+        self.assertEqual(warmer.warm(['p1']), 1)
+        self.assertEqual(self.client.get_playlist_items.call_count, 2)
+        self.assertIsNotNone(self.metadata_file.get_metadata('p1-track'))
+
+    def test_other_errors_skip_playlist(self):
+        self.client.get_playlist_items.side_effect = ValueError('bad playlist')
+        warmer = prewarm.PlaylistWarmer(self.client, self.metadata_file)
+        self.assertEqual(warmer.warm(['p1']), 0)
+        self.assertEqual(self.client.get_playlist_items.call_count, 1)
+
+@unittest.skipIf(thumbnails.Image is None, "Pillow not installed")
+class TestThumbnailCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        from io import BytesIO
+        image = BytesIO()
+        thumbnails.Image.new('RGB', (64, 64), (255, 0, 0)).save(image, format='PNG')
+        self.image = image.getvalue()
+
+    def make_cache(self, **kwargs) -> thumbnails.ThumbnailCache:
+        cache = thumbnails.ThumbnailCache(self.directory, size=(4, 2), **kwargs)
+        self.addCleanup(cache.shutdown)
+        loaded = threading.Event()
+        cache.on_loaded = lambda album_id: loaded.set()
+        cache.loaded = loaded
+        return cache
+
+    def test_render_half_blocks(self):
+        image = thumbnails.Image.new('RGB', (2, 2), (0, 0, 0))
+        image.putpixel((0, 1), (255, 255, 255))
+        text = thumbnails.render_half_blocks(image)
+        self.assertEqual(text.plain, '▀▀')
+        self.assertEqual(str(text.spans[0].style), 'rgb(0,0,0) on rgb(255,255,255)')
+
+    def test_request_downloads_and_renders(self):
+        cache = self.make_cache()
+        self.assertIsNone(cache.get('album'))
+        with patch('thumbnails.requests.get') as mock_get:
+            mock_get.return_value.content = self.image
+            cache.request('album', 'https://i.scdn.co/image/album')
+            self.assertTrue(cache.loaded.wait(5))
+        self.assertEqual(cache.get('album').plain, '▀▀▀▀\n▀▀▀▀')
+        self.assertTrue(os.path.isfile(cache.path('album')))
+
+        # Read from disk without downloading again
+        other = self.make_cache()
+        with patch('thumbnails.requests.get') as mock_get:
+            other.request('album', 'https://i.scdn.co/image/album')
+            self.assertTrue(other.loaded.wait(5))
+            mock_get.assert_not_called()
+        self.assertIsNotNone(other.get('album'))
+
+    def test_lru_limits(self):
+        cache = self.make_cache(max_entries=1, max_bytes=1)
+        with patch('thumbnails.requests.get') as mock_get:
+            mock_get.return_value.content = self.image
+            for album_id in ('a', 'b'):
+                cache.loaded.clear()
+                cache.request(album_id, 'https://i.scdn.co/image/x')
+                self.assertTrue(cache.loaded.wait(5))
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        # The newest thumbnail is over max_bytes by itself, so both were evicted from disk
+        self.assertEqual(os.listdir(self.directory), [])
+
+class TestDownloadFailureCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = download_failures.DownloadFailureCache(
+            path=os.devnull, base_delay=10, max_delay=60, ttl=500, clock=lambda: self.now)
+
+    def test_exponential_backoff(self):
+        self.assertEqual(self.cache.record_failure('t'), 10)
+        self.assertEqual(self.cache.record_failure('t'), 20)
+        self.assertEqual(self.cache.record_failure('t'), 40)
+        self.assertEqual(self.cache.record_failure('t'), 60)
+        self.assertEqual(self.cache.failures('t'), 4)
+
+    def test_concurrent_failures_written_whole(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'failed_downloads.pkl')
+            cache = download_failures.DownloadFailureCache(path=path)
+            errors = []
+            def record(thread):
+                try:
+                    for index in range(50):
+                        cache.record_failure(f'{thread}-{index}')
+                except Exception as e:
+                    errors.append(e)
+            threads = [threading.Thread(target=record, args=(thread,)) for thread in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(errors, [])
+            self.assertEqual(len(download_failures.DownloadFailureCache(path=path)._entries), 400)
+
+    def test_retry_after_backoff(self):
+        self.cache.record_failure('t')
+        self.assertTrue(self.cache.is_unavailable('t'))
+        self.now += 11
+        self.assertFalse(self.cache.is_unavailable('t'))
+
+    def test_ttl_expiry_and_success(self):
+        self.cache.record_failure('t')
+        self.cache.record_failure('t')
+        self.now += 501
+        self.assertEqual(self.cache.failures('t'), 0)
+        self.cache.record_failure('u')
+        self.cache.record_success('u')
+        self.assertFalse(self.cache.is_unavailable('u'))
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'failed.pkl')
+            cache = download_failures.DownloadFailureCache(path=path, clock=lambda: self.now)
+            cache.record_failure('t')
+            reloaded = download_failures.DownloadFailureCache(path=path, clock=lambda: self.now)
+            self.assertTrue(reloaded.is_unavailable('t'))
+
+class TestRecordingIndex(unittest.TestCase):
+    def setUp(self):
+        self.isrcs = {'single': 'ISRC1', 'album': 'ISRC1', 'other': 'ISRC2'}
+        self.lookup = MagicMock(side_effect=self.isrcs.get)
+        self.index = recordings.RecordingIndex(path=os.devnull, lookup_isrc=self.lookup)
+
+    def test_resolve_alias(self):
+        self.index.set_file('single')
+        self.index.isrc_for('album')
+        self.index.isrc_for('other')
+        self.assertEqual(self.index.resolve('album'), 'single')
+        self.assertEqual(self.index.resolve('single'), 'single')
+        self.assertEqual(self.index.resolve('other'), 'other')
+        self.assertEqual(sorted(self.index.aliases('album')), ['album', 'single'])
+
+    def test_unknown_track_resolves_to_itself(self):
+        index = recordings.RecordingIndex(path=os.devnull)
+        self.assertIsNone(index.isrc_for('x'))
+        self.assertEqual(index.resolve('x'), 'x')
+
+    def test_lookup_cached(self):
+        self.index.isrc_for('single')
+        self.index.isrc_for('single')
+        self.lookup.assert_called_once_with('single')
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'recordings.pkl')
+            index = recordings.RecordingIndex(path=path, lookup_isrc=self.isrcs.get)
+            index.set_file('single')
+            index.isrc_for('album')
+            reloaded = recordings.RecordingIndex(path=path)
+            self.assertEqual(reloaded.resolve('album'), 'single')
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_and_half_opens(self):
+        now = [0.0]
+        breaker = download_failures.CircuitBreaker(threshold=3, cooldown=30, clock=lambda: now[0])
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        # Trial download after cooldown fails, so it reopens immediately
+        now[0] = 31
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        # Only one trial at a time while half-open
+        now[0] = 62
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.remaining(), 30)
+        # A trial whose outcome is never recorded expires
+        now[0] = 92
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'daemon.sock')
+
+        self.classman = MagicMock()
+        self.classman.music_manager.queue = []
+        self.classman.music_manager.currently_playing = None
+        self.classman.music_manager.paused = True
+        self.classman.music_manager.add_song_to_queue.side_effect = self.classman.music_manager.queue.append
+        self.classman.spotify_client.get_user_playlists.return_value = [['name', 'id']]
+
+        self.music_daemon = daemon.MusicDaemon(self.classman, self.path)
+        server_thread = threading.Thread(target=self.music_daemon.serve_forever, daemon=True)
+        server_thread.start()
+        for _ in range(100):
+            if daemon.is_daemon_running(self.path):
+                break
+            time.sleep(0.01)
+        self.addCleanup(server_thread.join)
+        self.addCleanup(self.music_daemon.shutdown)
+
+        self.client = daemon.DaemonClient(self.path)
+        self.addCleanup(self.client.close)
+
+    def test_call_and_state_mirror(self):
+        remote = daemon.RemoteMusicManager(self.client)
+        remote.add_song_to_queue('trackA')
+        self.classman.music_manager.add_song_to_queue.assert_called_once_with('trackA')
+        self.assertEqual(remote.queue, ['trackA'])
+        self.assertTrue(remote.paused)
+
+    def test_proxy(self):
+        spotify_client = daemon.RemoteProxy(self.client, 'spotify_client')
+        spotify_client.authenticate()
+        self.assertEqual(spotify_client.get_user_playlists(), [['name', 'id']])
+
+    def test_socket_is_private(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        with patch('daemon._peer_uid', return_value=os.getuid() + 1):
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.addCleanup(connection.close)
+            connection.connect(self.path)
+            connection.settimeout(5)
+            # The daemon closes connections from other users straight away
+            self.assertEqual(connection.recv(1024), b'')
+
+    def test_unexposed_method(self):
+        with self.assertRaises(daemon.DaemonError):
+            self.client.call('music_manager', 'quit')
+        with self.assertRaises(AttributeError):
+            daemon.RemoteProxy(self.client, 'spotify_client').sp
+
+    def test_events_reach_other_clients(self):
+        other = daemon.DaemonClient(self.path)
+        self.addCleanup(other.close)
+        changed = threading.Event()
+        remote = daemon.RemoteMusicManager(other)
+        remote.set_on_song_change(lambda **delta: changed.set())
+
+        self.classman.music_manager.currently_playing = 'trackB'
+        self.music_daemon.broadcast('song-change', {'currently_playing': 'trackB'})
+        self.assertTrue(changed.wait(5))
+        self.assertEqual(remote.currently_playing, 'trackB')
+
+    def test_slow_client_does_not_block_broadcast(self):
+        self.client.close()
+        # A client that never reads fills its socket buffer, then its outgoing queue
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(connection.close)
+        connection.connect(self.path)
+        for _ in range(100):
+            if len(self.music_daemon._clients) == 1:
+                break
+            time.sleep(0.01)
+
+        self.classman.music_manager.queue = ['x' * 22] * 1000
+        start = time.perf_counter()
+        for _ in range(daemon.MAX_OUTGOING * 4):
+            self.music_daemon.broadcast('queue-change')
+        self.assertLess(time.perf_counter() - start, 5)
+        for _ in range(500):
+            if not self.music_daemon._clients:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.music_daemon._clients), 0)
+        # The daemon carries on serving other clients
+        other = daemon.DaemonClient(self.path)
+        self.addCleanup(other.close)
+        self.assertIsNone(other.call('daemon', 'state'))
+
+    def test_quit_only_detaches(self):
+        remote = daemon.RemoteMusicManager(self.client)
+        remote.quit()
+        self.classman.music_manager.quit.assert_not_called()
+        self.assertTrue(daemon.is_daemon_running(self.path))
+
+class TestTieredCache(unittest.TestCase):
+    def test_local_only(self):
+        cache = shared_cache.TieredCache()
+        self.assertFalse(cache.shared)
+        cache.set('metadata', 'a', {'name': 'A'})
+        self.assertEqual(cache.get('metadata', 'a'), {'name': 'A'})
+        self.assertIsNone(cache.get('metadata', 'b'))
+        self.assertEqual(cache.get_many('metadata', ['a', 'b']), {'a': {'name': 'A'}})
+        cache.add_members('downloaded', ['x'])
+        self.assertEqual(cache.members('downloaded'), {'x'})
+
+    def test_writes_batched_into_one_pipeline(self):
+        client = MagicMock()
+        cache = shared_cache.TieredCache(client=client, batch_size=3, flush_delay=60)
+        cache.set('metadata', 'a', {'name': 'A'})
+        cache.set('metadata', 'b', {'name': 'B'})
+        client.pipeline.assert_not_called()
+        cache.add_members('downloaded', ['x'])
+        client.pipeline.assert_called_once_with(transaction=False)
+        pipeline = client.pipeline.return_value
+        self.assertEqual(pipeline.set.call_count, 2)
+        pipeline.sadd.assert_called_once_with('spotdl-tui:downloaded:members', 'x')
+        pipeline.execute.assert_called_once()
+
+    def test_l1_keeps_most_recently_used(self):
+        cache = shared_cache.TieredCache(max_entries=2)
+        cache.set('metadata', 'a', 1)
+        cache.set('metadata', 'b', 2)
+        cache.get('metadata', 'a')
+        cache.set('metadata', 'c', 3)
+        self.assertEqual(cache.get_many('metadata', ['a', 'b', 'c']), {'a': 1, 'c': 3})
+
+    def test_l1_bounded_per_bucket(self):
+        cache = shared_cache.TieredCache(max_entries=2)
+        cache.set('playlist-tracks', 'p', ['a', 'b'])
+        # A burst of metadata writes doesn't evict playlist listings
+        cache.set_many('metadata', {str(i): i for i in range(10)})
+        self.assertEqual(cache.get('playlist-tracks', 'p'), ['a', 'b'])
+        self.assertEqual(cache.get_many('metadata', ['0', '8', '9']), {'8': 8, '9': 9})
+
+    def test_l2_reads_back_off_while_down(self):
+        client = MagicMock()
+        client.get.side_effect = OSError("connection refused")
+        cache = shared_cache.TieredCache(client=client, retry_delay=60)
+        self.assertIsNone(cache.get('metadata', 'a'))
+        self.assertIsNone(cache.get('metadata', 'b'))
+        self.assertEqual(cache.get_many('metadata', ['c']), {})
+        client.get.assert_called_once()
+        client.mget.assert_not_called()
+
+        cache._retry_at = 0.0
+        client.get.side_effect = None
+        client.get.return_value = b'1'
+        self.assertEqual(cache.get('metadata', 'b'), 1)
+
+    def test_failed_flush_is_retried(self):
+        client = MagicMock()
+        pipeline = client.pipeline.return_value
+        pipeline.execute.side_effect = [OSError("connection refused"), [True, True]]
+        cache = shared_cache.TieredCache(client=client, flush_delay=60, retry_delay=60, max_pending=1)
+        self.addCleanup(lambda: cache._flush_timer and cache._flush_timer.cancel())
+        cache.set('metadata', 'a', {'name': 'A'})
+        cache.set('metadata', 'b', {'name': 'B'})
+        cache.flush()
+
+        self.assertEqual(cache.failed_flushes, 1)
+        self.assertEqual(cache.dropped_writes, 1)
+        self.assertEqual(list(cache._pending_values), ['spotdl-tui:metadata:b'])
+
+        cache.flush()
+        pipeline.set.assert_called_with('spotdl-tui:metadata:b', '{"name": "B"}', ex=None)
+        self.assertEqual(cache._pending_values, {})
+
+    def test_l2_miss_fetched_in_one_round_trip(self):
+        client = MagicMock()
+        client.mget.return_value = [b'{"name": "B"}', None]
+        cache = shared_cache.TieredCache(client=client)
+        cache.set('metadata', 'a', {'name': 'A'})
+        found = cache.get_many('metadata', ['a', 'b', 'c'])
+        self.assertEqual(found, {'a': {'name': 'A'}, 'b': {'name': 'B'}})
+        client.mget.assert_called_once_with(['spotdl-tui:metadata:b', 'spotdl-tui:metadata:c'])
+        # b is now in L1
+        self.assertEqual(cache.get('metadata', 'b'), {'name': 'B'})
+        client.get.assert_not_called()
+
+    @unittest.skipUnless(shutil.which('redis-server') and shared_cache.redis, "redis-server not installed")
+    def test_shared_between_stations(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        server = subprocess.Popen(['redis-server', '--port', str(port), '--save', '', '--appendonly', 'no'],
+                                  stdout=subprocess.DEVNULL)
+        self.addCleanup(server.wait)
+        self.addCleanup(server.terminate)
+        url = f'redis://127.0.0.1:{port}/0'
+        for _ in range(100):
+            try:
+                shared_cache.redis.Redis.from_url(url).ping()
+                break
+            except shared_cache.redis.ConnectionError:
+                time.sleep(0.05)
+
+        namespace = f'test-{os.getpid()}'
+        station_a = shared_cache.TieredCache(url, namespace=namespace)
+        station_b = shared_cache.TieredCache(url, namespace=namespace)
+        station_a.set('metadata', 'a', {'name': 'A'})
+        station_a.add_members('downloaded', ['a'])
+        station_a.flush()
+        self.assertEqual(station_b.get('metadata', 'a'), {'name': 'A'})
+        self.assertEqual(station_b.members('downloaded'), {'a'})
+
+class TestUIEventBus(unittest.TestCase):
+    def setUp(self):
+        self.app = MagicMock()
+        self.app._thread_id = threading.get_ident()
+        self.bus = ui_events.UIEventBus(self.app)
+        self.deltas = []
+        self.bus.subscribe('queue-change', self.deltas.append)
+
+    def test_burst_coalesced(self):
+        self.bus.publish('queue-change', ops=[('append', ['a', 'b'])])
+        self.bus.publish('queue-change', ops=[('pop', 1)])
+        self.bus.publish('song-change', currently_playing='a')
+        self.bus.publish('song-change', currently_playing='b')
+        self.app.set_timer.assert_called_once()
+        self.bus.flush()
+        self.assertEqual(self.deltas, [{'ops': [('append', ['a', 'b']), ('pop', 1)]}])
+
+        self.bus.publish('queue-change', ops=[('reset',)])
+        self.assertEqual(self.app.set_timer.call_count, 2)
+
+    def test_handed_to_app_thread(self):
+        app = App()
+        bus = ui_events.UIEventBus(app, frame_time=0.01)
+        calls = []
+        bus.subscribe('song-change', lambda delta: calls.append((threading.get_ident(), delta)))
+
+        async def run():
+            async with app.run_test() as pilot:
+                def publish():
+                    for track in ('a', 'b', 'c'):
+                        bus.publish('song-change', currently_playing=track)
+                publisher = threading.Thread(target=publish)
+                publisher.start()
+                await asyncio.get_running_loop().run_in_executor(None, publisher.join)
+                await pilot.pause(0.1)
+                return app._thread_id
+
+        app_thread_id = asyncio.run(run())
+        self.assertEqual(calls, [(app_thread_id, {'currently_playing': 'c'})])
+
+class TestSongMetadataFile(unittest.TestCase):
+    def test_read_cached_until_file_changes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metadata.pkl')
+            metadata_file = song_metadata.SongMetadataFile(path)
+            metadata_file.add_metadata(('a', {'name': 'A'}))
+            with patch('song_metadata.pickle.load') as mock_load:
+                self.assertEqual(metadata_file.get_metadata('a'), {'name': 'A'})
+                mock_load.assert_not_called()
+
+            other = song_metadata.SongMetadataFile(path)
+            other.add_metadata(('b', {'name': 'B'}))
+            os.utime(path, ns=(0, 0))
+            self.assertEqual(metadata_file.get_metadata('b'), {'name': 'B'})
+
+    def test_update_metadata_merges(self):
+        with tempfile.TemporaryDirectory() as directory:
+            metadata_file = song_metadata.SongMetadataFile(os.path.join(directory, 'metadata.pkl'))
+            self.assertFalse(metadata_file.update_metadata('a', {'duration': 1.0}))
+            metadata_file.add_metadata(('a', {'name': 'A'}))
+            self.assertTrue(metadata_file.update_metadata('a', {'duration': 1.0}))
+            # Downloading the metadata again keeps the post-processing results
+            metadata_file.add_metadata(('a', {'name': 'A2'}))
+            self.assertEqual(metadata_file.get_metadata('a'), {'name': 'A2', 'duration': 1.0})
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.tracer = tracing.Tracer()
+
+    def test_disabled_records_nothing(self):
+        with self.tracer.span('x'):
+            pass
+        self.assertEqual(self.tracer.traced()(lambda: 5)(), 5)
+        self.assertEqual(len(self.tracer._events), 0)
+
+    def test_spans_exported_as_chrome_trace(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.json')
+            self.tracer.enable(path, profile=True, interval=0.001)
+            self.addCleanup(atexit.unregister, self.tracer.export)
+
+            @self.tracer.traced('work', 'test')
+            def work():
+                time.sleep(0.02)
+            work()
+            with self.assertRaises(ValueError):
+                with self.tracer.span('failing', track='t'):
+                    raise ValueError()
+            self.tracer.export()
+
+            with open(path, encoding='utf-8') as file:
+                trace = json.load(file)
+
+        events = {event['name']: event for event in trace['traceEvents']}
+        self.assertEqual(events['work']['ph'], 'X')
+        self.assertEqual(events['work']['cat'], 'test')
+        self.assertGreaterEqual(events['work']['dur'], 20000)
+        self.assertEqual(events['failing']['args'], {'track': 't', 'error': 'ValueError'})
+        self.assertIn('thread_name', events)
+        self.assertGreater(len(trace['samples']), 0)
+        self.assertIn(str(trace['samples'][0]['sf']), trace['stackFrames'])
+
+    def test_traced_coroutine_spans_until_done(self):
+        self.tracer.enabled = True
+
+        @self.tracer.traced('command')
+        def command():
+            async def run():
+                await asyncio.sleep(0.02)
+                return 5
+            return run()
+
+        self.assertEqual(asyncio.run(command()), 5)
+        events = list(self.tracer._events)
+        self.assertEqual([event['name'] for event in events], ['command'])
+        self.assertGreaterEqual(events[0]['dur'], 20000)
+
+    def test_keeps_only_recent_events(self):
+        tracer = tracing.Tracer(max_events=3)
+        tracer.enabled = True
+        for index in range(5):
+            with tracer.span(f'span{index}'):
+                pass
+        self.assertEqual([event['name'] for event in tracer._events], ['span2', 'span3', 'span4'])
+
+class TestTrackStore(unittest.TestCase):
+    def test_track_is_compact(self):
+        t = track.Track('id', 'Name', 'Artist', 'Album')
+        self.assertFalse(hasattr(t, '__dict__'))
+
+    def test_records_shared_and_strings_interned(self):
+        store = track.TrackStore()
+        rows = json.loads('[["A", "Same Artist", "t1"], ["B", "Same Artist", "t2"]]')
+        first = store.from_rows(rows)
+        again = store.from_rows(json.loads('[["A", "Same Artist", "t1"]]'))
+        self.assertIs(first[0], again[0])
+        self.assertIs(first[0].artists, first[1].artists)
+        self.assertEqual(len(store), 2)
+
+    def test_store_retains_less_than_row_copies(self):
+        data = json.dumps([[f'Song {i}', f'Artist {i % 300}', f'{i:022d}'] for i in range(20000)])
+
+        def retained(build) -> int:
+            was_tracing = tracemalloc.is_tracing()
+            if not was_tracing:
+                tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                kept = build()
+                size = tracemalloc.get_traced_memory()[0] - before
+                del kept
+                return size
+            finally:
+                if not was_tracing:
+                    tracemalloc.stop()
+
+        def rows_and_table_copy():
+            # What PlaylistView kept before: the parsed rows and a ['▶'] + row copy of each
+            rows = json.loads(data)
+            return rows, [['▶'] + row for row in rows]
+
+        def shared_tracks():
+            store = track.TrackStore()
+            return store, store.from_rows(json.loads(data))
+
+        self.assertLess(retained(shared_tracks), retained(rows_and_table_copy) * 0.8)
+
+    def test_from_metadata_fills_album(self):
+        store = track.TrackStore()
+        store.from_rows([['A', 'Artist', 't1']])
+        t = store.from_metadata({'id': 't1', 'name': 'A', 'artist-name': 'Artist', 'album-name': 'Album'})
+        self.assertEqual(t.album, 'Album')
+        self.assertIs(store.get('t1'), t)
+
+class TestQueueView(unittest.TestCase):
+    def test_track_without_metadata_shown_by_id(self):
+        classman = MagicMock()
+        classman.tracks = track.TrackStore()
+        classman.tracks.add('t1', 'Known', 'Artist')
+        classman.song_metadata_file.get_many.return_value = {}
+        classman.spotify_client.download_song_metadata.return_value = None
+
+        rows = main.Queue(classman).parse_queue(['t1', 'gone'])
+
+        self.assertEqual(rows, [('Known',), ('gone',)])
+        classman.song_metadata_file.add_metadata.assert_not_called()
+
+    def test_insert_op(self):
+        classman = MagicMock()
+        classman.tracks = track.TrackStore()
+        classman.tracks.add('a', 'A', 'Artist')
+        classman.tracks.add('c', 'C', 'Artist')
+        classman.song_metadata_file.get_many.return_value = {
+            'b': {'id': 'b', 'name': 'B', 'artist-name': 'Artist', 'album-name': 'Album'}}
+
+        async def run():
+            async with App().run_test():
+                view = main.Queue(classman)
+                view.table.add_columns('Song')
+                view.on_queue_change({'ops': [('append', ['a', 'c'])]})
+                view.on_queue_change({'ops': [('insert', 1, ['b'])]})
+                keyed = [view.table.get_row(row_key) for row_key in view._row_keys]
+                return keyed, [view.table.get_row_at(index) for index in range(view.table.row_count)]
+
+        keyed, shown = asyncio.run(run())
+        self.assertEqual(keyed, [['A'], ['B'], ['C']])
+        self.assertEqual(shown, keyed)
+        # Only the inserted song is looked up
+        classman.song_metadata_file.get_many.assert_called_once_with(['b'])
+
+class TestPlaylistView(unittest.TestCase):
+    TRACKS = 5000
+
+    def warm_classman(self, cached: bool):
+        """Returns a classman whose SpotifyClient has fetched a playlist, as the warmer does."""
+        classman = MagicMock()
+        classman.tracks = track.TrackStore()
+        client = spotify.SpotifyClient()
+        client.sp = MagicMock()
+        client.tracks = classman.tracks
+        client.shared_cache = shared_cache.TieredCache() if cached else None
+        client.sp.current_user_playlists.return_value = {
+            'items': [{'name': 'P', 'id': 'p1', 'snapshot_id': 's1'}], 'next': None}
+        client.sp.playlist_items.side_effect = lambda *args: {'items': [
+            {'track': {'name': f'Song {i}', 'id': f'{i:022d}', 'artists': [{'name': f'Artist {i % 300}', 'id': 'a'}],
+                       'album': {'name': f'Album {i % 500}', 'id': 'b'}}}
+            for i in range(self.TRACKS)], 'next': None}
+        client.sp.playlist.return_value = {'name': 'P'}
+        classman.spotify_client = client
+        client.get_user_playlists()
+        client.get_playlist_items('https://open.spotify.com/playlist/p1')
+        return classman
+
+    def test_compose_uses_cached_listing_and_shared_tracks(self):
+        def retained(cached: bool) -> tuple[int, tuple]:
+            gc.collect()
+            before = tracemalloc.get_traced_memory()[0]
+            classman = self.warm_classman(cached)
+            view = main.PlaylistView(classman, 'p1')
+            widgets = list(view.compose())
+            gc.collect()
+            return tracemalloc.get_traced_memory()[0] - before, (classman, view, widgets)
+
+        async def run():
+            async with App().run_test():
+                was_tracing = tracemalloc.is_tracing()
+                if not was_tracing:
+                    tracemalloc.start()
+                try:
+                    # The first compose fills Textual's own caches
+                    retained(True)
+                    uncached, _ = retained(False)
+                    cached, kept = retained(True)
+                finally:
+                    if not was_tracing:
+                        tracemalloc.stop()
+                return uncached, cached, kept
+
+        uncached, cached, (classman, view, _) = asyncio.run(run())
+        client = classman.spotify_client
+        client.sp.playlist_items.assert_called_once()
+        self.assertEqual(client.shared_cache.get('playlist-tracks', 'p1:s1')[:1], ['0' * 22])
+        self.assertIs(view.playlist_tracks[0], classman.tracks.get('0' * 22))
+        # Caching the listing costs about a pointer per track, not a copy of each row
+        self.assertLess((cached - uncached) / self.TRACKS, 32)
+
+    def test_listing_filled_from_cached_metadata(self):
+        client = spotify.SpotifyClient()
+        client.sp = MagicMock()
+        client.shared_cache = shared_cache.TieredCache()
+        client._snapshot_ids['p1'] = 's1'
+        # Another station fetched the playlist and its metadata
+        client.shared_cache.set('playlist-tracks', 'p1:s1', ['t1'])
+        client.shared_cache.set('metadata', 't1', {'name': 'T', 'artist-name': 'A', 'album-name': 'B'})
+        self.assertEqual(client.get_playlist_tracks('https://open.spotify.com/playlist/p1'), [['T', 'A', 't1']])
+        client.sp.playlist_items.assert_not_called()
+
+class TestAdaptiveDownloadController(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.controller = download_controller.AdaptiveDownloadController(
+            max_workers=4, rate_step=100, min_rate=10, clock=lambda: self.now)
+
+    def download(self, seconds, size=1000, succeeded=True, priority=False):
+        slot = self.controller.start(priority)
+        self.now += seconds
+        slot.finish(succeeded, size)
+        return slot
+
+    def test_additive_increase(self):
+        self.download(1)
+        self.assertEqual(self.controller.workers, 2)
+        self.download(1)
+        self.download(1)
+        self.assertEqual(self.controller.workers, 3)
+        self.assertIsNone(self.controller.rate_cap)
+
+    def test_multiplicative_decrease_on_slow_download(self):
+        for _ in range(6):
+            self.download(1)
+        self.assertEqual(self.controller.workers, 4)
+        # Throughput dropped to a quarter of the best
+        self.download(4)
+        self.assertEqual(self.controller.workers, 2)
+        self.assertEqual(self.controller.rate_cap, 125)
+        self.assertEqual(self.controller.start().rate_limit, 62)
+
+    def test_decrease_on_error_rate(self):
+        for _ in range(3):
+            self.download(1)
+        self.assertEqual(self.controller.workers, 3)
+        self.download(1, succeeded=False)
+        self.assertEqual(self.controller.workers, 3)
+        self.download(1, succeeded=False)
+        self.assertEqual(self.controller.workers, 1)
+
+    def test_steady_link_converges_upward(self):
+        link = 4 * 1024 * 1024
+        controller = download_controller.AdaptiveDownloadController(clock=lambda: self.now)
+
+        def run_rounds(rounds: int):
+            for _ in range(rounds):
+                # Every free worker shares the link, each up to its own rate limit
+                slots = [controller.start() for _ in range(controller.free_slots())]
+                rate = min(link / len(slots), slots[0].rate_limit or link)
+                self.now += 4 * 1024 * 1024 / rate
+                for slot in slots:
+                    slot.finish(True, 4 * 1024 * 1024)
+
+        run_rounds(40)
+        self.assertEqual(controller.workers, controller.max_workers)
+        self.assertIsNone(controller.rate_cap)
+
+        # After backing off (e.g. a brief outage) the workers and cap climb back
+        controller.workers = 1
+        controller.rate_cap = controller.min_rate
+        run_rounds(40)
+        self.assertEqual(controller.workers, controller.max_workers)
+        self.assertGreater(controller.rate_cap, controller.min_rate * 10)
+
+    def test_concurrent_downloads_sharing_link_not_congested(self):
+        for _ in range(6):
+            self.download(1)
+        self.assertEqual(self.controller.workers, 4)
+        # Three downloads each get a third of the link, the aggregate hasn't dropped
+        slots = [self.controller.start() for _ in range(3)]
+        self.now += 3
+        for slot in slots:
+            slot.finish(True, 1000)
+        self.assertEqual(self.controller.workers, 4)
+        self.assertIsNone(self.controller.rate_cap)
+
+    def test_download_at_its_rate_limit_not_congested(self):
+        for _ in range(6):
+            self.download(1)
+        self.controller.rate_cap = 100
+        slot = self.controller.start()
+        self.assertEqual(slot.rate_limit, 25)
+        self.now += 40
+        slot.finish(True, 1000)
+        self.assertEqual(self.controller.workers, 4)
+        self.assertEqual(self.controller.rate_cap, 100)
+
+    def test_worker_limit_and_priority_headroom(self):
+        slot = self.controller.start()
+        self.assertIsNotNone(slot)
+        self.assertIsNone(self.controller.start())
+        priority = self.controller.start(priority=True)
+        self.assertIsNotNone(priority)
+        self.assertIsNone(priority.rate_limit)
+        slot.cancel()
+        self.assertEqual(self.controller.free_slots(), 1)
+        self.assertEqual(self.controller.workers, 1)
+
 class TestPlayer(unittest.TestCase):
     @patch('player.pygame.mixer')
     def test_load_song(self, mock_mixer):
@@ -112,6 +1448,14 @@ class TestPlayer(unittest.TestCase):
         mock_mixer.music.load.assert_called()
         mock_mixer.music.play.assert_called()
 
+    @patch('player.pygame.mixer')
+    def test_load_song_from_memory(self, mock_mixer):
+        p = player.MusicPlayer()
+        p.load_song('path/to/song.mp3', b'audio')
+        file, namehint = mock_mixer.music.load.call_args.args
+        self.assertEqual(file.read(), b'audio')
+        self.assertEqual(namehint, 'mp3')
+
     @patch('player.pygame.mixer')
     def test_play_pause_stop(self, mock_mixer):
         p = player.MusicPlayer()
@@ -138,6 +1482,40 @@ class TestSpotifyClient(unittest.TestCase):
         playlists = client.get_user_playlists()
         self.assertIsInstance(playlists, list)
 
+    def test_playlist_tracks_cached_by_snapshot(self):
+        client = spotify.SpotifyClient()
+        client.sp = MagicMock()
+        client.shared_cache = shared_cache.TieredCache()
+        client.sp.current_user_playlists.return_value = {
+            'items': [{'name': 'P', 'id': 'p1', 'snapshot_id': 's1'}], 'next': None}
+        client.sp.playlist_items.return_value = {
+            'items': [{'track': {'name': 'T', 'id': 't1', 'artists': [{'name': 'A', 'id': 'a1'}],
+                                 'album': {'name': 'B', 'id': 'b1'}}}], 'next': None}
+
+        client.get_user_playlists()
+        url = 'https://open.spotify.com/playlist/p1'
+        self.assertEqual(client.get_playlist_tracks(url), [['T', 'A', 't1']])
+        self.assertEqual(client.get_playlist_tracks(url), [['T', 'A', 't1']])
+        client.sp.playlist_items.assert_called_once()
+
+        # A new snapshot means the playlist was edited
+        client.sp.current_user_playlists.return_value['items'][0]['snapshot_id'] = 's2'
+        client.get_user_playlists()
+        client.get_playlist_tracks(url)
+        self.assertEqual(client.sp.playlist_items.call_count, 2)
+
+    def test_song_metadata_has_cover(self):
+        client = spotify.SpotifyClient()
+        client.sp = MagicMock()
+        client.sp.track.return_value = {
+            'name': 'T', 'id': 't1', 'artists': [{'name': 'A', 'id': 'a1'}], 'external_ids': {'isrc': 'I'},
+            'album': {'name': 'B', 'id': 'b1', 'images': [{'url': 'large', 'width': 640}, {'url': 'small', 'width': 64}]}
+        }
+        metadata = client.download_song_metadata('t1')
+        self.assertEqual(metadata['album-id'], 'b1')
+        self.assertEqual(metadata['album-cover-url'], 'small')
+        self.assertEqual(metadata['album-art-url'], 'large')
+
     def test_extract_playlist_id(self):
         client = spotify.SpotifyClient()
         url = 'https://open.spotify.com/playlist/12345abcde'
@@ -192,5 +1570,27 @@ class TestClassManager(unittest.TestCase):
         self.assertTrue(mock_sc_instance.authenticate.called)
 
 
+class TestSoak(unittest.TestCase):
+    def test_short_soak_stays_within_budget(self):
+        budget = soak.SoakBudget(rss_mb=256, traced_mb=64, threads=8, fds=32)
+        report = soak.run_soak(iterations=40, warmup=10, sample_every=10, budget=budget)
+
+        self.assertTrue(report.passed, report.format())
+        self.assertGreaterEqual(len(report.samples), 4)
+        self.assertGreater(report.downloads, 0)
+        self.assertGreater(report.requests, 0)
+
+    def test_budget_reports_growth(self):
+        budget = soak.SoakBudget(rss_mb=1, traced_mb=1, threads=1, fds=1)
+        baseline = {'rss': 0, 'traced': 0, 'threads': 3, 'fds': 10}
+        final = {'rss': 2 * 1024 * 1024, 'traced': 0, 'threads': 6, 'fds': None}
+
+        failures = budget.check(baseline, final)
+
+        self.assertEqual(len(failures), 2)
+        self.assertIn('RSS', failures[0])
+        self.assertIn('Threads', failures[1])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,200 @@
+"""Caches album covers as small pre-rendered terminal images.
+
+Covers are downloaded once per album, downscaled to the size they are shown at
+(one pixel per half cell) and stored as PNGs in cache/thumbnails. Rendered
+images are kept in memory, so showing a cover never touches the disk or the
+network on the UI thread.
+
+Pillow is optional. Without it no covers are shown.
+"""
+import logging
+import os
+import threading
+
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import requests
+from rich.text import Text
+
+from tracing import span
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def render_half_blocks(image) -> Text:
+    """Renders an RGB image as rows of '▀', using the foreground colour for the
+    top pixel and the background colour for the bottom pixel of each cell.
+
+    Args:
+        image (PIL.Image.Image): Image with an even height.
+
+    Returns:
+        Text: One line per two rows of pixels.
+    """
+    width, height = image.size
+    pixels = image.load()
+    text = Text(no_wrap=True, overflow='crop')
+    for y in range(0, height - 1, 2):
+        if y:
+            text.append('\n')
+        for x in range(width):
+            top = pixels[x, y]
+            bottom = pixels[x, y + 1]
+            text.append('▀', f'rgb({top[0]},{top[1]},{top[2]}) on rgb({bottom[0]},{bottom[1]},{bottom[2]})')
+    return text
+
+
+class ThumbnailCache():
+    """Album covers by album ID, rendered for the terminal.
+
+    Rendered covers are kept in an in-memory LRU of max_entries. The PNGs on disk
+    are evicted least recently used first when they exceed max_bytes.
+    """
+    def __init__(
+        self,
+        directory: str = 'cache/thumbnails',
+        size: tuple[int, int] = (6, 3),
+        max_entries: int = 256,
+        max_bytes: int = 16 * 1024 * 1024,
+        max_workers: int = 2,
+        logger: logging.Logger | None = None
+        ):
+        """Initialises the ThumbnailCache.
+
+        Args:
+            directory (str, optional): Where to store thumbnails. Defaults to 'cache/thumbnails'.
+            size (tuple[int, int], optional): Size of a cover in terminal cells (columns, rows). Defaults to (6, 3).
+            max_entries (int, optional): Rendered covers kept in memory. Defaults to 256.
+            max_bytes (int, optional): Size cap of the thumbnails on disk. Defaults to 16 MiB.
+            max_workers (int, optional): Covers fetched at once. Defaults to 2.
+        """
+        self.directory = directory
+        self.size = size
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+        self._rendered: OrderedDict[str, Text] = OrderedDict()
+        self._loading: set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='thumbnails')
+
+        # Called with an album ID from a worker thread once its cover can be shown
+        self.on_loaded: Callable[[str], None] | None = None
+
+    @property
+    def available(self) -> bool:
+        """False if Pillow isn't installed."""
+        return Image is not None
+
+    def path(self, album_id: str) -> str:
+        return os.path.join(self.directory, f'{album_id}.png')
+
+    def get(self, album_id: str | None) -> Text | None:
+        """Returns a rendered cover if it is in memory. Never blocks, so it is safe
+        to call on the UI thread; use request() to load missing covers.
+        """
+        if album_id is None:
+            return None
+        with self._lock:
+            text = self._rendered.get(album_id)
+            if text is not None:
+                self._rendered.move_to_end(album_id)
+            return text
+
+    def request(self, album_id: str | None, url: str | None):
+        """Loads a cover in the background from disk, or from url if it isn't
+        cached, then calls on_loaded.
+
+        Args:
+            album_id (str | None): Spotify album ID.
+            url (str | None): URL of the cover image, from the song metadata.
+        """
+        if not self.available or album_id is None:
+            return
+        with self._lock:
+            if album_id in self._rendered or album_id in self._loading:
+                return
+            self._loading.add(album_id)
+        self._executor.submit(self._load, album_id, url)
+
+    def prefetch(self, metadata: list[dict]):
+        """Loads the covers of songs that will play soon.
+
+        Args:
+            metadata (list[dict]): Song metadata with 'album-id' and 'album-cover-url'.
+        """
+        for song in metadata:
+            self.request(song.get('album-id'), song.get('album-cover-url'))
+
+    def _load(self, album_id: str, url: str | None):
+        try:
+            with span('load thumbnail', 'thumbnails', album=album_id):
+                image = self._read(album_id)
+                if image is None and url is not None:
+                    image = self._download(album_id, url)
+                if image is None:
+                    return
+                text = render_half_blocks(image)
+            with self._lock:
+                self._rendered[album_id] = text
+                while len(self._rendered) > self.max_entries:
+                    self._rendered.popitem(last=False)
+        except Exception as e:
+            self.logger.warning("Could not load cover for %s: %s", album_id, e)
+            return
+        finally:
+            with self._lock:
+                self._loading.discard(album_id)
+
+        if self.on_loaded is not None:
+            self.on_loaded(album_id)
+
+    def _read(self, album_id: str):
+        path = self.path(album_id)
+        try:
+            with Image.open(path) as image:
+                image = image.convert('RGB')
+            # Mark as recently used for eviction
+            os.utime(path)
+            return image
+        except (OSError, ValueError):
+            return None
+
+    def _download(self, album_id: str, url: str):
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+        with Image.open(BytesIO(response.content)) as image:
+            columns, rows = self.size
+            image = image.convert('RGB').resize((columns, rows * 2), Image.LANCZOS)
+
+        os.makedirs(self.directory, exist_ok=True)
+        image.save(self.path(album_id), format='PNG', optimize=True)
+        self._evict()
+        return image
+
+    def _evict(self):
+        """Deletes the least recently used thumbnails until they fit in max_bytes."""
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.png')]
+        except OSError:
+            return
+        stats = sorted(((entry.stat(), entry.path) for entry in entries), key=lambda item: item[0].st_mtime)
+        total = sum(stat.st_size for stat, _ in stats)
+        for stat, path in stats:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= stat.st_size
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
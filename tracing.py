@@ -0,0 +1,250 @@
+"""Opt-in tracing and sampling profiling, exported as a Chrome trace.
+
+Tracing is off by default and spans cost almost nothing while it is off. Turn it
+on with the SPOTDL_TUI_TRACE environment variable or the --trace flag of main.py
+and daemon.py, giving the path to write the trace to when the program exits:
+
+    SPOTDL_TUI_TRACE=trace.json python main.py
+    python main.py --trace trace.json --profile
+
+The file can be opened in chrome://tracing or https://ui.perfetto.dev. With
+profiling on (SPOTDL_TUI_PROFILE=1 or --profile), the stacks of every thread are
+sampled and included in the same file. Only the most recent events and samples
+are kept, so tracing a long session uses bounded memory.
+"""
+import atexit
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+
+from collections import deque
+from contextlib import nullcontext
+
+TRACE_PATH = os.getenv('SPOTDL_TUI_TRACE')
+PROFILE = os.getenv('SPOTDL_TUI_PROFILE', '') not in ('', '0')
+
+_NULL_SPAN = nullcontext()
+
+
+class _Span():
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer: 'Tracer', name: str, category: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record({
+            'name': self.name,
+            'cat':  self.category,
+            'ph':   'X',
+            'ts':   self.tracer.timestamp(self.start),
+            'dur':  (end - self.start) / 1000,
+            'args': self.args
+        })
+        return False
+
+
+class Tracer():
+    """Records timed spans in Chrome trace event format, keeping the last max_events."""
+    def __init__(self, max_events: int = 500_000):
+        self.enabled = False
+        self.path: str | None = None
+        self.profiler: SamplingProfiler | None = None
+
+        self._events: deque[dict] = deque(maxlen=max_events)
+        self._thread_names: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+        self._pid = os.getpid()
+
+    def enable(self, path: str, profile: bool = False, interval: float = 0.005):
+        """Starts recording, and writes the trace to path when the program exits.
+
+        Args:
+            path (str): Where to write the Chrome trace JSON.
+            profile (bool, optional): Also sample the stacks of all threads. Defaults to False.
+            interval (float, optional): Seconds between stack samples. Defaults to 0.005.
+        """
+        if self.enabled:
+            return
+        self.enabled = True
+        self.path = path
+        if profile:
+            self.profiler = SamplingProfiler(self, interval)
+            self.profiler.start()
+        atexit.register(self.export)
+
+    def timestamp(self, perf_counter_ns: int) -> float:
+        """Converts a time.perf_counter_ns() value to trace microseconds."""
+        return (perf_counter_ns - self._origin) / 1000
+
+    def record(self, event: dict):
+        """Adds a raw trace event, filling in the process and thread."""
+        thread = threading.current_thread()
+        event['pid'] = self._pid
+        event['tid'] = thread.ident
+        with self._lock:
+            self._thread_names.setdefault(thread.ident, thread.name)
+            self._events.append(event)
+
+    def span(self, name: str, category: str = 'app', **args):
+        """Returns a context manager that records how long its block takes.
+
+        Args:
+            name (str): Name shown in the trace, e.g. 'spotdl'.
+            category (str, optional): Category, e.g. 'download' or 'spotify'. Defaults to 'app'.
+            **args: Extra details to show with the span.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def traced(self, name: str | None = None, category: str = 'app'):
+        """Decorator that records a span around every call of a function. If the call
+        returns a coroutine (e.g. a MusicManager method called on its actor thread),
+        the span ends when the coroutine finishes rather than when it is created.
+
+        Args:
+            name (str | None, optional): Span name. Defaults to the function's qualified name.
+            category (str, optional): Span category. Defaults to 'app'.
+        """
+        def decorator(function):
+            span_name = name if name is not None else function.__qualname__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                span = _Span(self, span_name, category, {}).__enter__()
+                try:
+                    result = function(*args, **kwargs)
+                except BaseException as e:
+                    span.__exit__(type(e), e, e.__traceback__)
+                    raise
+                if inspect.iscoroutine(result):
+                    return self._traced_coroutine(span, result)
+                span.__exit__(None, None, None)
+                return result
+            return wrapper
+        return decorator
+
+    @staticmethod
+    async def _traced_coroutine(span: _Span, coroutine):
+        try:
+            result = await coroutine
+        except BaseException as e:
+            span.__exit__(type(e), e, e.__traceback__)
+            raise
+        span.__exit__(None, None, None)
+        return result
+
+    def export(self, path: str | None = None):
+        """Writes everything recorded so far as a Chrome trace JSON file.
+
+        Args:
+            path (str | None, optional): Defaults to the path given to enable().
+        """
+        path = path if path is not None else self.path
+        if path is None:
+            return
+        if self.profiler is not None:
+            self.profiler.stop()
+
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+        events.extend({
+            'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': thread_name}
+        } for tid, thread_name in thread_names.items())
+
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if self.profiler is not None:
+            trace['stackFrames'], trace['samples'] = self.profiler.export()
+
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(trace, file)
+
+
+class SamplingProfiler():
+    """Periodically samples the Python stack of every thread.
+
+    Stacks are stored as a tree of frames, in the stackFrames/samples format that
+    Chrome trace viewers show as a flame chart per thread. Only the last
+    max_samples samples are kept.
+    """
+    def __init__(self, tracer: Tracer, interval: float = 0.005, max_samples: int = 500_000):
+        self.tracer = tracer
+        self.interval = interval
+
+        self._frames: dict[tuple[int | None, str], int] = {}
+        self._samples: deque[dict] = deque(maxlen=max_samples)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _frame_id(self, parent: int | None, name: str) -> int:
+        key = (parent, name)
+        frame_id = self._frames.get(key)
+        if frame_id is None:
+            frame_id = len(self._frames)
+            self._frames[key] = frame_id
+        return frame_id
+
+    def sample(self):
+        """Records the current stack of every thread except the profiler's own."""
+        timestamp = self.tracer.timestamp(time.perf_counter_ns())
+        for tid, frame in sys._current_frames().items():
+            if tid == self._thread.ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+
+            frame_id = None
+            for name in reversed(stack):
+                frame_id = self._frame_id(frame_id, name)
+            self._samples.append({
+                'cpu': 0, 'tid': tid, 'ts': timestamp, 'name': 'sample', 'sf': frame_id, 'weight': 1
+            })
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def export(self) -> tuple[dict[str, dict], list[dict]]:
+        """Returns the stackFrames and samples sections of a Chrome trace."""
+        stack_frames = {}
+        for (parent, name), frame_id in self._frames.items():
+            stack_frames[str(frame_id)] = {'name': name, 'category': 'python'}
+            if parent is not None:
+                stack_frames[str(frame_id)]['parent'] = str(parent)
+        return stack_frames, list(self._samples)
+
+
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced
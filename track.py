@@ -0,0 +1,61 @@
+"""Provides Track, a compact record of a track shared by every view, and TrackStore."""
+import sys
+
+
+class Track():
+    """The details of a track that the views display.
+
+    Uses __slots__ so each track costs one small object instead of a list plus a
+    dict, and interns artist and album names because they repeat across tracks.
+    """
+    __slots__ = ('id', 'name', 'artists', 'album')
+
+    def __init__(self, track_id: str, name: str, artists: str, album: str = ''):
+        self.id = track_id
+        self.name = name
+        self.artists = sys.intern(artists)
+        self.album = sys.intern(album)
+
+    def __repr__(self) -> str:
+        return f'Track({self.id!r}, {self.name!r}, {self.artists!r}, {self.album!r})'
+
+
+class TrackStore():
+    """Holds one Track per track ID, so playlists and the queue reference the same
+    records instead of keeping their own copies.
+    """
+    def __init__(self):
+        self._tracks: dict[str, Track] = {}
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def get(self, track_id: str) -> Track | None:
+        return self._tracks.get(track_id)
+
+    def add(self, track_id: str, name: str, artists: str, album: str = '') -> Track:
+        """Returns the Track for track_id, creating it if needed.
+
+        Args:
+            track_id (str): Spotify track ID.
+            name (str): Track name.
+            artists (str): Artist names, comma separated.
+            album (str, optional): Album name. Defaults to ''.
+        """
+        track = self._tracks.get(track_id)
+        if track is None:
+            track = Track(track_id, name, artists, album)
+            self._tracks[track.id] = track
+        elif album and not track.album:
+            track.album = sys.intern(album)
+        return track
+
+    def from_rows(self, rows: list[list[str]]) -> list[Track]:
+        """Returns the Tracks for rows of [name, artists, id], as returned by
+        SpotifyClient.get_playlist_tracks.
+        """
+        return [self.add(row[2], row[0], row[1]) for row in rows]
+
+    def from_metadata(self, metadata: dict[str, str]) -> Track:
+        """Returns the Track for metadata from SpotifyClient.download_song_metadata."""
+        return self.add(metadata['id'], metadata['name'], metadata['artist-name'], metadata['album-name'])
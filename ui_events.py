@@ -0,0 +1,89 @@
+"""Provides UIEventBus, which hands player and queue events to the Textual app thread."""
+import threading
+
+from collections.abc import Callable
+
+from textual.app import App
+
+
+class UIEventBus():
+    """Collects events published from any thread and delivers them on the app thread.
+
+    Events published within the same frame are coalesced, so a burst such as a skip
+    (which used to redraw three times) results in one call per event per frame.
+    Each event carries a delta dict. When deltas are merged, list values (such as
+    queue edits) are concatenated in order and other values are replaced by the
+    newest one.
+    """
+    def __init__(self, app: App, frame_time: float = 1 / 30):
+        """Initialises the UIEventBus.
+
+        Args:
+            app (App): The app whose thread handlers are called on.
+            frame_time (float, optional): Seconds to collect events for before delivering them. Defaults to 1/30.
+        """
+        self.app = app
+        self.frame_time = frame_time
+
+        self._handlers: dict[str, list[Callable[[dict], None]]] = {}
+        self._pending: dict[str, dict] = {}
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def subscribe(self, event: str, handler: Callable[[dict], None]):
+        """Calls handler with the merged delta each frame in which event was published.
+
+        Args:
+            event (str): Name of the event, e.g. 'song-change'.
+            handler (Callable[[dict], None]): Called on the app thread.
+        """
+        self._handlers.setdefault(event, []).append(handler)
+
+    def unsubscribe(self, event: str, handler: Callable[[dict], None]):
+        """Stops calling a handler added with subscribe, e.g. when its widget is removed."""
+        handlers = self._handlers.get(event, [])
+        if handler in handlers:
+            handlers.remove(handler)
+
+    def publish(self, event: str, **delta):
+        """Queues an event to be delivered on the next frame. Safe to call from any thread.
+
+        Args:
+            event (str): Name of the event.
+            **delta: What changed.
+        """
+        with self._lock:
+            pending = self._pending.setdefault(event, {})
+            for key, value in delta.items():
+                if isinstance(value, list) and isinstance(pending.get(key), list):
+                    pending[key] = pending[key] + value
+                else:
+                    pending[key] = value
+
+            if self._scheduled:
+                return
+            self._scheduled = True
+
+        try:
+            if getattr(self.app, '_thread_id', None) == threading.get_ident():
+                self.app.set_timer(self.frame_time, self.flush)
+                return
+            # Unlike call_from_thread this doesn't wait for the app thread, which
+            # may itself be waiting on the thread publishing the event
+            if self.app.is_running and self.app.call_later(self.app.set_timer, self.frame_time, self.flush):
+                return
+        except RuntimeError:
+            pass
+        # The app isn't running, so deliver with the next event instead
+        with self._lock:
+            self._scheduled = False
+
+    def flush(self):
+        """Delivers all pending events. Must be called on the app thread."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._scheduled = False
+
+        for event, delta in pending.items():
+            for handler in self._handlers.get(event, []):
+                handler(delta)